@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# 模拟 yt-dlp 的命令行行为，供基准测试离线使用，不访问网络
+# 通过环境变量控制输出规模和速度：
+#   FAKE_YTDLP_FORMATS           -J 结果中的格式数量
+#   FAKE_YTDLP_SUBTITLES         -J 结果中的字幕语言数量
+#   FAKE_YTDLP_EXTRACT_DELAY     输出结果前模拟提取耗时（秒）
+#   FAKE_YTDLP_ENTRIES           播放列表条目数量
+#   FAKE_YTDLP_PROGRESS_LINES    每个文件输出的进度行数
+#   FAKE_YTDLP_PROGRESS_RATE     每秒输出的进度行数，0 表示不限速
+#   FAKE_YTDLP_FILE_SIZE         模拟下载的文件大小（字节），实际只写入很小的文件
+#   FAKE_YTDLP_FAIL_EVERY        每 N 个 URL 失败一次，0 表示不失败
+import sys
+import os
+import re
+import json
+import time
+import zlib
+
+VIDEO_HEIGHTS = [4320, 2160, 1440, 1080, 720, 480, 360, 240, 144]
+SUBTITLE_LANGS = ['en', 'zh-Hans', 'zh-Hant', 'ja', 'ko', 'fr', 'de', 'es', 'pt', 'ru', 'it', 'ar', 'hi', 'th', 'vi']
+
+
+def get_env_number(name, default, cast=int):
+    try:
+        return cast(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def get_video_id(url):
+    match = re.search(r'v=([\w-]+)', url)
+    return match.group(1) if match else url.rstrip('/').rsplit('/', 1)[-1] or 'video'
+
+
+def build_info(url, format_count, subtitle_count):
+    video_id = get_video_id(url)
+    formats = []
+    for index in range(format_count):
+        kind = index % 4
+        height = VIDEO_HEIGHTS[(index // 4) % len(VIDEO_HEIGHTS)]
+        if kind == 3:
+            formats.append({
+                'format_id': f'a{index}', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2',
+                'abr': 48 + index, 'filesize': 3 * 1024 * 1024 + index,
+            })
+            continue
+        vcodec = ['avc1.640028', 'vp09.00.40.08', 'av01.0.08M.08'][kind]
+        formats.append({
+            'format_id': f'v{index}', 'ext': 'mp4' if kind == 0 else 'webm', 'vcodec': vcodec, 'acodec': 'none',
+            'height': height, 'width': height * 16 // 9, 'fps': 60 if index % 8 == 0 else 30,
+            'tbr': height * 2 + index, 'filesize': height * 100 * 1024 + index,
+            'dynamic_range': 'HDR10' if kind == 2 and height >= 2160 else 'SDR',
+        })
+    subtitles = {}
+    automatic_captions = {}
+    for index in range(subtitle_count):
+        lang = SUBTITLE_LANGS[index % len(SUBTITLE_LANGS)] + ('' if index < len(SUBTITLE_LANGS) else f'-{index}')
+        target = subtitles if index % 2 == 0 else automatic_captions
+        target[lang] = [{'ext': 'vtt', 'name': lang}, {'ext': 'srv3', 'name': lang}]
+    return {
+        'id': video_id, 'title': f'Bench {video_id}', 'webpage_url': url, 'extractor': 'bench',
+        'formats': formats, 'subtitles': subtitles, 'automatic_captions': automatic_captions,
+    }
+
+
+def render_progress(template, values):
+    # 按传入的 --progress-template 渲染，和真实 yt-dlp 一样缺少的字段输出 NA
+    def replace(match):
+        value = values.get(match.group(1))
+        return 'NA' if value is None else str(value)
+    return re.sub(r'%\(progress\.(\w+)\)s', replace, template)
+
+
+def build_mp4():
+    # 最小的 ftyp + moov + mdat 结构，能通过后处理的容器检查
+    def box(box_type, payload):
+        return (8 + len(payload)).to_bytes(4, 'big') + box_type + payload
+    return box(b'ftyp', b'isom' + bytes(4) + b'isomavc1') + box(b'moov', b'') + box(b'mdat', bytes(1024))
+
+
+def render_output(template, url, fmt):
+    # 只支持程序用到的几个字段
+    is_audio = fmt.startswith('bestaudio')
+    values = {'title': f'Bench {get_video_id(url)}', 'id': get_video_id(url), 'format_id': 'a3' if is_audio else fmt,
+              'ext': 'm4a' if is_audio else 'mp4'}
+    return re.sub(r'%\((\w+)\)s', lambda match: values.get(match.group(1), 'NA'), template)
+
+
+def get_option(args, *names):
+    for name in names:
+        if name in args:
+            index = args.index(name)
+            if index + 1 < len(args):
+                return args[index + 1]
+    return None
+
+
+def should_fail(url):
+    fail_every = get_env_number('FAKE_YTDLP_FAIL_EVERY', 0)
+    return fail_every > 0 and zlib.crc32(url.encode('utf-8')) % fail_every == 0
+
+
+def run_probe(url):
+    time.sleep(get_env_number('FAKE_YTDLP_EXTRACT_DELAY', 0, float))
+    print(f'[bench] Extracting URL: {url}', file=sys.stderr)
+    if should_fail(url):
+        print(f'ERROR: [bench] {get_video_id(url)}: Video unavailable', file=sys.stderr)
+        return 1
+    info = build_info(url, get_env_number('FAKE_YTDLP_FORMATS', 40), get_env_number('FAKE_YTDLP_SUBTITLES', 20))
+    print(json.dumps(info))
+    return 0
+
+
+def run_list(url):
+    for index in range(get_env_number('FAKE_YTDLP_ENTRIES', 20)):
+        entry_id = f'{get_video_id(url)[:6]}{index:05d}'
+        print(json.dumps({'id': entry_id, 'title': f'Entry {index}', 'url': f'https://bench.invalid/watch?v={entry_id}'}))
+        sys.stdout.flush()
+    return 0
+
+
+def run_download(url, args, info_file=None):
+    template = get_option(args, '--progress-template')
+    if template and ':' in template:
+        template = template.split(':', 1)[1]
+    output_dir = get_option(args, '-P', '--paths') or '.'
+    fmt = get_option(args, '-f', '--format') or ''
+    output_template = get_option(args, '-o', '--output')
+    if output_template:
+        name = os.path.join(output_dir, render_output(output_template, url, fmt))
+    else:
+        name = os.path.join(output_dir, f'Bench [{get_video_id(url)}].mp4')
+    lines = get_env_number('FAKE_YTDLP_PROGRESS_LINES', 50)
+    rate = get_env_number('FAKE_YTDLP_PROGRESS_RATE', 0, float)
+    total = get_env_number('FAKE_YTDLP_FILE_SIZE', 50 * 1024 * 1024)
+    files = 2 if '+' in fmt else 1
+
+    if info_file:
+        # 和真实 yt-dlp 一样，载入已有的信息时不再提取网页
+        print(f'[info] Loading video info from {info_file}', flush=True)
+    else:
+        print(f'[bench] Extracting URL: {url}', flush=True)
+    if should_fail(url):
+        print(f'ERROR: [bench] {get_video_id(url)}: Video unavailable', flush=True)
+        return 1
+    started = time.monotonic()
+    next_emit = started
+    for file_index in range(files):
+        print(f'[download] Destination: {name if output_template else f"{name}.f{file_index}"}', flush=True)
+        for line in range(1, lines + 1):
+            if rate > 0:
+                # 按固定速率发出，和实际下载时的进度节奏一致；进程被暂停过时不补发落下的部分
+                next_emit = max(next_emit + 1 / rate, time.monotonic() - 0.05)
+                delay = next_emit - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            values = {
+                'status': 'downloading',
+                'downloaded_bytes': total * line // lines,
+                'total_bytes': total,
+                'speed': total / max(0.001, time.monotonic() - started),
+                'eta': lines - line,
+                # 借用 fragment_index 传发出时刻，基准测试据此计算进度到界面的延迟
+                'fragment_index': f'{time.time():.6f}',
+            }
+            if template:
+                print(render_progress(template, values), flush=True)
+            else:
+                print(f'[download] {line * 100 / lines:5.1f}% of {total} at {values["speed"]:.0f}B/s', flush=True)
+    if files > 1:
+        print(f'[Merger] Merging formats into "{name}"', flush=True)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(name, 'wb') as f:
+        f.write(build_mp4())
+    return 0
+
+
+def write_cookie_jar(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# Netscape HTTP Cookie File\n.bench.invalid\tTRUE\t/\tTRUE\t0\tSID\tbench\n')
+
+
+def main(argv):
+    if '--version' in argv:
+        print('2099.01.01')
+        return 0
+    cookie_path = get_option(argv, '--cookies')
+    if '--cookies-from-browser' in argv and cookie_path:
+        # 和真实 yt-dlp 一样，即使没有给出 URL 也会在退出前写入读取到的浏览器 Cookies
+        write_cookie_jar(cookie_path)
+    info_file = get_option(argv, '--load-info-json')
+    if info_file:
+        with open(info_file, 'r', encoding='utf-8') as f:
+            return run_download(json.load(f)['webpage_url'], argv, info_file)
+    urls = [arg for arg in argv if arg.startswith(('http://', 'https://'))]
+    if not urls:
+        print('ERROR: no URL', file=sys.stderr)
+        return 2
+    url = urls[-1]
+    if '-J' in argv or '--dump-single-json' in argv:
+        return run_probe(url)
+    if '--flat-playlist' in argv:
+        return run_list(url)
+    return run_download(url, argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,253 @@
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_ytdlp
+from yt_dlp_core import (DEFAULT_SETTINGS, DownloaderCore, JobQueue, QueueListener, build_formats_from_info,
+                         invalidate_ytdlp_command)
+
+# 和基准结果比较时，值越大越差的指标；jobs_per_second 越小越差，单独处理
+COMPARE_KEYS = [
+    ('parse', 'p50_ms'),
+    ('sniff', 'p50_ms'),
+    ('progress_latency', 'p95_ms'),
+    ('queue', 'peak_traced_mb'),
+]
+
+
+def summarize(seconds):
+    if not seconds:
+        return {'count': 0}
+    values = sorted(value * 1000 for value in seconds)
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.fmean(values), 3),
+        'p50_ms': round(values[len(values) // 2], 3),
+        'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+        'max_ms': round(values[-1], 3),
+    }
+
+
+def get_max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux 上 ru_maxrss 的单位是 KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def create_stub_command(work_dir):
+    # Popen 需要一个可执行文件，用当前解释器包一层启动脚本
+    stub_path = os.path.join(BENCH_DIR, 'fake_ytdlp.py')
+    if os.name == 'nt':
+        command = os.path.join(work_dir, 'yt-dlp.cmd')
+        with open(command, 'w', encoding='utf-8') as f:
+            f.write(f'@"{sys.executable}" "{stub_path}" %*\n')
+    else:
+        command = os.path.join(work_dir, 'yt-dlp')
+        with open(command, 'w', encoding='utf-8') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{stub_path}" "$@"\n')
+        os.chmod(command, 0o755)
+    return command
+
+
+def create_core(args, work_dir):
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update({
+        'job_log_dir': os.path.join(work_dir, 'logs'),
+        'engine': 'subprocess',
+        'max_concurrent_downloads': args.workers,
+        'default_site_concurrency': args.workers,
+        'site_concurrency': {},
+        # 基准测试不写指标、调优和下载记录，也不影响正常使用时的缓存
+        'metrics_enabled': False,
+        'download_auto_tune': False,
+        'download_archive': False,
+    })
+    return DownloaderCore(settings)
+
+
+def bench_parse(args):
+    text = json.dumps(fake_ytdlp.build_info('https://bench.invalid/watch?v=parse', args.formats, args.subtitles))
+    timings = []
+    for _ in range(args.parse_runs):
+        started = time.perf_counter()
+        build_formats_from_info(json.loads(text))
+        timings.append(time.perf_counter() - started)
+    result = summarize(timings)
+    result['json_kb'] = round(len(text) / 1024, 1)
+    return result
+
+
+def bench_sniff(args, core):
+    timings = []
+    failures = 0
+    for index in range(args.sniff_runs):
+        started = time.perf_counter()
+        success, _, _ = core.engine.probe(
+            f'https://bench.invalid/watch?v=sniff{index:05d}', 'none', core.cookie_file, lambda: False, lambda line: None,
+        )
+        timings.append(time.perf_counter() - started)
+        failures += 0 if success else 1
+    result = summarize(timings)
+    result['failures'] = failures
+    return result
+
+
+class BenchListener(QueueListener):
+    def __init__(self, emit_progress=None):
+        self.latencies = []
+        self.progress_events = 0
+        self.emit_progress = emit_progress
+
+    def record_progress(self, progress):
+        self.progress_events += 1
+        sent_at = progress.get('fragment_index')
+        if sent_at:
+            self.latencies.append(time.time() - sent_at)
+
+    def on_job_progress(self, job, progress):
+        if self.emit_progress:
+            self.emit_progress(progress)
+        else:
+            self.record_progress(progress)
+
+
+def create_qt_bridge(listener):
+    # 装了 PyQt6 时经过跨线程信号送到主线程，和界面收到进度的路径一致
+    try:
+        from PyQt6.QtCore import QCoreApplication, QObject, pyqtSignal
+    except ImportError:
+        return None, None
+
+    class ProgressBridge(QObject):
+        progress_signal = pyqtSignal(dict)
+
+    app = QCoreApplication.instance() or QCoreApplication([])
+    bridge = ProgressBridge()
+    bridge.progress_signal.connect(listener.record_progress)
+    listener.emit_progress = bridge.progress_signal.emit
+    return app, bridge
+
+
+def bench_queue(args, core, output_dir):
+    listener = BenchListener()
+    app, bridge = (None, None) if args.no_qt else create_qt_bridge(listener)
+    download_queue = JobQueue(core, listener, output_dir)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    for index in range(args.jobs):
+        download_queue.add_job(f'https://bench.invalid/watch?v=job{index:05d}', 'v0', '1080p/H.264/60fps', 'none')
+    if app:
+        while not download_queue.wait_idle(0.005):
+            app.processEvents()
+        app.processEvents()
+    else:
+        download_queue.wait_idle()
+    elapsed = time.perf_counter() - started
+    traced_current, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    states = {}
+    for job in download_queue.jobs:
+        states[job.state] = states.get(job.state, 0) + 1
+    return {
+        'jobs': args.jobs,
+        'workers': args.workers,
+        'seconds': round(elapsed, 3),
+        'jobs_per_second': round(args.jobs / elapsed, 2),
+        'states': states,
+        'progress_events': listener.progress_events,
+        'traced_mb': round(traced_current / 1024 / 1024, 2),
+        'peak_traced_mb': round(traced_peak / 1024 / 1024, 2),
+        'ui_path': 'qt' if bridge else 'listener',
+    }, summarize(listener.latencies)
+
+
+def compare_results(results, baseline, tolerance):
+    regressions = []
+    for section, key in COMPARE_KEYS:
+        current = results.get(section, {}).get(key)
+        previous = baseline.get(section, {}).get(key)
+        if current is not None and previous and current > previous * (1 + tolerance):
+            regressions.append(f'{section}.{key}: {previous} -> {current}')
+    current = results['queue']['jobs_per_second']
+    previous = baseline.get('queue', {}).get('jobs_per_second')
+    if previous and current < previous * (1 - tolerance):
+        regressions.append(f'queue.jobs_per_second: {previous} -> {current}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='使用模拟的 yt-dlp 离线测量嗅探解析、进度延迟、队列吞吐和内存。')
+    parser.add_argument('--jobs', type=int, default=300, help='模拟下载任务数')
+    parser.add_argument('--workers', type=int, default=8, help='同时下载的任务数')
+    parser.add_argument('--formats', type=int, default=40, help='每个视频的格式数量')
+    parser.add_argument('--subtitles', type=int, default=20, help='每个视频的字幕语言数量')
+    parser.add_argument('--parse-runs', type=int, default=500, help='解析测量次数')
+    parser.add_argument('--sniff-runs', type=int, default=30, help='完整嗅探（启动进程 + 解析）测量次数')
+    parser.add_argument('--progress-lines', type=int, default=50, help='每个文件的进度行数')
+    parser.add_argument('--progress-rate', type=float, default=200, help='每秒进度行数，0 表示不限速')
+    parser.add_argument('--extract-delay', type=float, default=0, help='模拟提取耗时（秒）')
+    parser.add_argument('--fail-every', type=int, default=0, help='每 N 个任务模拟失败一次')
+    parser.add_argument('--no-qt', action='store_true', help='不经过 Qt 信号，只测到队列回调为止')
+    parser.add_argument('--json', help='把结果写入 JSON 文件，可作为之后比较的基准')
+    parser.add_argument('--baseline', help='与之前保存的 JSON 结果比较，超出容差时返回 1')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='比较时允许的相对退化，默认 0.2')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='yt_dlp_gui_bench_')
+    try:
+        os.environ.update({
+            'YT_DLP_GUI_YTDLP': create_stub_command(work_dir),
+            'FAKE_YTDLP_FORMATS': str(args.formats),
+            'FAKE_YTDLP_SUBTITLES': str(args.subtitles),
+            'FAKE_YTDLP_EXTRACT_DELAY': str(args.extract_delay),
+            'FAKE_YTDLP_PROGRESS_LINES': str(args.progress_lines),
+            'FAKE_YTDLP_PROGRESS_RATE': str(args.progress_rate),
+            'FAKE_YTDLP_FAIL_EVERY': str(args.fail_every),
+        })
+        invalidate_ytdlp_command()
+        core = create_core(args, work_dir)
+
+        results = {'parse': bench_parse(args)}
+        print(f'解析：{results["parse"]}', file=sys.stderr)
+        results['sniff'] = bench_sniff(args, core)
+        print(f'嗅探：{results["sniff"]}', file=sys.stderr)
+        results['queue'], results['progress_latency'] = bench_queue(args, core, os.path.join(work_dir, 'downloads'))
+        print(f'队列：{results["queue"]}', file=sys.stderr)
+        print(f'进度延迟：{results["progress_latency"]}', file=sys.stderr)
+        results['max_rss_mb'] = get_max_rss_mb()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'性能退化：{regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from yt_dlp_core import DEFAULT_SETTINGS, ApiServer, CookiePreferences, DownloaderCore, JobQueue
+
+
+@pytest.fixture
+def api(monkeypatch):
+    settings = dict(DEFAULT_SETTINGS)
+    settings['download_archive'] = False
+    queue = JobQueue(DownloaderCore(settings))
+    # 只检查接口本身，不真正开始下载
+    monkeypatch.setattr(queue, 'schedule', lambda: None)
+    server = ApiServer(queue.core, queue, host='127.0.0.1', port=0, token='')
+    url = server.start()
+    yield url, queue
+    server.stop()
+
+
+def post_job(url, payload):
+    request = urllib.request.Request(
+        url + '/api/jobs', data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.mark.parametrize('priority', ['abc', 0, -2, [1]])
+def test_submit_rejects_invalid_priority(api, priority):
+    url, queue = api
+    status, body = post_job(url, {'url': 'https://www.youtube.com/watch?v=abcdefghijk', 'priority': priority})
+    assert status == 400
+    assert body['error'].startswith('priority 必须是正整数')
+    assert queue.jobs == []
+
+
+def test_submit_and_get_job(api):
+    url, queue = api
+    status, body = post_job(url, {'url': 'https://www.youtube.com/watch?v=abcdefghijk', 'priority': '3'})
+    assert status == 202
+    job_id = body['jobs'][0]['id']
+    assert queue.get_job(job_id).priority == 3
+    with urllib.request.urlopen(f'{url}/api/jobs/{job_id}', timeout=5) as response:
+        assert json.loads(response.read())['id'] == job_id
+    assert queue.get_job(job_id + 1) is None
+
+
+class FakeLease:
+    def __init__(self, mode, on_line):
+        self.mode = mode
+        self.path = None
+        self.on_line = on_line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeCookies:
+    def __init__(self):
+        self.modes = []
+
+    def lease(self, cookie_mode, on_line=None):
+        self.modes.append(cookie_mode)
+        return FakeLease(cookie_mode, on_line)
+
+
+class FakeListEngine:
+    name = 'inprocess'
+
+    def list_entries(self, url, cookie_mode, cookie_file, should_stop, on_line, on_entry, on_process=None):
+        for index in range(3):
+            on_entry({'id': f'entry{index:06d}', 'url': f'https://www.youtube.com/watch?v=entry{index:06d}', 'title': str(index)})
+        return True
+
+
+@pytest.mark.parametrize('cookie_mode, expected', [('firefox', 'firefox'), (None, 'none')])
+def test_playlist_uses_requested_cookie_mode(api, tmp_path, cookie_mode, expected):
+    url, queue = api
+    queue.core._engine = FakeListEngine()
+    queue.core._cookies = FakeCookies()
+    queue.core._cookie_preferences = CookiePreferences(str(tmp_path / 'cookie_preferences.json'))
+    payload = {'url': 'https://www.youtube.com/playlist?list=PLabc'}
+    if cookie_mode:
+        payload['cookie_mode'] = cookie_mode
+    status, body = post_job(url, payload)
+    assert status == 202 and body['playlists'] == [payload['url']]
+    deadline = time.monotonic() + 5
+    while len(queue.jobs) < 3 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert [job.cookie_mode for job in queue.jobs] == [expected] * 3
+    assert queue.core._cookies.modes[0] == expected
@@ -0,0 +1,55 @@
+from yt_dlp_core import DEFAULT_SETTINGS, DownloadArchive, DownloaderCore, DownloadJob, JobQueue
+
+URL = 'https://www.youtube.com/watch?v=abcdefghijk'
+
+
+def make_job(output_file):
+    job = DownloadJob(1, URL, '137', '1080p', 'none')
+    job.output_file = str(output_file)
+    return job
+
+
+def test_lookup_partial_requires_leftover_files(tmp_path):
+    archive = DownloadArchive(str(tmp_path / 'archive.sqlite3'))
+    output = tmp_path / 'video.mp4'
+    (tmp_path / 'video.mp4.part').write_bytes(b'x' * 10)
+    archive.record(make_job(output), 'partial')
+
+    record = archive.lookup_partial(URL, '137')
+    assert record['output_path'] == str(output)
+    assert archive.lookup(URL, '137') is None
+
+    (tmp_path / 'video.mp4.part').unlink()
+    assert archive.lookup_partial(URL, '137') is None
+    assert archive.query() == []
+
+
+def test_done_record_replaces_partial(tmp_path):
+    archive = DownloadArchive(str(tmp_path / 'archive.sqlite3'))
+    output = tmp_path / 'video.mp4'
+    (tmp_path / 'video.mp4.part').write_bytes(b'x')
+    archive.record(make_job(output), 'partial')
+    (tmp_path / 'video.mp4.part').rename(output)
+    archive.record(make_job(output), 'done')
+    assert archive.lookup_partial(URL, '137') is None
+    assert archive.lookup(URL, '137')['output_path'] == str(output)
+
+
+def test_add_job_resumes_in_partial_location(tmp_path, monkeypatch):
+    settings = dict(DEFAULT_SETTINGS)
+    core = DownloaderCore(settings)
+    core._archive = DownloadArchive(str(tmp_path / 'archive.sqlite3'))
+    previous_dir = tmp_path / 'previous'
+    previous_dir.mkdir()
+    (previous_dir / 'video.mp4.part').write_bytes(b'x')
+    core.archive.record(make_job(previous_dir / 'video.mp4'), 'partial')
+
+    queue = JobQueue(core, output_dir=str(tmp_path / 'new'))
+    monkeypatch.setattr(queue, 'schedule', lambda: None)
+    job = queue.add_job(URL, '137', '1080p', 'none')
+    assert job.state == 'queued'
+    assert job.output_dir == str(previous_dir)
+    assert job.output_file == str(previous_dir / 'video.mp4')
+
+    other = queue.add_job('https://www.youtube.com/watch?v=zzzzzzzzzzz', '137', '1080p', 'none')
+    assert other.output_dir == str(tmp_path / 'new')
@@ -0,0 +1,22 @@
+from yt_dlp_core import SubprocessEngine
+
+URL = 'https://www.youtube.com/watch?v=abcdefghijk'
+
+
+def make_engine():
+    return SubprocessEngine(lambda: 'yt-dlp', None)
+
+
+def test_download_cmd_uses_url():
+    cmd = make_engine().build_download_cmd(URL, {'format': '137', 'cookie_mode': 'none'}, None)
+    assert URL in cmd
+    assert '--load-info-json' not in cmd
+
+
+def test_download_cmd_loads_info_instead_of_url():
+    request = {'format': '137', 'cookie_mode': 'none', 'info_json': '/tmp/video.info.json'}
+    cmd = make_engine().build_download_cmd(URL, request, None)
+    # 给出链接时 yt-dlp 会忽略 --load-info-json
+    assert URL not in cmd
+    assert cmd[cmd.index('--load-info-json') + 1] == '/tmp/video.info.json'
+    assert cmd[-1] == '--newline'
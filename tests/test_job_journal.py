@@ -0,0 +1,48 @@
+import os
+
+import yt_dlp_core
+from yt_dlp_core import JobJournal
+
+
+def read_ids(path):
+    journal = JobJournal(path)
+    return {record['id']: record['state'] for record in journal.load()}
+
+
+def test_appends_are_batched(tmp_path, monkeypatch):
+    syncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(yt_dlp_core.os, 'fsync', lambda fd: (syncs.append(fd), real_fsync(fd)))
+    path = str(tmp_path / 'queue_journal.jsonl')
+    journal = JobJournal(path, sync_interval=0.2)
+    for job_id in range(1, 2001):
+        journal.append({'id': job_id, 'state': 'queued'})
+    # 最终结果要等落盘后才返回，前面排队的记录一起写入
+    journal.append({'id': 1, 'state': 'done'})
+    states = read_ids(path)
+    assert len(states) == 2000
+    assert states[1] == 'done'
+    assert len(syncs) < 10
+    journal.close()
+
+
+def test_close_writes_pending_records(tmp_path):
+    path = str(tmp_path / 'queue_journal.jsonl')
+    journal = JobJournal(path, sync_interval=60)
+    journal.append({'id': 1, 'state': 'queued'})
+    journal.append({'id': 2, 'state': 'paused'})
+    journal.close()
+    assert read_ids(path) == {1: 'queued', 2: 'paused'}
+    # 关闭后不再写入，也不会阻塞
+    journal.append({'id': 3, 'state': 'done'})
+    assert 3 not in read_ids(path)
+
+
+def test_rewrite_drops_pending_records(tmp_path):
+    path = str(tmp_path / 'queue_journal.jsonl')
+    journal = JobJournal(path, sync_interval=60)
+    journal.append({'id': 1, 'state': 'queued'})
+    journal.rewrite([{'id': 2, 'state': 'queued'}])
+    journal.append({'id': 2, 'state': 'cancelled'})
+    assert read_ids(path) == {2: 'cancelled'}
+    journal.close()
@@ -0,0 +1,76 @@
+import gzip
+import os
+
+from yt_dlp_core import JobLog
+
+
+def write_log(path, count, capacity=50):
+    log = JobLog(path, capacity)
+    for i in range(count):
+        log.write(f'line {i:05d} ' + 'x' * 40)
+    log.close()
+    return log
+
+
+def truncate(path, ratio=0.5):
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        f.truncate(int(size * ratio))
+
+
+def read_all(log, page_size=100):
+    return [line for page in log.read_pages(page_size) for line in page]
+
+
+def test_read_complete_log(tmp_path):
+    log = write_log(str(tmp_path / 'job.log.gz'), 250)
+    pages = list(log.read_pages(100))
+    assert [len(page) for page in pages] == [100, 100, 50]
+    assert pages[0][0].startswith('line 00000')
+    assert pages[-1][-1].startswith('line 00249')
+
+
+def test_read_truncated_log_returns_decoded_lines_and_tail(tmp_path):
+    path = str(tmp_path / 'job.log.gz')
+    log = write_log(path, 5000)
+    truncate(path)
+    lines = read_all(log)
+    marker = lines.index('[日志文件已损坏，以下为内存中最近的输出]')
+    assert marker > 0
+    assert lines[:marker] == [f'line {i:05d} ' + 'x' * 40 for i in range(marker)]
+    assert lines[marker + 1:] == log.tail()
+    assert len(log.tail()) == 50
+
+
+def test_read_truncated_log_with_appended_member(tmp_path):
+    # 崩溃后截断的文件后面又追加了新的 gzip 成员
+    path = str(tmp_path / 'job.log.gz')
+    write_log(path, 5000)
+    truncate(path)
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        f.write('resumed\n')
+    log = JobLog(path, 50)
+    lines = read_all(log)
+    assert lines[-1] == '[日志文件已损坏，以下为内存中最近的输出]'
+    assert lines[0].startswith('line 00000')
+
+
+def test_read_garbage_file(tmp_path):
+    path = tmp_path / 'job.log.gz'
+    path.write_bytes(b'not a gzip file')
+    log = JobLog(str(path), 50)
+    log.lines.append('in memory')
+    assert read_all(log) == ['[日志文件已损坏，以下为内存中最近的输出]', 'in memory']
+
+
+def test_read_missing_file(tmp_path):
+    log = JobLog(str(tmp_path / 'missing.log.gz'), 50)
+    assert read_all(log) == []
+
+
+def test_read_while_writing(tmp_path):
+    log = JobLog(str(tmp_path / 'job.log.gz'), 50)
+    for i in range(10):
+        log.write(f'line {i}')
+    assert read_all(log) == [f'line {i}' for i in range(10)]
+    log.close()
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+
+import yt_dlp_core
+from yt_dlp_core import DEFAULT_SETTINGS, DownloaderCore, JobJournal, JobLog, JobQueue, get_resume_log_path
+
+
+def make_queue(tmp_path):
+    settings = dict(DEFAULT_SETTINGS)
+    settings['download_archive'] = False
+    settings['job_log_dir'] = str(tmp_path / 'logs')
+    core = DownloaderCore(settings)
+    journal = JobJournal(str(tmp_path / 'queue_journal.jsonl'))
+    return JobQueue(core, journal=journal), journal
+
+
+def write_journal(journal, record):
+    with open(journal.path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def test_resume_log_path():
+    assert get_resume_log_path('/logs/a-1.log.gz') == '/logs/a-1-resume1.log.gz'
+
+
+def test_resume_log_path_skips_existing(tmp_path):
+    path = str(tmp_path / 'a-1.log.gz')
+    (tmp_path / 'a-1-resume1.log.gz').write_bytes(b'')
+    assert get_resume_log_path(path) == str(tmp_path / 'a-1-resume2.log.gz')
+    assert get_resume_log_path(str(tmp_path / 'a-1-resume1.log.gz')) == str(tmp_path / 'a-1-resume2.log.gz')
+
+
+def test_restore_starts_new_log_file(tmp_path):
+    queue, journal = make_queue(tmp_path)
+    old_path = str(tmp_path / 'logs' / 'old-1.log.gz')
+    old_log = JobLog(old_path, 50)
+    for i in range(5000):
+        old_log.write(f'before crash {i}')
+    old_log.close()
+    # 模拟崩溃时日志只写了一半
+    with open(old_path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) // 2)
+    write_journal(journal, {
+        'id': 1, 'url': 'https://example.com/v', 'format_id': 'best', 'state': 'paused', 'log': old_path,
+    })
+
+    job, = queue.restore()
+    assert job.log.path == str(tmp_path / 'logs' / 'old-1-resume1.log.gz')
+    assert job.log.previous == [old_path]
+    record, = journal.load()
+    assert record['log'] == job.log.path
+    assert record['previous_logs'] == [old_path]
+
+    job.log.mark('resumed')
+    job.log.close()
+    lines = [line for page in job.log.read_pages(100) for line in page]
+    assert lines[0] == 'before crash 0'
+    assert lines[-2] == '[日志在此处中断：old-1.log.gz]'
+    assert lines[-1].endswith('resumed')
+
+
+class SlowExitTask:
+    # 模拟收到停止信号后还要过一会儿才退出的 yt-dlp
+    running = []
+
+    def __init__(self, core, job, on_updated=None):
+        self.job = job
+        self.stopped = threading.Event()
+        self.downloaded_file = None
+        self.job_metrics = None
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self, on_line, on_progress):
+        SlowExitTask.running.append(self)
+        try:
+            self.stopped.wait(5)
+            time.sleep(0.3)
+        finally:
+            SlowExitTask.running.remove(self)
+        return False, '下载已取消'
+
+
+def test_resume_waits_for_paused_task_to_exit(tmp_path, monkeypatch):
+    monkeypatch.setattr(yt_dlp_core, 'DownloadTask', SlowExitTask)
+    queue, _ = make_queue(tmp_path)
+    job = queue.add_job('https://example.com/video/1', 'best', 'best', 'none')
+    first = job.task
+    assert job.state == 'running'
+
+    queue.pause_job(job)
+    queue.resume_job(job)
+    assert job.state == 'paused' and job.resume_requested
+    assert job.task is first
+    # 旧任务退出前不会启动第二个
+    time.sleep(0.1)
+    assert len(SlowExitTask.running) == 1
+
+    deadline = time.monotonic() + 5
+    while job.task in (None, first) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert job.state == 'running'
+    assert job.task is not first
+    assert len(SlowExitTask.running) == 1
+    assert not job.resume_requested
+
+    queue.cancel_job(job)
+    assert queue.wait_idle(5)
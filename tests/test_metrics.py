@@ -0,0 +1,19 @@
+import time
+
+from yt_dlp_core import JobMetrics
+
+
+def test_postprocess_phases_are_recorded():
+    metrics = JobMetrics('download', 'https://example.com/video/1', 'extract')
+    metrics.enter('download')
+    metrics.enter('postprocess')
+    time.sleep(0.05)
+    metrics.add_postprocess_phases({'rename': 0.01, 'check': 0.005, 'hash': 0.02})
+    record = metrics.finish('success', 'subprocess', None)
+    phases = record['phases']
+    assert phases['rename'] == 0.01
+    assert phases['check'] == 0.005
+    assert phases['hash'] == 0.02
+    assert phases['postprocess_wait'] >= 0.01
+    assert 'postprocess' not in phases
+    assert abs(sum(phases.values()) - record['duration']) < 0.005
@@ -0,0 +1,28 @@
+from yt_dlp_core import remove_partial_files
+
+
+def touch(path):
+    path.write_bytes(b'x')
+    return path
+
+
+def test_removes_stream_files_and_temporary_files(tmp_path):
+    video = touch(tmp_path / 'Video [abcdefghijk].f137.mp4')
+    audio_part = touch(tmp_path / 'Video [abcdefghijk].f140.m4a.part')
+    fragment = touch(tmp_path / 'Video [abcdefghijk].f140.m4a.part-Frag3')
+    merged_part = touch(tmp_path / 'Video.mp4.part')
+    removed = remove_partial_files([
+        str(video), str(tmp_path / 'Video [abcdefghijk].f140.m4a'), str(tmp_path / 'Video.mp4'),
+    ])
+    assert sorted(removed) == sorted(map(str, [video, audio_part, fragment, merged_part]))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_keeps_finished_files_with_dotted_names(tmp_path):
+    names = ['Intro.fast.mp4', 'x.final.mkv', 'Talk.f.mp4', 'Clip.fhd.webm']
+    for name in names:
+        touch(tmp_path / name)
+    touch(tmp_path / 'Intro.fast.mp4.part')
+    removed = remove_partial_files([str(tmp_path / name) for name in names])
+    assert removed == [str(tmp_path / 'Intro.fast.mp4.part')]
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(names)
@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from yt_dlp_core import DEFAULT_SETTINGS, ProcessSupervisor, set_process_suspended
+
+# 模拟 yt-dlp 启动 ffmpeg：父进程再开一个子进程，输出子进程的 PID 后一起空转
+STUB = '''
+import subprocess, sys, time
+child = subprocess.Popen([sys.executable, '-c', 'import time\\nwhile True: time.sleep(0.05)'])
+print(child.pid, flush=True)
+while True:
+    time.sleep(0.05)
+'''
+
+pytestmark = pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='需要 /proc 查看进程状态')
+
+
+def get_state(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        return f.read().rsplit(')', 1)[1].split()[0]
+
+
+def wait_state(pid, stopped, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (get_state(pid) == 'T') == stopped:
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_suspend_pauses_child_processes():
+    supervisor = ProcessSupervisor(DEFAULT_SETTINGS)
+    process = supervisor.popen([sys.executable, '-c', STUB])
+    try:
+        child_pid = int(process.stdout.readline())
+        assert set_process_suspended(process, True)
+        assert wait_state(process.pid, True)
+        assert wait_state(child_pid, True)
+
+        assert set_process_suspended(process, False)
+        assert wait_state(process.pid, False)
+        assert wait_state(child_pid, False)
+    finally:
+        supervisor.kill(process)
+        process.wait(timeout=5)
+
+
+def test_suspend_process_in_own_group_only_stops_it():
+    # 和本程序同一个进程组时只暂停它自己
+    process = subprocess.Popen([sys.executable, '-c', 'import time\nwhile True: time.sleep(0.05)'])
+    try:
+        assert set_process_suspended(process, True)
+        assert wait_state(process.pid, True)
+        assert get_state(os.getpid()) != 'T'
+        assert set_process_suspended(process, False)
+        assert wait_state(process.pid, False)
+    finally:
+        process.kill()
+        process.wait(timeout=5)
@@ -0,0 +1,70 @@
+import threading
+
+from yt_dlp_core import DEFAULT_SETTINGS, DownloaderCore, FormatTable, SniffPool, SniffPoolListener
+
+URL = 'https://example.com/video/1'
+
+
+class FakeLease:
+    def __init__(self, mode, on_line):
+        self.mode = mode
+        self.path = None
+        self.on_line = on_line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeCookies:
+    def lease(self, cookie_mode, on_line=None):
+        return FakeLease(cookie_mode, on_line)
+
+
+class FakeEngine:
+    name = 'inprocess'
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def probe(self, url, cookie_mode, cookie_file, should_stop, on_line, on_process=None):
+        self.calls += 1
+        self.release.wait(5)
+        return False, '嗅探失败', FormatTable()
+
+
+class RecordingListener(SniffPoolListener):
+    def __init__(self):
+        self.finished = []
+
+    def on_sniff_finished(self, url, success, message, formats, cookie_mode):
+        self.finished.append((url, success))
+
+
+def make_pool(monkeypatch):
+    settings = dict(DEFAULT_SETTINGS)
+    settings['metrics_enabled'] = False
+    core = DownloaderCore(settings)
+    core._engine = FakeEngine()
+    core._cookies = FakeCookies()
+    monkeypatch.setattr(core, 'lookup_cached_formats', lambda url: (None, None))
+    listener = RecordingListener()
+    return SniffPool(core, listener), core._engine, listener
+
+
+def test_failed_url_can_be_retried(monkeypatch):
+    pool, engine, listener = make_pool(monkeypatch)
+    assert pool.add_urls([URL]) == [URL]
+    # 正在嗅探的链接不会重复加入
+    assert pool.add_urls([URL]) == []
+    engine.release.set()
+    assert pool.wait_idle(5)
+    assert listener.finished == [(URL, False)]
+
+    assert pool.add_urls([URL]) == [URL]
+    assert pool.wait_idle(5)
+    assert engine.calls == 2
+    assert listener.finished == [(URL, False), (URL, False)]
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from yt_dlp_core import (
+    DEFAULT_SETTINGS, CookiePreferences, DownloaderCore, EngineLogger, FormatTable, JobMetrics, SniffTask, get_site_key,
+)
+
+URL = 'https://www.youtube.com/watch?v=abcdefghijk'
+
+
+class FakeLease:
+    def __init__(self, mode, on_line):
+        self.mode = mode
+        self.path = None
+        self.on_line = on_line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeCookies:
+    def lease(self, cookie_mode, on_line=None):
+        return FakeLease(cookie_mode, on_line)
+
+
+class FakeEngine:
+    name = 'inprocess'
+
+    def __init__(self, delays):
+        # 每种方式多久后成功，None 表示一直等到被中断
+        self.delays = delays
+        self.started = {}
+        self.stopped = set()
+        self.lock = threading.Lock()
+
+    def probe(self, url, cookie_mode, cookie_file, should_stop, on_line, on_process=None):
+        with self.lock:
+            self.started[cookie_mode] = time.monotonic()
+        delay = self.delays[cookie_mode]
+        deadline = time.monotonic() + (delay if delay is not None else 10)
+        while time.monotonic() < deadline:
+            if should_stop():
+                self.stopped.add(cookie_mode)
+                return False, '嗅探已取消', FormatTable()
+            time.sleep(0.01)
+        return delay is not None, '嗅探完成', FormatTable()
+
+
+def make_task(tmp_path, delays, preferred=None):
+    settings = dict(DEFAULT_SETTINGS)
+    settings['cookie_race_delay'] = 5
+    core = DownloaderCore(settings)
+    core._engine = FakeEngine(delays)
+    core._cookies = FakeCookies()
+    core._cookie_preferences = CookiePreferences(str(tmp_path / 'cookie_preferences.json'))
+    if preferred:
+        core._cookie_preferences.preferred[get_site_key(URL)] = preferred
+    task = SniffTask(core, URL)
+    task.job_metrics = JobMetrics('sniff', URL, 'cache')
+    return task, core._engine
+
+
+def test_race_without_preference_launches_all_modes(tmp_path):
+    task, engine = make_task(tmp_path, {'none': None, 'firefox': 0.2})
+    began = time.monotonic()
+    success, _, _, cookie_mode = task.race_sniff(['none', 'firefox'], lambda line: None)
+    assert success and cookie_mode == 'firefox'
+    assert time.monotonic() - began < 2
+    assert set(engine.started) == {'none', 'firefox'}
+    deadline = time.monotonic() + 2
+    while 'none' not in engine.stopped and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert 'none' in engine.stopped
+
+
+def test_race_with_preference_gives_head_start(tmp_path):
+    task, engine = make_task(tmp_path, {'none': 0.2, 'firefox': None}, preferred='none')
+    success, _, _, cookie_mode = task.race_sniff(['none', 'firefox'], lambda line: None)
+    assert success and cookie_mode == 'none'
+    assert list(engine.started) == ['none']
+
+
+def test_engine_logger_interrupts_stopped_attempt():
+    class Cancelled(Exception):
+        pass
+
+    lines = []
+    stopped = threading.Event()
+    logger = EngineLogger(lines.append, stopped.is_set, Cancelled)
+    logger.info('[youtube] abcdefghijk: Downloading webpage')
+    stopped.set()
+    with pytest.raises(Cancelled):
+        logger.debug('[youtube] abcdefghijk: Downloading player')
+    assert lines == ['[youtube] abcdefghijk: Downloading webpage']
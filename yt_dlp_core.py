@@ -0,0 +1,4425 @@
+import sys
+import os
+import re
+import time
+import subprocess
+import tempfile
+import shutil
+import json
+import queue
+import glob
+import threading
+import urllib.parse
+from collections import OrderedDict, deque
+
+
+def get_runtime_dir():
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def get_managed_ytdlp_path():
+    return os.path.join(get_runtime_dir(), 'yt-dlp.exe' if os.name == 'nt' else 'yt-dlp')
+
+
+def get_popen_kwargs():
+    # 只有 Windows 需要隐藏控制台窗口，Linux 上没有 CREATE_NO_WINDOW
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NO_WINDOW}
+    return {}
+
+
+_resolved_ytdlp = {}
+
+
+def resolve_ytdlp_command():
+    # 指定了环境变量时直接使用，基准测试用它换成模拟的 yt-dlp
+    override = os.environ.get('YT_DLP_GUI_YTDLP')
+    if override:
+        return override
+    # 解析结果缓存起来，只有程序目录下的 yt-dlp 变化或更新完成后才重新查找 PATH
+    managed_path = get_managed_ytdlp_path()
+    managed_stamp = get_file_stamp(managed_path)
+    cached_command = _resolved_ytdlp.get('command')
+    if cached_command and _resolved_ytdlp.get('managed_stamp') == managed_stamp:
+        if cached_command == managed_path or os.path.exists(cached_command):
+            return cached_command
+
+    if managed_stamp:
+        command = managed_path
+    else:
+        command = shutil.which('yt-dlp.exe') or shutil.which('yt-dlp') or managed_path
+    _resolved_ytdlp.update({'command': command, 'managed_stamp': managed_stamp})
+    return command
+
+
+def invalidate_ytdlp_command():
+    _resolved_ytdlp.clear()
+
+
+class PhaseTimer:
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def total(self):
+        return self.last - self.start
+
+    def report(self):
+        parts = [f'{name} {seconds * 1000:.0f}ms' for name, seconds in self.phases]
+        return f'{self.total() * 1000:.0f}ms（' + '，'.join(parts) + '）'
+
+
+DEFAULT_SETTINGS = {
+    'sniff_cache_ttl': 6 * 3600,
+    'sniff_cache_max_entries': 200,
+    'max_concurrent_downloads': 3,
+    'default_site_concurrency': 2,
+    'site_concurrency': {'youtube': 2, 'bilibili': 4},
+    # 批量嗅探时同时进行的嗅探数，以及同一站点最多同时嗅探几个，避免被站点限流
+    'max_concurrent_sniffs': 4,
+    'sniff_site_concurrency': 2,
+    # auto：装了 yt_dlp 模块就在进程内调用，否则使用 yt-dlp 可执行文件
+    'engine': 'auto',
+    # 上次胜出的 Cookies 方式先跑这么多秒，之后其余方式同时启动
+    'cookie_race_delay': 1.0,
+    # Firefox 的 Cookies 提取一次后保存为 Netscape 格式，在这么多秒内所有嗅探和下载共用，不再每次读取浏览器
+    'cookie_jar_ttl': 1800,
+    # 界面每秒最多刷新几次进度
+    'progress_ui_hz': 5,
+    # 启动到窗口可交互超过这么多毫秒时输出各阶段耗时
+    'startup_budget_ms': 1000,
+    # 更新 yt-dlp 时查询的发布信息接口，可以指向本地的镜像或测试服务器
+    'update_api_url': 'https://api.github.com/repos/yt-dlp/yt-dlp/releases/latest',
+    # 更新下载中断后自动续传的次数
+    'update_retries': 5,
+    # DASH/HLS 分片同时下载的数量，开启自动调优时作为起点
+    'concurrent_fragments': 4,
+    # HTTP 直链按块请求的字节数，0 表示不分块（部分站点会对单个大请求限速）
+    'http_chunk_size': 10 * 1024 * 1024,
+    # 外部多连接下载器，目前支持 aria2c（PATH 中或程序目录下），留空不使用
+    'external_downloader': '',
+    'aria2c_connections': 8,
+    # 按站点测量任务开头几秒的实际速度，为之后的任务调整分片并发和分块大小
+    'download_auto_tune': True,
+    'download_tune_seconds': 8,
+    # 每个嗅探和下载任务的阶段耗时、流量和速度写入 JSON Lines 和 Prometheus 文本文件
+    'metrics_enabled': True,
+    # 指标目录，留空使用程序目录下的 metrics；可以指向 node_exporter 的 textfile 目录
+    'metrics_dir': '',
+    # 嗅探结果中显示的视频和音频编码；为了兼容默认只有 H.264 和 AAC，
+    # 加入 'VP9'、'AV1'、'HEVC' 可以看到 4K/8K/HDR 等格式
+    'format_codecs': ['H.264', 'AAC'],
+    # 下载记录：已完成的视频再次加入队列时直接跳过，不再联网提取
+    'download_archive': True,
+    # 下载完成后的重命名、容器完整性检查和 SHA-256 放到单独的线程池，下载槽位立即让给下一个任务
+    'postprocess_workers': 2,
+    'postprocess_hash': True,
+    # 所有下载共享的总带宽（字节/秒，也可以写 '20M'、'512K'），0 表示不限速
+    'bandwidth_limit': 0,
+    # 按时段覆盖总带宽，例如 [{'start': '09:00', 'end': '18:00', 'days': [0, 1, 2, 3, 4], 'limit': '20M'}]；
+    # days 是星期一到星期日的 0-6，省略表示每天；结束早于开始表示跨过午夜；按顺序取第一条匹配的时段
+    'bandwidth_schedule': [],
+    # 每个下载任务在内存中只保留最近的输出行，完整输出压缩写入程序目录下的 logs
+    'job_log_lines': 200,
+    # 日志目录，留空使用程序目录下的 logs；最多保留 job_log_keep 个，超出时删除最旧的
+    'job_log_dir': '',
+    'job_log_keep': 500,
+    # 队列状态写入 queue_journal.jsonl，崩溃或重启后自动恢复未完成的任务，不用重新嗅探
+    'restore_queue': True,
+    # 输入链接停顿多久（毫秒）后再处理；链接完整时在后台先嗅探，点击按钮时格式往往已经准备好
+    'url_debounce_ms': 400,
+    'speculative_sniff': True,
+    # 下载进程（包括 yt-dlp 启动的 ffmpeg 合并）的 CPU/IO 优先级：normal、below_normal 或 idle
+    'download_priority': 'below_normal',
+    # 取消时先让进程组正常退出，超过这个时间（秒）仍未退出就强制结束整个进程树
+    'cancel_grace_seconds': 0.5,
+    # 选择视频格式时同时下载视频和音频两路，都完成后再用 ffmpeg 合并；找不到 ffmpeg 时交给 yt-dlp 依次下载
+    'parallel_streams': True,
+    # 本地 HTTP 接口，供其他程序提交任务和订阅进度；默认只监听本机，监听其他地址时必须设置 api_token
+    'api_enabled': False,
+    'api_host': '127.0.0.1',
+    'api_port': 8765,
+    'api_token': '',
+}
+
+
+def get_settings_path():
+    return os.path.join(get_runtime_dir(), 'yt_dlp_gui.json')
+
+
+def get_cache_dir():
+    return os.path.join(get_runtime_dir(), 'cache')
+
+
+def get_cookie_dir():
+    return os.path.join(get_runtime_dir(), 'cookies')
+
+
+def get_queue_journal_path():
+    return os.path.join(get_runtime_dir(), 'queue_journal.jsonl')
+
+
+def load_settings():
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(get_settings_path(), 'r', encoding='utf-8') as f:
+            user_settings = json.load(f)
+        if isinstance(user_settings, dict):
+            settings.update(user_settings)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f'读取配置文件失败：{str(e)}')
+    return settings
+
+
+def write_json_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def write_text_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def is_youtube_url(url):
+    return 'youtube.com' in url.lower() or 'youtu.be' in url.lower()
+
+
+def get_site_key(url):
+    if is_youtube_url(url):
+        return 'youtube'
+    host = urllib.parse.urlsplit(url.strip()).netloc.lower().split(':')[0]
+    if host == 'b23.tv' or host.endswith('bilibili.com'):
+        return 'bilibili'
+    return host[4:] if host.startswith('www.') else host
+
+
+def get_cookie_modes(url, manual_cookie_enabled, cookie_file):
+    if not is_youtube_url(url):
+        return ['none']
+    if manual_cookie_enabled and os.path.exists(cookie_file):
+        return ['file']
+    return ['none', 'firefox']
+
+
+YOUTUBE_ID_PATTERN = re.compile(r'(?:youtu\.be/|/shorts/|/embed/|/live/|[?&]v=)([A-Za-z0-9_-]{11})')
+BILIBILI_ID_PATTERN = re.compile(r'/video/(BV[0-9A-Za-z]{10}|av\d+)', re.IGNORECASE)
+
+
+def normalize_video_key(url):
+    url = url.strip()
+    parsed = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qs(parsed.query)
+    host = parsed.netloc.lower()
+
+    if is_youtube_url(url):
+        video_match = YOUTUBE_ID_PATTERN.search(url)
+        key = f'youtube:{video_match.group(1)}' if video_match else 'youtube'
+        if query.get('list'):
+            key += f':list:{query["list"][0]}'
+        if video_match or query.get('list'):
+            return key
+
+    if 'bilibili.com' in host:
+        video_match = BILIBILI_ID_PATTERN.search(parsed.path)
+        if video_match:
+            key = f'bilibili:{video_match.group(1)}'
+            page = query.get('p', ['1'])[0]
+            return key if page == '1' else f'{key}:p{page}'
+
+    # 其他站点：去掉锚点和统计参数，参数排序后作为键
+    kept_query = sorted(
+        (name, value) for name, value in urllib.parse.parse_qsl(parsed.query)
+        if not name.lower().startswith(('utm_', 'spm', 'from', 'share'))
+    )
+    return urllib.parse.urlunsplit((
+        parsed.scheme.lower(), host, parsed.path.rstrip('/'),
+        urllib.parse.urlencode(kept_query), '',
+    ))
+
+
+def get_file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ''
+    return f'{int(stat.st_mtime)}:{stat.st_size}'
+
+
+class SniffCache:
+    def __init__(self, path, ttl, max_entries, stamp_getter=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # yt-dlp 文件变化（更新）后旧的嗅探结果全部作废
+        self.stamp_getter = stamp_getter or (lambda: '')
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.load()
+
+    def make_key(self, url, cookie_mode):
+        return f'{normalize_video_key(url)}|{cookie_mode}'
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = OrderedDict((key, value) for key, value in data.get('entries', []))
+        except FileNotFoundError:
+            self.entries = OrderedDict()
+        except Exception as e:
+            print(f'读取嗅探缓存失败：{str(e)}')
+            self.entries = OrderedDict()
+
+    def save(self):
+        try:
+            write_json_atomic(self.path, {'entries': list(self.entries.items())})
+        except Exception as e:
+            print(f'写入嗅探缓存失败：{str(e)}')
+
+    def get(self, url, cookie_mode):
+        key = self.make_key(url, cookie_mode)
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            if time.time() - entry.get('time', 0) > self.ttl or entry.get('stamp') != self.stamp_getter():
+                del self.entries[key]
+                self.save()
+                return None
+            self.entries.move_to_end(key)
+            return FormatTable.from_entries(entry.get('formats', []))
+
+    def put(self, url, cookie_mode, formats):
+        if self.max_entries <= 0:
+            return
+        key = self.make_key(url, cookie_mode)
+        with self.lock:
+            self.entries[key] = {
+                'time': time.time(),
+                'stamp': self.stamp_getter(),
+                'formats': formats.to_list(),
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.save()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.save()
+
+
+SUBTITLE_EXT_PATTERN = re.compile(r'^(vtt|ttml|srv\d|json3|srt|ass)$', re.IGNORECASE)
+
+
+def format_size_label(filesize):
+    if not filesize:
+        return ''
+    size_mb = filesize / (1024 * 1024)
+    if size_mb >= 1024:
+        return f'{round(size_mb / 1024, 2)}GB'
+    return f'{round(size_mb, 1)}MB'
+
+
+def pick_probe_entry(info):
+    # 播放列表的 -J 结果把每个视频放在 entries 里，取第一个带格式的条目
+    if info.get('_type') == 'playlist' or 'entries' in info:
+        for entry in info.get('entries') or []:
+            if entry and (entry.get('formats') or entry.get('subtitles') or entry.get('automatic_captions')):
+                return entry
+        return {}
+    return info
+
+
+VIDEO_CODEC_NAMES = [
+    ('avc1', 'H.264'), ('avc3', 'H.264'), ('h264', 'H.264'),
+    ('hvc1', 'HEVC'), ('hev1', 'HEVC'), ('h265', 'HEVC'),
+    ('vp09', 'VP9'), ('vp9', 'VP9'), ('av01', 'AV1'), ('vp8', 'VP8'),
+]
+AUDIO_CODEC_NAMES = [
+    ('mp4a', 'AAC'), ('aac', 'AAC'), ('opus', 'Opus'), ('vorbis', 'Vorbis'),
+    ('mp3', 'MP3'), ('flac', 'FLAC'), ('ec-3', 'E-AC-3'), ('ac-3', 'AC-3'),
+]
+FORMAT_SORT_KEYS = ['height', 'fps', 'tbr', 'filesize', 'codec']
+
+
+def get_codec_name(codec, codec_names):
+    for prefix, name in codec_names:
+        if codec.startswith(prefix):
+            return name
+    return codec.split('.')[0].upper()
+
+
+def make_format_row(format_id, label, kind, **fields):
+    row = {
+        'id': format_id, 'label': label, 'kind': kind, 'codec': None, 'height': None, 'fps': None,
+        'tbr': None, 'filesize': None, 'dynamic_range': None, 'ext': None, 'lang': None,
+    }
+    row.update(fields)
+    return row
+
+
+def get_label_height(format_label):
+    match = re.match(r'^(\d+)p/', format_label)
+    return int(match.group(1)) if match else None
+
+
+def make_legacy_format_row(format_id, label):
+    # 旧版本缓存和播放列表策略只有 (id, 标签)，从标签里还原能排序筛选的字段
+    if format_id.startswith('policy:'):
+        return make_format_row(format_id, label, 'policy')
+    if format_id.startswith('subtitle:'):
+        return make_format_row(format_id, label, 'subtitle', lang=format_id.split(':')[1])
+    parts = label.split('/')
+    if label.startswith('音频/'):
+        return make_format_row(format_id, label, 'audio', codec=parts[1] if len(parts) > 1 else None)
+    return make_format_row(format_id, label, 'video', codec=parts[1] if len(parts) > 1 else None,
+                           height=get_label_height(label))
+
+
+class FormatTable:
+    def __init__(self, rows=None):
+        self.rows = []
+        self.by_id = {}
+        self.by_label = {}
+        for row in rows or []:
+            self.add(row)
+
+    @classmethod
+    def from_entries(cls, entries):
+        return cls(entry if isinstance(entry, dict) else make_legacy_format_row(*entry) for entry in entries)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def add(self, row):
+        if row['id'] in self.by_id:
+            return False
+        # 标签要能反查格式，同名时带上格式 ID 区分
+        if row['label'] in self.by_label:
+            row = dict(row, label=f'{row["label"]} ({row["id"]})')
+        self.rows.append(row)
+        self.by_id[row['id']] = row
+        self.by_label[row['label']] = row
+        return True
+
+    def get(self, format_id):
+        return self.by_id.get(format_id)
+
+    def find_label(self, label):
+        return self.by_label.get(label)
+
+    def filter(self, kinds=None, codecs=None, min_height=None, max_height=None, min_fps=None, hdr=None):
+        def matches(row):
+            if kinds and row['kind'] not in kinds:
+                return False
+            if row['kind'] not in ('video', 'audio'):
+                return True
+            if codecs and row['codec'] not in codecs:
+                return False
+            if row['kind'] == 'audio':
+                return True
+            height = row['height'] or 0
+            if min_height and height < min_height:
+                return False
+            if max_height and height > max_height:
+                return False
+            if min_fps and (row['fps'] or 0) < min_fps:
+                return False
+            if hdr is not None and bool(row['dynamic_range']) != hdr:
+                return False
+            return True
+
+        return FormatTable(row for row in self.rows if matches(row))
+
+    def sorted(self, key='height', reverse=True):
+        # 缺少该字段的行始终排在最后
+        known = [row for row in self.rows if row.get(key) is not None]
+        unknown = [row for row in self.rows if row.get(key) is None]
+        return FormatTable(sorted(known, key=lambda row: row[key], reverse=reverse) + unknown)
+
+    def pairs(self):
+        return [(row['id'], row['label']) for row in self.rows]
+
+    def to_list(self):
+        return [dict(row) for row in self.rows]
+
+
+def parse_format_entries(info):
+    videos = []
+    audios = []
+    for fmt in info.get('formats') or []:
+        format_id = str(fmt.get('format_id') or '')
+        if not format_id:
+            continue
+        vcodec = str(fmt.get('vcodec') or 'none').lower()
+        acodec = str(fmt.get('acodec') or 'none').lower()
+        ext = str(fmt.get('ext') or '').lower()
+        filesize = fmt.get('filesize') or fmt.get('filesize_approx') or 0
+        size_label = format_size_label(filesize)
+        tbr = fmt.get('tbr') or 0
+
+        if vcodec not in ('none', ''):
+            height = fmt.get('height')
+            if not height:
+                continue
+            codec = get_codec_name(vcodec, VIDEO_CODEC_NAMES)
+            fps = int(fmt['fps']) if fmt.get('fps') else None
+            dynamic_range = fmt.get('dynamic_range')
+            dynamic_range = dynamic_range if dynamic_range and dynamic_range != 'SDR' else None
+            label_parts = [f'{height}p', codec, f'{fps}fps' if fps else '', dynamic_range or '', size_label]
+            videos.append(make_format_row(
+                format_id, '/'.join(part for part in label_parts if part), 'video', codec=codec, height=height,
+                fps=fps, tbr=tbr, filesize=filesize or None, dynamic_range=dynamic_range, ext=ext,
+            ))
+        elif acodec not in ('none', '') or ext in {'m4a', 'aac'}:
+            codec = 'AAC' if acodec in ('none', '') else get_codec_name(acodec, AUDIO_CODEC_NAMES)
+            label_parts = ['音频', codec, size_label]
+            audios.append(make_format_row(
+                format_id, '/'.join(part for part in label_parts if part), 'audio', codec=codec,
+                tbr=fmt.get('abr') or tbr, filesize=filesize or None, ext=ext,
+            ))
+
+    videos.sort(key=lambda row: (row['height'], row['fps'] or 0, row['tbr']), reverse=True)
+    audios.sort(key=lambda row: row['tbr'], reverse=True)
+    return videos + audios
+
+
+def parse_subtitle_entries(info):
+    subtitle_entries = []
+    seen_ids = set()
+    for source_key, subtitle_mode, subtitle_kind in (
+        ('subtitles', 'manual', '字幕'),
+        ('automatic_captions', 'auto', '自动字幕'),
+    ):
+        for subtitle_lang, tracks in (info.get(source_key) or {}).items():
+            exts = [str(track.get('ext') or '') for track in tracks or []]
+            exts = [ext for ext in exts if SUBTITLE_EXT_PATTERN.match(ext)]
+            if not exts:
+                continue
+            subtitle_id = f'subtitle:{subtitle_lang}:{subtitle_mode}'
+            if subtitle_id in seen_ids:
+                continue
+            seen_ids.add(subtitle_id)
+
+            subtitle_name = next((track.get('name') for track in tracks if track.get('name')), '')
+            subtitle_note = ' '.join(part for part in (subtitle_name, ', '.join(exts)) if part)
+            subtitle_info = f'{subtitle_kind}/{subtitle_lang}'
+            if subtitle_note:
+                subtitle_info += f'/{subtitle_note}'
+            subtitle_entries.append(make_format_row(subtitle_id, subtitle_info, 'subtitle', lang=subtitle_lang))
+    return subtitle_entries
+
+
+def build_cookie_args(cookie_mode, cookie_file):
+    if cookie_mode == 'firefox':
+        return ['--cookies-from-browser', 'firefox']
+    if cookie_mode == 'file':
+        return ['--cookies', cookie_file]
+    return []
+
+
+def build_formats_from_info(info):
+    entry = pick_probe_entry(info)
+    formats = FormatTable(parse_format_entries(entry) + parse_subtitle_entries(entry))
+    if not formats:
+        return False, '未找到可用的视频格式或字幕', formats
+    return True, '嗅探完成', formats
+
+
+def format_progress_text(progress):
+    downloaded = progress.get('downloaded_bytes') or 0
+    total = progress.get('total_bytes') or progress.get('total_bytes_estimate') or 0
+    text = '[download]'
+    if total:
+        text += f' {downloaded * 100 / total:.1f}% of {format_size_label(total) or "0MB"}'
+    elif downloaded:
+        text += f' {format_size_label(downloaded)}'
+    if progress.get('speed'):
+        text += f' at {format_size_label(progress["speed"]) or "0MB"}/s'
+    if progress.get('eta') is not None:
+        eta = int(progress['eta'])
+        text += f' ETA {eta // 60:02d}:{eta % 60:02d}'
+    return text
+
+
+PROGRESS_PREFIX = '[progress] '
+PROGRESS_FIELDS = [
+    'status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate',
+    'speed', 'eta', 'fragment_index', 'fragment_count',
+]
+# 让 yt-dlp 按固定字段输出进度，不再解析给人看的进度文字
+PROGRESS_TEMPLATE = 'download:' + PROGRESS_PREFIX + '|'.join(f'%(progress.{field})s' for field in PROGRESS_FIELDS)
+
+
+def parse_progress_line(line):
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+    values = line[len(PROGRESS_PREFIX):].split('|')
+    if len(values) != len(PROGRESS_FIELDS):
+        return None
+    progress = {}
+    for field, value in zip(PROGRESS_FIELDS, values):
+        if field == 'status':
+            progress[field] = value
+            continue
+        try:
+            progress[field] = float(value)
+        except ValueError:
+            progress[field] = None
+    return progress
+
+
+def get_progress_percent(progress):
+    total = progress.get('total_bytes') or progress.get('total_bytes_estimate')
+    if total:
+        return min(100.0, (progress.get('downloaded_bytes') or 0) * 100 / total)
+    if progress.get('fragment_count'):
+        return min(100.0, (progress.get('fragment_index') or 0) * 100 / progress['fragment_count'])
+    return None
+
+
+class ProgressThrottle:
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_emit = 0.0
+        self.pending = None
+
+    def offer(self, item, force=False):
+        # 距上次发出不足 interval 的更新只保留最新一条，由 flush() 补发
+        now = time.monotonic()
+        if force or now - self.last_emit >= self.interval:
+            self.last_emit = now
+            self.pending = None
+            return True
+        self.pending = item
+        return False
+
+    def flush(self):
+        item = self.pending
+        self.pending = None
+        return item
+
+
+# Windows 的优先级类由子进程继承，Linux 上用 nice 值，ffmpeg 等子进程同样继承
+WINDOWS_PRIORITY_CLASSES = {'below_normal': 0x00004000, 'idle': 0x00000040}
+POSIX_NICE_VALUES = {'below_normal': 10, 'idle': 19}
+
+
+class ProcessSupervisor:
+    def __init__(self, settings):
+        self.settings = settings
+        self.processes = set()
+        self.lock = threading.Lock()
+
+    def popen(self, cmd, priority='normal'):
+        kwargs = get_popen_kwargs()
+        if os.name == 'nt':
+            # 单独的进程组，取消时只结束这个任务的进程树，不再对自己的 PID 执行 taskkill
+            kwargs['creationflags'] |= subprocess.CREATE_NEW_PROCESS_GROUP | WINDOWS_PRIORITY_CLASSES.get(priority, 0)
+        else:
+            kwargs['start_new_session'] = True
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            **kwargs,
+        )
+        if os.name != 'nt' and priority in POSIX_NICE_VALUES:
+            self.lower_priority(process, priority)
+        with self.lock:
+            self.processes = {item for item in self.processes if item.poll() is None}
+            self.processes.add(process)
+        return process
+
+    def lower_priority(self, process, priority):
+        try:
+            os.setpriority(os.PRIO_PROCESS, process.pid, POSIX_NICE_VALUES[priority])
+            ionice = shutil.which('ionice')
+            if ionice:
+                io_class = ['-c', '3'] if priority == 'idle' else ['-c', '2', '-n', '7']
+                subprocess.run([ionice, *io_class, '-p', str(process.pid)], capture_output=True, timeout=5)
+        except Exception as e:
+            print(f'设置进程优先级失败：{str(e)}')
+
+    def signal_group(self, process, force):
+        if os.name == 'nt':
+            if force:
+                # /T 连同 yt-dlp 启动的 ffmpeg 一起结束
+                subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True, **get_popen_kwargs())
+            else:
+                import signal
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+            return
+        import signal
+        # 被带宽限制暂停的进程收到 SIGCONT 后才会处理 SIGTERM
+        for sig in ((signal.SIGKILL,) if force else (signal.SIGTERM, signal.SIGCONT)):
+            os.killpg(process.pid, sig)
+
+    def terminate(self, process, grace=None):
+        # 立即返回：先通知整个进程组退出，宽限时间后仍有残留就强制结束，调用方不用等待
+        grace = self.settings['cancel_grace_seconds'] if grace is None else grace
+        if process is None:
+            return
+        try:
+            if process.poll() is None:
+                self.signal_group(process, False)
+        except Exception:
+            pass
+        timer = threading.Timer(grace, self.kill, args=(process,))
+        timer.daemon = True
+        timer.start()
+
+    def kill(self, process):
+        # Linux 上进程组长退出后组里的 ffmpeg 可能还在，所以不看 poll() 直接对整个组发送
+        if os.name == 'nt' and process.poll() is not None:
+            return
+        try:
+            self.signal_group(process, True)
+        except ProcessLookupError:
+            pass
+        except Exception as e:
+            print(f'结束进程失败：{str(e)}')
+
+    def stop_all(self, timeout):
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            try:
+                if process.poll() is None:
+                    self.signal_group(process, False)
+            except Exception:
+                pass
+        deadline = time.monotonic() + timeout
+        while any(process.poll() is None for process in processes) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for process in processes:
+            self.kill(process)
+
+
+# yt-dlp 分别下载音视频时加在文件名后的格式编号，例如 .f137.mp4；Intro.fast.mp4 这类普通文件名不算
+STREAM_FILE_PATTERN = re.compile(r'\.f\d[\w-]*\.\w+$')
+
+
+def remove_partial_files(paths):
+    # 只删除 yt-dlp 的临时文件和尚未合并的单独音视频，已经完成的文件不受影响；
+    # paths 只能是本任务 yt-dlp 输出的下载目标，不能是目录里扫描到的文件
+    removed = []
+    for path in paths:
+        candidates = [path + '.part', path + '.ytdl'] + glob.glob(glob.escape(path) + '.part-Frag*')
+        if STREAM_FILE_PATTERN.search(path):
+            candidates.append(path)
+        for candidate in candidates:
+            try:
+                if os.path.isfile(candidate):
+                    os.remove(candidate)
+                    removed.append(candidate)
+            except Exception as e:
+                print(f'删除临时文件失败：{str(e)}')
+    return removed
+
+
+class SubprocessEngine:
+    name = 'subprocess'
+
+    def __init__(self, command_getter, supervisor):
+        self.command_getter = command_getter
+        self.supervisor = supervisor
+
+    def popen(self, cmd, on_process, priority='normal'):
+        process = self.supervisor.popen(cmd, priority)
+        if on_process:
+            on_process(process)
+        return process
+
+    def probe(self, url, cookie_mode, cookie_file, should_stop, on_line, on_process=None, on_info=None):
+        # 一次 -J 探测同时拿到格式和字幕，不再分别调用 -F 和 --list-subs
+        cmd = [self.command_getter(), '-J']
+        cmd.extend(build_cookie_args(cookie_mode, cookie_file))
+        cmd.append(url)
+        process = self.popen(cmd, on_process)
+
+        info = None
+        while not should_stop():
+            line = process.stdout.readline()
+            if not line:
+                break
+            line = line.strip()
+            if line.startswith('{'):
+                try:
+                    info = json.loads(line)
+                except ValueError as e:
+                    print(f"解析嗅探结果错误: {e}")
+                continue
+            if line:
+                on_line(line)
+
+        if should_stop():
+            self.supervisor.terminate(process)
+            return False, '嗅探已取消', FormatTable()
+
+        process.wait()
+        if process.returncode == 0 and info:
+            if on_info:
+                on_info(info)
+            return build_formats_from_info(info)
+        return False, '嗅探失败', FormatTable()
+
+    def list_entries(self, url, cookie_mode, cookie_file, should_stop, on_line, on_entry, on_process=None):
+        # 扁平列出条目，每拿到一条就输出一行 JSON，不等整个列表提取完
+        cmd = [self.command_getter(), '--flat-playlist', '--lazy-playlist', '-j']
+        cmd.extend(build_cookie_args(cookie_mode, cookie_file))
+        cmd.append(url)
+        process = self.popen(cmd, on_process)
+
+        while not should_stop():
+            line = process.stdout.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not line.startswith('{'):
+                if line:
+                    on_line(line)
+                continue
+            try:
+                on_entry(json.loads(line))
+            except ValueError as e:
+                print(f"解析列表条目错误: {e}")
+
+        if should_stop():
+            self.supervisor.terminate(process)
+            return False
+
+        process.wait()
+        return process.returncode == 0
+
+    def extract_cookies(self, browser, path):
+        # 不带链接运行时 yt-dlp 报错退出，但退出前会把从浏览器读取的 Cookies 写入 --cookies 指定的文件
+        process = self.popen([self.command_getter(), '--cookies-from-browser', browser, '--cookies', path], None)
+        try:
+            process.communicate(timeout=COOKIE_EXTRACT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.supervisor.kill(process)
+            process.communicate()
+            return False
+        return os.path.isfile(path) and os.path.getsize(path) > 0
+
+    def build_download_cmd(self, url, request, cookie_file):
+        cmd = [self.command_getter()]
+        if request.get('subtitle_lang'):
+            cmd.append('--write-auto-sub' if request['subtitle_mode'] == 'auto' else '--write-sub')
+            cmd.extend(['--sub-lang', request['subtitle_lang'], '--convert-subs', 'srt', '--skip-download'])
+        else:
+            cmd.extend(['-f', request['format']])
+        cmd.extend(build_cookie_args(request['cookie_mode'], cookie_file))
+        if request.get('merge_output_format'):
+            cmd.extend(['--merge-output-format', request['merge_output_format']])
+        if request.get('output_dir'):
+            cmd.extend(['-P', request['output_dir']])
+        if request.get('output_template'):
+            cmd.extend(['-o', request['output_template']])
+        if request.get('concurrent_fragments'):
+            cmd.extend(['-N', str(request['concurrent_fragments'])])
+        if request.get('http_chunk_size'):
+            cmd.extend(['--http-chunk-size', str(request['http_chunk_size'])])
+        if request.get('external_downloader'):
+            cmd.extend(['--downloader', request['external_downloader']])
+            if request.get('external_downloader_args'):
+                cmd.extend(['--downloader-args', 'aria2c:' + ' '.join(request['external_downloader_args'])])
+        cmd.extend(['--progress-template', PROGRESS_TEMPLATE])
+        # 已经提取过的信息直接载入，yt-dlp 不再访问一遍网页，给出链接时反而会忽略这个文件
+        if request.get('info_json'):
+            cmd.extend(['--load-info-json', request['info_json']])
+        else:
+            cmd.append(url)
+        cmd.append('--newline')
+        return cmd
+
+    def download(self, url, request, cookie_file, should_stop, on_line, on_progress, on_process=None):
+        process = self.popen(self.build_download_cmd(url, request, cookie_file), on_process, request.get('priority', 'normal'))
+        downloaded_file = None
+
+        while not should_stop():
+            line = process.stdout.readline()
+            if not line:
+                break
+            line = line.strip()
+            progress = parse_progress_line(line)
+            if progress is not None:
+                on_progress(progress)
+                continue
+            on_line(line)
+            if '[download] Destination:' in line:
+                downloaded_file = line.split(':', 1)[1].strip()
+            elif '[Merger] Merging formats into ' in line:
+                downloaded_file = line.split('into ', 1)[1].strip().strip('"')
+            elif line.startswith('[download] ') and line.endswith(' has already been downloaded'):
+                # 恢复的任务文件已经完整时 yt-dlp 不再输出 Destination
+                downloaded_file = line[len('[download] '):-len(' has already been downloaded')]
+
+        process.wait()
+        return process.returncode == 0 and not should_stop(), downloaded_file
+
+
+class EngineLogger:
+    def __init__(self, on_line, should_stop=None, cancelled=None):
+        self.on_line = on_line
+        # 嗅探时没有进度回调，也没有进程可以结束，只能在每行输出时检查是否要中断
+        self.should_stop = should_stop
+        self.cancelled = cancelled
+
+    def emit(self, msg):
+        if self.should_stop and self.should_stop():
+            raise self.cancelled()
+        self.on_line(msg)
+
+    def debug(self, msg):
+        # yt-dlp 把普通输出也发到 debug，真正的调试信息带 [debug] 前缀
+        if not msg.startswith('[debug] '):
+            self.emit(msg)
+
+    def info(self, msg):
+        self.emit(msg)
+
+    def warning(self, msg):
+        self.emit(f'WARNING: {msg}')
+
+    def error(self, msg):
+        self.emit(msg)
+
+
+class InProcessEngine:
+    name = 'inprocess'
+
+    def __init__(self, module):
+        self.yt_dlp = module
+
+    def build_params(self, cookie_mode, cookie_file, on_line, should_stop=None):
+        params = {
+            'logger': EngineLogger(on_line, should_stop, self.yt_dlp.utils.DownloadCancelled),
+            'noprogress': True,
+            'color': 'no_color',
+        }
+        if cookie_mode == 'firefox':
+            params['cookiesfrombrowser'] = ('firefox',)
+        elif cookie_mode == 'file':
+            params['cookiefile'] = cookie_file
+        return params
+
+    def extract_cookies(self, browser, path):
+        jar = self.yt_dlp.cookies.extract_cookies_from_browser(browser)
+        jar.save(path)
+        return True
+
+    def probe(self, url, cookie_mode, cookie_file, should_stop, on_line, on_process=None, on_info=None):
+        params = self.build_params(cookie_mode, cookie_file, on_line, should_stop)
+        try:
+            with self.yt_dlp.YoutubeDL(params) as ydl:
+                info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+        except self.yt_dlp.utils.DownloadCancelled:
+            return False, '嗅探已取消', FormatTable()
+        except self.yt_dlp.utils.DownloadError as e:
+            on_line(str(e))
+            return False, '嗅探已取消' if should_stop() else '嗅探失败', FormatTable()
+        if should_stop():
+            return False, '嗅探已取消', FormatTable()
+        if not info:
+            return False, '嗅探失败', FormatTable()
+        if on_info:
+            on_info(info)
+        return build_formats_from_info(info)
+
+    def list_entries(self, url, cookie_mode, cookie_file, should_stop, on_line, on_entry, on_process=None):
+        params = self.build_params(cookie_mode, cookie_file, on_line, should_stop)
+        params.update({'extract_flat': 'in_playlist', 'lazy_playlist': True})
+        try:
+            with self.yt_dlp.YoutubeDL(params) as ydl:
+                info = ydl.extract_info(url, download=False, process=False)
+                # entries 可能是惰性的生成器，边迭代边交给界面
+                for entry in (info or {}).get('entries') or []:
+                    if should_stop():
+                        return False
+                    if entry:
+                        on_entry(ydl.sanitize_info(entry))
+        except self.yt_dlp.utils.DownloadCancelled:
+            return False
+        except self.yt_dlp.utils.DownloadError as e:
+            on_line(str(e))
+            return False
+        return info is not None and not should_stop()
+
+    def download(self, url, request, cookie_file, should_stop, on_line, on_progress, on_process=None):
+        params = self.build_params(request['cookie_mode'], cookie_file, on_line)
+        if request.get('subtitle_lang'):
+            params.update({
+                'writeautomaticsub' if request['subtitle_mode'] == 'auto' else 'writesubtitles': True,
+                'subtitleslangs': [request['subtitle_lang']],
+                'skip_download': True,
+                'postprocessors': [{'key': 'FFmpegSubtitlesConvertor', 'format': 'srt'}],
+            })
+        else:
+            params['format'] = request['format']
+        if request.get('merge_output_format'):
+            params['merge_output_format'] = request['merge_output_format']
+        if request.get('output_dir'):
+            params['paths'] = {'home': request['output_dir']}
+        if request.get('output_template'):
+            params['outtmpl'] = {'default': request['output_template']}
+        if request.get('concurrent_fragments'):
+            params['concurrent_fragment_downloads'] = request['concurrent_fragments']
+        if request.get('http_chunk_size'):
+            params['http_chunk_size'] = request['http_chunk_size']
+        if request.get('external_downloader'):
+            params['external_downloader'] = {'default': request['external_downloader']}
+            params['external_downloader_args'] = {'aria2c': request.get('external_downloader_args') or []}
+
+        result = {'file': None}
+
+        def progress_hook(d):
+            if should_stop():
+                raise self.yt_dlp.utils.DownloadCancelled()
+            if d.get('status') == 'finished':
+                result['file'] = d.get('filename')
+            on_progress({
+                'status': d.get('status'),
+                'downloaded_bytes': d.get('downloaded_bytes'),
+                'total_bytes': d.get('total_bytes'),
+                'total_bytes_estimate': d.get('total_bytes_estimate'),
+                'speed': d.get('speed'),
+                'eta': d.get('eta'),
+                'fragment_index': d.get('fragment_index'),
+                'fragment_count': d.get('fragment_count'),
+                'filename': d.get('filename'),
+            })
+
+        def postprocessor_hook(d):
+            if should_stop():
+                raise self.yt_dlp.utils.DownloadCancelled()
+            on_line(f'[{d.get("postprocessor")}] {d.get("status")}')
+            if d.get('status') == 'finished':
+                result['file'] = (d.get('info_dict') or {}).get('filepath') or result['file']
+
+        params['progress_hooks'] = [progress_hook]
+        params['postprocessor_hooks'] = [postprocessor_hook]
+        try:
+            with self.yt_dlp.YoutubeDL(params) as ydl:
+                if request.get('info_json'):
+                    retcode = ydl.download_with_info_file(request['info_json'])
+                else:
+                    retcode = ydl.download([url])
+        except self.yt_dlp.utils.DownloadCancelled:
+            return False, result['file']
+        except self.yt_dlp.utils.DownloadError as e:
+            on_line(str(e))
+            return False, result['file']
+        return retcode == 0 and not should_stop(), result['file']
+
+
+def load_ytdlp_module():
+    try:
+        import yt_dlp
+    except ImportError:
+        return None
+    return yt_dlp
+
+
+def create_engine(engine_name, command_getter, supervisor):
+    if engine_name in ('auto', 'inprocess'):
+        module = load_ytdlp_module()
+        if module is not None:
+            return InProcessEngine(module)
+        if engine_name == 'inprocess':
+            print('未安装 yt_dlp 模块，改用 yt-dlp 可执行文件')
+    return SubprocessEngine(command_getter, supervisor)
+
+
+PLAYLIST_POLICIES = [
+    ('policy:best', '整个列表/最高画质/H.264'),
+    ('policy:1080', '整个列表/1080p及以下/H.264'),
+    ('policy:720', '整个列表/720p及以下/H.264'),
+    ('policy:480', '整个列表/480p及以下/H.264'),
+    ('policy:audio', '整个列表/音频/AAC'),
+]
+
+PLAYLIST_URL_PATTERNS = [
+    re.compile(r'youtube\.com/(playlist\?|@[^/?#]+/?(videos|shorts|streams)?/?$|channel/|c/|user/)', re.IGNORECASE),
+    re.compile(r'[?&]list=', re.IGNORECASE),
+    re.compile(r'space\.bilibili\.com/|bilibili\.com/(list|medialist|bangumi/play/ss|festival)/', re.IGNORECASE),
+]
+
+
+def is_playlist_url(url):
+    return any(pattern.search(url.strip()) for pattern in PLAYLIST_URL_PATTERNS)
+
+
+YOUTUBE_VIDEO_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/live/|/embed/)([\w-]{11})(?:[?&#/]|$)')
+BILIBILI_VIDEO_PATTERN = re.compile(r'/video/(?:BV[0-9A-Za-z]{10}|av\d+)(?:[?#/]|$)')
+
+
+def get_sniffable_url(text):
+    # 判断输入框里是否已经是完整的视频链接；还在输入中的链接返回 None，不去嗅探
+    url = text.strip()
+    if not re.match(r'^https?://\S+$', url, re.IGNORECASE) or is_playlist_url(url):
+        return None
+    parts = urllib.parse.urlsplit(url)
+    host = parts.hostname or ''
+    if '.' not in host or len(host.rsplit('.', 1)[1]) < 2:
+        return None
+    site = get_site_key(url)
+    if site == 'youtube':
+        return url if YOUTUBE_VIDEO_PATTERN.search(url) else None
+    if site == 'bilibili' and host != 'b23.tv':
+        return url if BILIBILI_VIDEO_PATTERN.search(url) else None
+    # 其他网站看不出链接是否完整，有路径就在输入停顿后嗅探
+    return url if parts.path.strip('/') else None
+
+
+def select_format_for_policy(formats, policy):
+    # 列表策略固定下载 H.264 和 AAC，不受界面显示的编码设置影响
+    if policy == 'policy:audio':
+        audios = formats.filter(kinds=['audio'], codecs=['AAC']).pairs()
+        return audios[0] if audios else None
+
+    videos = formats.filter(kinds=['video'], codecs=['H.264']).sorted('height')
+    if not videos:
+        return None
+    if policy == 'policy:best':
+        return videos.pairs()[0]
+    max_height = int(policy.split(':', 1)[1])
+    # 按分辨率从高到低，取第一个不超过上限的；都超过时退而取最低的
+    capped = videos.filter(max_height=max_height).pairs()
+    return capped[0] if capped else videos.pairs()[-1]
+
+
+def get_entry_url(entry):
+    url = entry.get('url') or entry.get('webpage_url') or ''
+    if url.startswith(('http://', 'https://')):
+        return url
+    video_id = entry.get('id') or url
+    ie_key = str(entry.get('ie_key') or '').lower()
+    if ie_key.startswith('youtube') and video_id:
+        return f'https://www.youtube.com/watch?v={video_id}'
+    if ie_key.startswith('bili') and video_id:
+        return f'https://www.bilibili.com/video/{video_id}'
+    return url
+
+
+def get_archive_identity(url):
+    # 不联网，只从 URL 得出 (站点, 视频 ID)，YouTube 链接里附带的列表参数不影响结果
+    site = get_site_key(url)
+    key = normalize_video_key(url)
+    if key.startswith(f'{site}:'):
+        return site, key[len(site) + 1:].split(':list:')[0]
+    return site, key
+
+
+def get_file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def has_partial_download(path):
+    return os.path.exists(path + '.part') or os.path.exists(path) or bool(glob.glob(glob.escape(path) + '.part-Frag*'))
+
+
+class DownloadArchive:
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS downloads (
+                    extractor TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    requested_format TEXT NOT NULL,
+                    format_id TEXT,
+                    format_label TEXT,
+                    url TEXT,
+                    title TEXT,
+                    output_path TEXT,
+                    size INTEGER,
+                    status TEXT NOT NULL,
+                    completed_at REAL,
+                    PRIMARY KEY (extractor, video_id, requested_format)
+                )
+            ''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS downloads_completed_at ON downloads (completed_at)')
+
+    def lookup(self, url, format_id):
+        extractor, video_id = get_archive_identity(url)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM downloads WHERE extractor = ? AND video_id = ? AND status = 'done' "
+                "AND (requested_format = ? OR format_id = ?) ORDER BY completed_at DESC LIMIT 1",
+                (extractor, video_id, format_id, format_id),
+            ).fetchone()
+        if not row:
+            return None
+        record = dict(row)
+        # 文件被移走、删除或大小不对时当作没下载过，重新下载
+        size = get_file_size(record['output_path']) if record['output_path'] else None
+        if size is None or (record['size'] is not None and size != record['size']):
+            self.remove_entry(extractor, video_id, record['requested_format'])
+            return None
+        return record
+
+    def lookup_partial(self, url, format_id):
+        # 上次没下完的记录，.part 和分片都已经被删掉时不再沿用
+        extractor, video_id = get_archive_identity(url)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM downloads WHERE extractor = ? AND video_id = ? AND status = 'partial' "
+                "AND requested_format = ? AND output_path IS NOT NULL ORDER BY completed_at DESC LIMIT 1",
+                (extractor, video_id, format_id),
+            ).fetchone()
+        if not row:
+            return None
+        record = dict(row)
+        if not has_partial_download(record['output_path']):
+            self.remove_entry(extractor, video_id, record['requested_format'])
+            return None
+        return record
+
+    def record(self, job, status):
+        extractor, video_id = get_archive_identity(job.url)
+        output_path = os.path.abspath(job.output_file) if job.output_file else None
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (extractor, video_id, job.requested_format, job.format_id, job.format_label, job.url, job.title,
+                 output_path, get_file_size(output_path) if output_path else None, status, time.time()),
+            )
+
+    def remove_entry(self, extractor, video_id, requested_format):
+        with self.lock, self.db:
+            self.db.execute(
+                'DELETE FROM downloads WHERE extractor = ? AND video_id = ? AND requested_format = ?',
+                (extractor, video_id, requested_format),
+            )
+
+    def remove(self, url):
+        extractor, video_id = get_archive_identity(url)
+        with self.lock, self.db:
+            return self.db.execute('DELETE FROM downloads WHERE extractor = ? AND video_id = ?',
+                                   (extractor, video_id)).rowcount
+
+    def query(self, search=None, status=None, limit=200):
+        conditions = []
+        params = []
+        if search:
+            conditions.append('(title LIKE ? OR url LIKE ? OR video_id LIKE ? OR output_path LIKE ?)')
+            params.extend([f'%{search}%'] * 4)
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        sql = 'SELECT * FROM downloads'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY completed_at DESC LIMIT ?'
+        params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, params)]
+
+
+class CookiePreferences:
+    def __init__(self, path):
+        self.path = path
+        self.preferred = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.preferred = dict(json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'读取 Cookies 偏好失败：{str(e)}')
+
+    def order(self, site, cookie_modes):
+        # 上次在该站点胜出的方式排在最前
+        preferred = self.preferred.get(site)
+        if preferred in cookie_modes:
+            return [preferred] + [mode for mode in cookie_modes if mode != preferred]
+        return list(cookie_modes)
+
+    def record(self, site, cookie_mode):
+        if self.preferred.get(site) == cookie_mode:
+            return
+        self.preferred[site] = cookie_mode
+        try:
+            write_json_atomic(self.path, self.preferred)
+        except Exception as e:
+            print(f'写入 Cookies 偏好失败：{str(e)}')
+
+
+COOKIE_BROWSER = 'firefox'
+COOKIE_EXTRACT_TIMEOUT = 120
+# 提取失败后这么多秒内不再尝试，直接让 yt-dlp 自己读取浏览器
+COOKIE_RETRY_SECONDS = 300
+COOKIE_LEASE_MAX_AGE = 24 * 3600
+# 出现这些输出说明 Cookies 已经失效，下次使用前重新从浏览器提取
+COOKIE_AUTH_ERRORS = (
+    'Sign in to confirm',
+    'cookies are no longer valid',
+    'Use --cookies-from-browser or --cookies for the authentication',
+)
+
+
+def make_file_private(path):
+    # Cookies 文件只允许当前用户读取
+    if os.name != 'nt':
+        os.chmod(path, 0o600)
+
+
+class CookieLease:
+    def __init__(self, jar, mode, path, generation=None, on_line=None):
+        self.jar = jar
+        self.mode = mode
+        self.path = path
+        # 从浏览器提取的 Cookies 的版本，None 表示不是提取的，失效时无法刷新
+        self.generation = generation
+        self.target = on_line
+
+    def on_line(self, line):
+        if self.generation is not None and any(error in line for error in COOKIE_AUTH_ERRORS):
+            self.jar.invalidate(self.generation)
+        if self.target:
+            self.target(line)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def release(self):
+        if self.path and os.path.dirname(self.path) == self.jar.lease_dir:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f'删除 Cookies 副本失败：{str(e)}')
+
+
+class CookieJar:
+    def __init__(self, core):
+        self.core = core
+        self.directory = get_cookie_dir()
+        self.browser_path = os.path.join(self.directory, f'{COOKIE_BROWSER}-cookies.txt')
+        self.lease_dir = os.path.join(self.directory, 'leases')
+        # None 表示还没看过磁盘上的文件，0 表示已经失效
+        self.extracted_at = None
+        self.failed_at = None
+        self.next_lease = 0
+        self.lock = threading.Lock()
+        self.extract_lock = threading.Lock()
+        self.prune_leases()
+
+    def prune_leases(self):
+        # 程序异常退出时留下的副本
+        now = time.time()
+        for path in glob.glob(os.path.join(self.lease_dir, '*.txt')):
+            try:
+                if now - os.path.getmtime(path) > COOKIE_LEASE_MAX_AGE:
+                    os.remove(path)
+            except Exception as e:
+                print(f'清理 Cookies 副本失败：{str(e)}')
+
+    def get_browser_jar(self):
+        # 同一时间只提取一次，其他嗅探和下载等它完成后直接使用
+        with self.extract_lock:
+            now = time.time()
+            if self.extracted_at is None:
+                self.extracted_at = os.path.getmtime(self.browser_path) if os.path.exists(self.browser_path) else 0
+            ttl = float(self.core.settings['cookie_jar_ttl'])
+            if self.extracted_at and now - self.extracted_at < ttl:
+                return self.browser_path, self.extracted_at
+            if self.failed_at and now - self.failed_at < COOKIE_RETRY_SECONDS:
+                return None, None
+            temp_path = self.browser_path + '.tmp'
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                if self.core.engine.extract_cookies(COOKIE_BROWSER, temp_path):
+                    make_file_private(temp_path)
+                    os.replace(temp_path, self.browser_path)
+                    self.extracted_at = time.time()
+                    self.failed_at = None
+                    return self.browser_path, self.extracted_at
+            except Exception as e:
+                print(f'提取浏览器 Cookies 失败：{str(e)}')
+            self.failed_at = now
+            return None, None
+
+    def invalidate(self, generation):
+        # 同一批副本可能有好几个命令同时报错，只让对应的那次提取失效，不反复提取
+        with self.extract_lock:
+            if self.extracted_at == generation:
+                self.extracted_at = 0
+                self.failed_at = None
+
+    def lease(self, cookie_mode, on_line=None):
+        # 每个命令使用单独的副本，yt-dlp 退出时会写回 Cookies 文件，共用一个文件会互相覆盖
+        generation = None
+        if cookie_mode == COOKIE_BROWSER:
+            source, generation = self.get_browser_jar()
+            if source is None:
+                return CookieLease(self, cookie_mode, None, on_line=on_line)
+        elif cookie_mode == 'file' and os.path.exists(self.core.cookie_file):
+            source = self.core.cookie_file
+        else:
+            return CookieLease(self, cookie_mode, self.core.cookie_file, on_line=on_line)
+        with self.lock:
+            self.next_lease += 1
+            path = os.path.join(self.lease_dir, f'{os.getpid()}-{self.next_lease}.txt')
+        try:
+            os.makedirs(self.lease_dir, exist_ok=True)
+            shutil.copyfile(source, path)
+            make_file_private(path)
+        except Exception as e:
+            print(f'复制 Cookies 失败：{str(e)}')
+            return CookieLease(self, cookie_mode, self.core.cookie_file, on_line=on_line)
+        return CookieLease(self, 'file', path, generation, on_line)
+
+    def save_manual(self, text):
+        os.makedirs(os.path.dirname(self.core.cookie_file), exist_ok=True)
+        write_text_atomic(self.core.cookie_file, text)
+        make_file_private(self.core.cookie_file)
+        # 旧版本放在所有用户共享的临时目录，保存新的之后删除
+        legacy_path = os.path.join(tempfile.gettempdir(), 'YouTube-Cookies.txt')
+        if os.path.exists(legacy_path) and os.path.abspath(legacy_path) != os.path.abspath(self.core.cookie_file):
+            try:
+                os.remove(legacy_path)
+            except Exception as e:
+                print(f'删除旧的 Cookies 文件失败：{str(e)}')
+
+
+TUNING_LEVELS = {
+    'fragments': [1, 2, 4, 8, 16],
+    'chunk': [1024 * 1024, 4 * 1024 * 1024, 10 * 1024 * 1024, 32 * 1024 * 1024],
+}
+# 速度至少提高这么多才算调优有效，避免被网络抖动带着来回跳
+TUNING_MIN_GAIN = 0.1
+# 两个方向都没有提升后，先按最佳值跑这么多个任务再重新试探
+TUNING_HOLD_JOBS = 5
+
+
+def get_nearest_level(levels, value):
+    return min(levels, key=lambda level: abs(level - value))
+
+
+class ThroughputSample:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.start_time = None
+        self.start_bytes = 0
+        self.last_time = None
+        self.last_bytes = 0
+        self.fragmented = False
+        self.speed = None
+
+    def offer(self, progress):
+        downloaded = progress.get('downloaded_bytes')
+        if self.speed is not None or progress.get('status') != 'downloading' or downloaded is None:
+            return
+        if progress.get('fragment_count'):
+            self.fragmented = True
+        now = time.monotonic()
+        # 从第一条进度开始计时，不算提取和连接的耗时；换到下一个文件时重新计
+        if self.start_time is None or downloaded < self.last_bytes:
+            self.start_time = now
+            self.start_bytes = downloaded
+        self.last_time = now
+        self.last_bytes = downloaded
+        if now - self.start_time >= self.seconds:
+            self.speed = (downloaded - self.start_bytes) / (now - self.start_time)
+
+    def finish(self):
+        # 任务在采样窗口内就下完了，只要采到一秒以上也记一次
+        if self.speed is None and self.start_time is not None and self.last_time - self.start_time >= 1:
+            self.speed = (self.last_bytes - self.start_bytes) / (self.last_time - self.start_time)
+        return self.speed
+
+
+class DownloadTuner:
+    def __init__(self, path, settings):
+        self.path = path
+        self.enabled = bool(settings['download_auto_tune'])
+        self.defaults = {
+            'fragments': get_nearest_level(TUNING_LEVELS['fragments'], int(settings['concurrent_fragments'] or 1)),
+            'chunk': int(settings['http_chunk_size'] or 0),
+        }
+        self.sites = {}
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.sites = dict(json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'读取下载调优记录失败：{str(e)}')
+
+    def get_state(self, site, dimension):
+        states = self.sites.setdefault(site, {})
+        if dimension not in states:
+            value = self.defaults[dimension]
+            states[dimension] = {
+                'value': value, 'best_value': value, 'best_speed': 0,
+                'direction': 1, 'misses': 0, 'hold': 0,
+            }
+        return states[dimension]
+
+    def suggest(self, site):
+        if not self.enabled:
+            return {'concurrent_fragments': self.defaults['fragments'], 'http_chunk_size': self.defaults['chunk']}
+        with self.lock:
+            chunk = self.get_state(site, 'chunk')['value'] if self.defaults['chunk'] else 0
+            return {'concurrent_fragments': self.get_state(site, 'fragments')['value'], 'http_chunk_size': chunk}
+
+    def record(self, site, tuning, sample):
+        speed = sample.finish()
+        dimension = 'fragments' if sample.fragmented else 'chunk'
+        if not self.enabled or not speed or (dimension == 'chunk' and not self.defaults['chunk']):
+            return
+        value = tuning['concurrent_fragments'] if dimension == 'fragments' else tuning['http_chunk_size']
+        with self.lock:
+            state = self.get_state(site, dimension)
+            # 同时跑的其他任务已经让这个站点换了参数，这次的测量作废
+            if state['value'] != value:
+                return
+            if speed > state['best_speed'] * (1 + TUNING_MIN_GAIN):
+                state['best_value'] = value
+                state['best_speed'] = speed
+                state['misses'] = 0
+            elif value == state['best_value']:
+                # 网络情况会变，最佳值的速度取移动平均，不让一次偶然的高速一直压着
+                state['best_speed'] = (state['best_speed'] + speed) / 2
+            else:
+                state['misses'] += 1
+                state['direction'] = -state['direction']
+
+            levels = TUNING_LEVELS[dimension]
+            best_index = levels.index(get_nearest_level(levels, state['best_value']))
+            next_index = best_index + state['direction']
+            if state['hold'] > 0:
+                state['hold'] -= 1
+                next_index = best_index
+            elif state['misses'] >= 2 or not 0 <= next_index < len(levels):
+                state['direction'] = -state['direction']
+                state['misses'] = 0
+                state['hold'] = TUNING_HOLD_JOBS
+                next_index = best_index
+            state['value'] = levels[next_index]
+            try:
+                write_json_atomic(self.path, self.sites)
+            except Exception as e:
+                print(f'写入下载调优记录失败：{str(e)}')
+
+
+METRICS_LOG_MAX_BYTES = 10 * 1024 * 1024
+POSTPROCESS_LINE_PREFIXES = ('[Merger]', '[FixupM', '[FFmpeg', '[VideoConvertor]', '[VideoRemuxer]')
+PROMETHEUS_METRICS = [
+    ('yt_dlp_gui_jobs_total', 'counter', '已结束的任务数'),
+    ('yt_dlp_gui_phase_seconds_total', 'counter', '各阶段累计耗时（秒）'),
+    ('yt_dlp_gui_bytes_total', 'counter', '累计下载字节数'),
+    ('yt_dlp_gui_retries_total', 'counter', 'yt-dlp 报告的重试次数'),
+    ('yt_dlp_gui_last_avg_speed_bytes', 'gauge', '最近一个下载任务的平均速度（字节/秒）'),
+    ('yt_dlp_gui_last_peak_speed_bytes', 'gauge', '最近一个下载任务的峰值速度（字节/秒）'),
+    ('yt_dlp_gui_last_job_timestamp_seconds', 'gauge', '最近一个任务结束的时间'),
+]
+
+
+class JobMetrics:
+    def __init__(self, kind, url, phase):
+        self.kind = kind
+        self.url = url
+        self.site = get_site_key(url)
+        self.started = time.time()
+        self.timer = PhaseTimer()
+        self.phase = phase
+        self.finished_bytes = 0
+        self.file_bytes = 0
+        self.peak_speed = 0
+        self.retries = 0
+        self.attempts = 0
+        self.lock = threading.Lock()
+
+    def enter(self, phase):
+        # 进入新阶段时把到现在为止的耗时记到上一阶段名下
+        with self.lock:
+            if phase == self.phase:
+                return
+            if self.phase:
+                self.timer.mark(self.phase)
+            self.phase = phase
+
+    def process_started(self, process):
+        if self.phase == 'spawn':
+            self.enter('extract')
+
+    def add_postprocess_phases(self, phases):
+        # 后处理线程池里分别计时的重命名、校验和哈希记到各自名下，其余的是在线程池排队的时间
+        with self.lock:
+            now = time.perf_counter()
+            waited = now - self.timer.last - sum(phases.values())
+            self.timer.phases.append(('postprocess_wait', max(0.0, waited)))
+            self.timer.phases.extend(phases.items())
+            self.timer.last = now
+            self.phase = None
+
+    def observe_line(self, line):
+        if 'Retrying' in line:
+            self.retries += 1
+        if line.startswith(POSTPROCESS_LINE_PREFIXES):
+            self.enter('merge')
+
+    def observe_progress(self, progress):
+        downloaded = progress.get('downloaded_bytes')
+        if downloaded is None:
+            return
+        if progress.get('status') == 'downloading':
+            self.enter('download')
+        # 视频下完再下音频时字节数从零开始，把上一个文件的字节数累加起来
+        if downloaded < self.file_bytes:
+            self.finished_bytes += self.file_bytes
+        self.file_bytes = downloaded
+        if progress.get('speed'):
+            self.peak_speed = max(self.peak_speed, progress['speed'])
+
+    def finish(self, result, engine_name, ytdlp_version):
+        self.enter(None)
+        phases = {}
+        for name, seconds in self.timer.phases:
+            phases[name] = phases.get(name, 0) + seconds
+        total_bytes = int(self.finished_bytes + self.file_bytes)
+        download_seconds = phases.get('download', 0)
+        return {
+            'time': round(self.started, 3),
+            'kind': self.kind,
+            'site': self.site,
+            'url': self.url,
+            'result': result,
+            'engine': engine_name,
+            'ytdlp_version': ytdlp_version,
+            'duration': round(self.timer.total(), 3),
+            'phases': {name: round(seconds, 3) for name, seconds in phases.items()},
+            'bytes': total_bytes,
+            'avg_speed': round(total_bytes / download_seconds) if total_bytes and download_seconds > 0 else None,
+            'peak_speed': round(self.peak_speed) or None,
+            'retries': self.retries,
+            'attempts': self.attempts,
+        }
+
+
+def format_prometheus_labels(labels):
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class MetricsRecorder:
+    def __init__(self, directory):
+        self.jsonl_path = os.path.join(directory, 'jobs.jsonl')
+        self.prom_path = os.path.join(directory, 'yt_dlp_gui.prom')
+        # 计数器只在本次运行内累加，程序重启后归零，Prometheus 的 rate() 能正确处理
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def add(self, metric, labels, value):
+        key = (metric, tuple(labels))
+        self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, metric, labels, value):
+        self.values[(metric, tuple(labels))] = value
+
+    def update(self, record):
+        kind_site = [('kind', record['kind']), ('site', record['site'])]
+        self.add('yt_dlp_gui_jobs_total', kind_site + [
+            ('result', record['result']), ('ytdlp_version', record['ytdlp_version'] or ''),
+        ], 1)
+        for phase, seconds in record['phases'].items():
+            self.add('yt_dlp_gui_phase_seconds_total', kind_site + [('phase', phase)], seconds)
+        self.add('yt_dlp_gui_retries_total', kind_site, record['retries'])
+        self.set('yt_dlp_gui_last_job_timestamp_seconds', kind_site, record['time'] + record['duration'])
+        if record['kind'] == 'download':
+            site = [('site', record['site'])]
+            self.add('yt_dlp_gui_bytes_total', site, record['bytes'])
+            if record['avg_speed']:
+                self.set('yt_dlp_gui_last_avg_speed_bytes', site, record['avg_speed'])
+            if record['peak_speed']:
+                self.set('yt_dlp_gui_last_peak_speed_bytes', site, record['peak_speed'])
+
+    def render(self):
+        lines = []
+        for metric, metric_type, help_text in PROMETHEUS_METRICS:
+            samples = sorted((labels, value) for (name, labels), value in self.values.items() if name == metric)
+            if not samples:
+                continue
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{metric}{format_prometheus_labels(labels)} {round(value, 3)}')
+        return '\n'.join(lines) + '\n'
+
+    def record(self, record):
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.jsonl_path), exist_ok=True)
+                if os.path.exists(self.jsonl_path) and os.path.getsize(self.jsonl_path) > METRICS_LOG_MAX_BYTES:
+                    os.replace(self.jsonl_path, self.jsonl_path + '.1')
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self.update(record)
+                # node_exporter 可能随时读取，必须整体替换，不能边写边读
+                write_text_atomic(self.prom_path, self.render())
+            except Exception as e:
+                print(f'写入任务指标失败：{str(e)}')
+
+
+def find_external_downloader(name):
+    if not name:
+        return None
+    local_path = os.path.join(get_runtime_dir(), name + ('.exe' if os.name == 'nt' else ''))
+    if os.path.exists(local_path):
+        return local_path
+    return shutil.which(name)
+
+
+BANDWIDTH_TICK = 0.2
+BANDWIDTH_REBALANCE_INTERVAL = 1.0
+RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate_limit(value):
+    # 支持 20M、512K、1.5GB/s 或直接的字节数，0 表示不限速
+    if isinstance(value, (int, float)):
+        return max(0, int(value))
+    match = re.match(r'^\s*([\d.]+)\s*([KMG]?)I?B?(/S)?\s*$', str(value or '0').upper())
+    if not match:
+        raise ValueError(f'无法识别的速度：{value}')
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2)])
+
+
+def parse_schedule_time(text):
+    hour, minute = str(text).split(':', 1)
+    return int(hour) * 60 + int(minute)
+
+
+def get_scheduled_limit(schedule, default_limit, now=None):
+    now = now or time.localtime()
+    minutes = now.tm_hour * 60 + now.tm_min
+    for rule in schedule or []:
+        try:
+            start = parse_schedule_time(rule['start'])
+            end = parse_schedule_time(rule['end'])
+            if start <= end:
+                in_range, weekday = start <= minutes < end, now.tm_wday
+            else:
+                # 跨过午夜的时段，午夜之后的部分算作前一天
+                in_range = minutes >= start or minutes < end
+                weekday = now.tm_wday if minutes >= start else (now.tm_wday - 1) % 7
+            if in_range and (not rule.get('days') or weekday in rule['days']):
+                return parse_rate_limit(rule.get('limit', 0))
+        except (KeyError, ValueError) as e:
+            print(f'带宽时段配置无效：{str(e)}')
+    return parse_rate_limit(default_limit)
+
+
+def get_windows_process_tree(pid):
+    # 按父进程号找出 yt-dlp 启动的 ffmpeg、aria2c 等全部子孙进程，父进程排在前面
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESSENTRY32W(ctypes.Structure):
+        _fields_ = [
+            ('dwSize', wintypes.DWORD),
+            ('cntUsage', wintypes.DWORD),
+            ('th32ProcessID', wintypes.DWORD),
+            ('th32DefaultHeapID', ctypes.c_size_t),
+            ('th32ModuleID', wintypes.DWORD),
+            ('cntThreads', wintypes.DWORD),
+            ('th32ParentProcessID', wintypes.DWORD),
+            ('pcPriClassBase', ctypes.c_long),
+            ('dwFlags', wintypes.DWORD),
+            ('szExeFile', ctypes.c_wchar * 260),
+        ]
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+    # TH32CS_SNAPPROCESS
+    snapshot = kernel32.CreateToolhelp32Snapshot(0x00000002, 0)
+    if not snapshot or snapshot == wintypes.HANDLE(-1).value:
+        return [pid]
+    children = {}
+    try:
+        entry = PROCESSENTRY32W()
+        entry.dwSize = ctypes.sizeof(PROCESSENTRY32W)
+        found = kernel32.Process32FirstW(snapshot, ctypes.byref(entry))
+        while found:
+            children.setdefault(entry.th32ParentProcessID, []).append(entry.th32ProcessID)
+            found = kernel32.Process32NextW(snapshot, ctypes.byref(entry))
+    finally:
+        kernel32.CloseHandle(snapshot)
+    tree = [pid]
+    for parent in tree:
+        tree.extend(child for child in children.get(parent, []) if child not in tree)
+    return tree
+
+
+def set_process_suspended(process, suspended):
+    # 暂停整个进程树，否则 yt-dlp 停了，它启动的 aria2c、ffmpeg 还在继续下载
+    if os.name == 'nt':
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.windll.kernel32
+        kernel32.OpenProcess.restype = wintypes.HANDLE
+        ntdll = ctypes.windll.ntdll
+        action = ntdll.NtSuspendProcess if suspended else ntdll.NtResumeProcess
+        pids = get_windows_process_tree(process.pid)
+        result = False
+        # 暂停时先停父进程，免得它在遍历期间再启动新的子进程；恢复时反过来
+        for pid in (pids if suspended else reversed(pids)):
+            # PROCESS_SUSPEND_RESUME
+            handle = kernel32.OpenProcess(0x0800, False, pid)
+            if not handle:
+                continue
+            try:
+                ok = action(handle) == 0
+            finally:
+                kernel32.CloseHandle(handle)
+            if pid == process.pid:
+                result = ok
+        return result
+    import signal
+    sig = signal.SIGSTOP if suspended else signal.SIGCONT
+    pgid = os.getpgid(process.pid)
+    if pgid == os.getpgrp():
+        # 没有单独进程组的进程只能发给它自己，不能把本程序也一起暂停
+        os.kill(process.pid, sig)
+    else:
+        os.killpg(pgid, sig)
+    return True
+
+
+class TokenBucket:
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.rate:
+            # 最多攒 1 秒的量，空闲之后不会一下子冲满带宽
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        else:
+            self.tokens = 0.0
+        self.updated = now
+
+    def set_rate(self, rate, now):
+        self.refill(now)
+        self.rate = rate
+
+    def take(self, amount, now):
+        # 返回还要等多久才能把透支的量补回来
+        self.refill(now)
+        if not self.rate:
+            return 0.0
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+
+class BandwidthTransfer:
+    def __init__(self, governor, job):
+        self.governor = governor
+        self.job = job
+        self.bucket = TokenBucket()
+        # 音视频分开下载时一个任务同时有两个进程，一起暂停和恢复
+        self.processes = []
+        self.suspended = False
+        self.last_bytes = 0
+        # 上次分配以来收到的字节数和是否被限速过，用来估计任务实际需要多少带宽
+        self.received = 0
+        self.throttled = False
+
+    def set_process(self, process):
+        with self.governor.lock:
+            self.governor.set_suspended(self, False)
+            self.processes = [item for item in self.processes if item.poll() is None] + [process]
+
+    def observe(self, progress, should_stop):
+        downloaded = progress.get('downloaded_bytes')
+        if downloaded is None:
+            return
+        wait = self.governor.consume(self, int(downloaded))
+        # 进程内引擎直接在进度回调里等待，yt-dlp 的下载线程就停在这里；子进程由调节线程暂停
+        if not self.processes and wait > 0:
+            deadline = time.monotonic() + wait
+            while wait > 0 and not should_stop():
+                time.sleep(min(wait, BANDWIDTH_TICK))
+                wait = deadline - time.monotonic()
+
+    def close(self):
+        self.governor.unregister(self)
+
+
+class BandwidthGovernor:
+    def __init__(self, settings):
+        self.settings = settings
+        # 界面或命令行临时指定的总带宽，None 表示按配置和时段
+        self.override = None
+        self.transfers = []
+        self.total_limit = 0
+        self.last_rebalance = time.monotonic()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def get_total_limit(self):
+        if self.override is not None:
+            return self.override
+        return get_scheduled_limit(self.settings['bandwidth_schedule'], self.settings['bandwidth_limit'])
+
+    def set_limit(self, limit):
+        # 立即对正在下载的任务生效，不需要重启任务
+        override = None if limit is None else parse_rate_limit(limit)
+        with self.lock:
+            self.override = override
+            self.rebalance(time.monotonic())
+
+    def register(self, job):
+        transfer = BandwidthTransfer(self, job)
+        with self.lock:
+            self.transfers.append(transfer)
+            self.rebalance(time.monotonic())
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return transfer
+
+    def unregister(self, transfer):
+        with self.lock:
+            if transfer not in self.transfers:
+                return
+            self.transfers.remove(transfer)
+            self.set_suspended(transfer, False)
+            self.rebalance(time.monotonic())
+
+    def update_priority(self):
+        with self.lock:
+            self.rebalance(time.monotonic())
+
+    def consume(self, transfer, downloaded):
+        with self.lock:
+            # 先下视频再下音频时，进度会从新文件重新计数
+            delta = downloaded - transfer.last_bytes if downloaded >= transfer.last_bytes else downloaded
+            transfer.last_bytes = downloaded
+            transfer.received += delta
+            wait = transfer.bucket.take(delta, time.monotonic())
+            if wait:
+                transfer.throttled = True
+            return wait
+
+    def rebalance(self, now):
+        self.total_limit = self.get_total_limit()
+        elapsed = max(now - self.last_rebalance, BANDWIDTH_TICK)
+        self.last_rebalance = now
+        shares = {}
+        pending = list(self.transfers)
+        remaining = self.total_limit
+        # 按优先级加权分配；用不满份额的任务只保留实际用量（留些余量），多出来的再分给其他任务
+        while remaining and pending:
+            weights = sum(transfer.job.priority for transfer in pending)
+            capped = []
+            for transfer in pending:
+                share = remaining * transfer.job.priority / weights
+                demand = transfer.received / elapsed * 1.25
+                if transfer.received and not transfer.throttled and demand < share:
+                    capped.append((transfer, demand))
+            if not capped:
+                for transfer in pending:
+                    shares[transfer] = remaining * transfer.job.priority / weights
+                break
+            for transfer, demand in capped:
+                shares[transfer] = demand
+                remaining -= demand
+                pending.remove(transfer)
+        for transfer in self.transfers:
+            transfer.bucket.set_rate(int(shares.get(transfer, 0)), now)
+            transfer.received = 0
+            transfer.throttled = False
+
+    def set_suspended(self, transfer, suspended):
+        if not transfer.processes or transfer.suspended == suspended:
+            return
+        try:
+            processes = [process for process in transfer.processes if process.poll() is None]
+            if suspended and not processes:
+                return
+            for process in processes:
+                set_process_suspended(process, suspended)
+            transfer.suspended = suspended
+        except Exception as e:
+            print(f'{"暂停" if suspended else "恢复"}下载进程失败：{str(e)}')
+
+    def run(self):
+        while True:
+            time.sleep(BANDWIDTH_TICK)
+            with self.lock:
+                if not self.transfers:
+                    self.thread = None
+                    return
+                now = time.monotonic()
+                # 定期重新分配，时段切换和任务实际用量的变化都在这里生效
+                if now - self.last_rebalance >= BANDWIDTH_REBALANCE_INTERVAL:
+                    self.rebalance(now)
+                for transfer in self.transfers:
+                    if not transfer.processes:
+                        continue
+                    # 子进程无法在进度回调里等待，透支时暂停整个 yt-dlp 进程，补回来后继续
+                    transfer.bucket.refill(now)
+                    self.set_suspended(transfer, bool(transfer.bucket.rate) and transfer.bucket.tokens < 0)
+
+
+class DownloaderCore:
+    def __init__(self, settings=None, cookie_file=None):
+        self.settings = settings or load_settings()
+        # 手动粘贴的 Cookies 放在程序目录，不再放在所有用户共享的临时目录
+        self.cookie_file = cookie_file or os.path.join(get_cookie_dir(), 'manual-cookies.txt')
+        self.manual_cookie_enabled = False
+        self.ytdlp_path = None
+        # 缓存文件和 yt-dlp 引擎都在第一次用到时才加载，不拖慢启动
+        self._sniff_cache = None
+        self._cookie_preferences = None
+        self._cookies = None
+        self._engine = None
+        self._supervisor = None
+        self._download_tuner = None
+        self._metrics = None
+        self._archive = None
+        self._postprocessor = None
+        self._bandwidth = None
+        self._ytdlp_version = None
+        self.job_logs_pruned = False
+        self.lock = threading.Lock()
+
+    @property
+    def sniff_cache(self):
+        with self.lock:
+            if self._sniff_cache is None:
+                self._sniff_cache = SniffCache(
+                    os.path.join(get_cache_dir(), 'sniff_cache.json'),
+                    self.settings['sniff_cache_ttl'],
+                    self.settings['sniff_cache_max_entries'],
+                    lambda: get_file_stamp(self.get_ytdlp_command()),
+                )
+            return self._sniff_cache
+
+    @property
+    def cookie_preferences(self):
+        with self.lock:
+            if self._cookie_preferences is None:
+                self._cookie_preferences = CookiePreferences(os.path.join(get_cache_dir(), 'cookie_preferences.json'))
+            return self._cookie_preferences
+
+    @property
+    def cookies(self):
+        with self.lock:
+            if self._cookies is None:
+                self._cookies = CookieJar(self)
+            return self._cookies
+
+    @property
+    def supervisor(self):
+        with self.lock:
+            if self._supervisor is None:
+                self._supervisor = ProcessSupervisor(self.settings)
+            return self._supervisor
+
+    @property
+    def engine(self):
+        supervisor = self.supervisor
+        with self.lock:
+            if self._engine is None:
+                self._engine = create_engine(self.settings['engine'], self.get_ytdlp_command, supervisor)
+            return self._engine
+
+    @property
+    def download_tuner(self):
+        with self.lock:
+            if self._download_tuner is None:
+                self._download_tuner = DownloadTuner(os.path.join(get_cache_dir(), 'download_tuning.json'), self.settings)
+            return self._download_tuner
+
+    @property
+    def metrics(self):
+        with self.lock:
+            if self._metrics is None:
+                self._metrics = MetricsRecorder(self.settings['metrics_dir'] or os.path.join(get_runtime_dir(), 'metrics'))
+            return self._metrics
+
+    @property
+    def archive(self):
+        with self.lock:
+            if self._archive is None:
+                self._archive = DownloadArchive(os.path.join(get_runtime_dir(), 'download_archive.sqlite3'))
+            return self._archive
+
+    @property
+    def postprocessor(self):
+        with self.lock:
+            if self._postprocessor is None:
+                self._postprocessor = PostProcessor(self.settings['postprocess_workers'], self.settings['postprocess_hash'])
+            return self._postprocessor
+
+    @property
+    def bandwidth(self):
+        with self.lock:
+            if self._bandwidth is None:
+                self._bandwidth = BandwidthGovernor(self.settings)
+            return self._bandwidth
+
+    def create_job_log(self, job, path=None, previous=None):
+        log_dir = self.settings['job_log_dir'] or os.path.join(get_runtime_dir(), 'logs')
+        with self.lock:
+            if not self.job_logs_pruned:
+                self.job_logs_pruned = True
+                prune_job_logs(log_dir, self.settings['job_log_keep'])
+        if not path:
+            name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{job.job_id}.log.gz'
+            path = os.path.join(log_dir, name)
+        return JobLog(path, self.settings['job_log_lines'], previous)
+
+    def lookup_archive(self, url, format_id):
+        if not self.settings['download_archive']:
+            return None
+        try:
+            return self.archive.lookup(url, format_id)
+        except Exception as e:
+            print(f'读取下载记录失败：{str(e)}')
+            return None
+
+    def lookup_partial_archive(self, url, format_id):
+        if not self.settings['download_archive']:
+            return None
+        try:
+            return self.archive.lookup_partial(url, format_id)
+        except Exception as e:
+            print(f'读取下载记录失败：{str(e)}')
+            return None
+
+    def record_archive(self, job, status):
+        if not self.settings['download_archive']:
+            return
+        try:
+            self.archive.record(job, status)
+        except Exception as e:
+            print(f'写入下载记录失败：{str(e)}')
+
+    def get_ytdlp_version(self):
+        engine = self.engine
+        if engine.name == 'inprocess':
+            return engine.yt_dlp.version.__version__
+        # 同一个可执行文件只查一次版本，更新后文件戳变化再重新查
+        command = self.get_ytdlp_command()
+        key = (command, get_file_stamp(command))
+        cached = self._ytdlp_version
+        if cached and cached[0] == key:
+            return cached[1]
+        version = get_local_ytdlp_version(command)
+        self._ytdlp_version = (key, version)
+        return version
+
+    def record_metrics(self, job_metrics, result):
+        if not self.settings['metrics_enabled']:
+            return None
+        # 先结束计时，查询 yt-dlp 版本的耗时不算进最后一个阶段
+        job_metrics.enter(None)
+        try:
+            record = job_metrics.finish(result, self.engine.name, self.get_ytdlp_version())
+        except Exception as e:
+            print(f'统计任务指标失败：{str(e)}')
+            return None
+        self.metrics.record(record)
+        return record
+
+    def get_download_tuning(self, site):
+        tuning = self.download_tuner.suggest(site)
+        downloader = self.settings['external_downloader']
+        if downloader == 'aria2c':
+            downloader_path = find_external_downloader(downloader)
+            if downloader_path:
+                connections = int(self.settings['aria2c_connections'])
+                tuning['external_downloader'] = downloader_path
+                tuning['external_downloader_args'] = [f'-x{connections}', f'-s{connections}', '-k1M']
+            else:
+                print('未找到 aria2c，使用 yt-dlp 自带的下载器')
+        elif downloader:
+            print(f'不支持的外部下载器：{downloader}')
+        return tuning
+
+    def get_ytdlp_command(self):
+        self.ytdlp_path = resolve_ytdlp_command()
+        return self.ytdlp_path
+
+    def get_cookie_modes(self, url):
+        cookie_modes = get_cookie_modes(url, self.manual_cookie_enabled, self.cookie_file)
+        return self.cookie_preferences.order(get_site_key(url), cookie_modes)
+
+    def get_progress_interval(self):
+        return 1.0 / max(0.1, float(self.settings['progress_ui_hz']))
+
+    def filter_formats(self, formats):
+        return formats.filter(codecs=self.settings['format_codecs'])
+
+    def lookup_cached_formats(self, url):
+        for cookie_mode in get_cookie_modes(url, self.manual_cookie_enabled, self.cookie_file):
+            formats = self.sniff_cache.get(url, cookie_mode)
+            if formats:
+                visible = self.filter_formats(formats)
+                return (visible, cookie_mode) if visible else (None, None)
+        return None, None
+
+
+class SniffTask:
+    def __init__(self, core, url):
+        self.core = core
+        self.url = url
+        self.is_running = True
+        self.processes = {}
+        self.job_metrics = None
+
+    def run_sniff(self, cookie_mode, attempt_stopped, on_line):
+        def on_process(process):
+            self.processes[cookie_mode] = process
+            self.job_metrics.process_started(process)
+
+        with self.core.cookies.lease(cookie_mode, on_line) as lease:
+            return self.core.engine.probe(
+                self.url,
+                lease.mode,
+                lease.path,
+                lambda: not self.is_running or attempt_stopped.is_set(),
+                lease.on_line,
+                on_process,
+            )
+
+    def stop_attempt(self, cookie_mode, attempt_stopped):
+        # 进程内调用没有进程可结束，由 EngineLogger 在下一行输出时检查 attempt_stopped 中断
+        attempt_stopped.set()
+        self.core.supervisor.terminate(self.processes.get(cookie_mode))
+
+    def race_sniff(self, cookie_modes, on_line):
+        # 几种 Cookies 方式同时嗅探，取最先成功的结果并立即结束其余的
+        results = queue.Queue()
+        attempts = {}
+
+        def attempt(cookie_mode, attempt_stopped):
+            try:
+                result = self.run_sniff(cookie_mode, attempt_stopped, on_line)
+            except Exception as e:
+                result = (False, f'嗅探时发生错误：{str(e)}', FormatTable())
+            results.put((cookie_mode, result))
+
+        def launch(cookie_mode):
+            self.job_metrics.attempts += 1
+            attempt_stopped = threading.Event()
+            attempts[cookie_mode] = attempt_stopped
+            threading.Thread(target=attempt, args=(cookie_mode, attempt_stopped), daemon=True).start()
+
+        # 该站点有过胜出记录时首选方式先跑，其余的稍后启动；首选方式提前失败则立刻启动其余的。
+        # 没有记录就不知道哪种更快，全部同时启动
+        if self.core.cookie_preferences.preferred.get(get_site_key(self.url)) in cookie_modes:
+            launch(cookie_modes[0])
+            pending = list(cookie_modes[1:])
+        else:
+            for mode in cookie_modes:
+                launch(mode)
+            pending = []
+        head_start = float(self.core.settings['cookie_race_delay'])
+        finished = 0
+        last_message = '嗅探失败'
+        while finished < len(cookie_modes) and self.is_running:
+            try:
+                cookie_mode, (success, message, formats) = results.get(timeout=head_start if pending else 0.1)
+            except queue.Empty:
+                if pending:
+                    for mode in pending:
+                        launch(mode)
+                    pending = []
+                continue
+
+            finished += 1
+            if success:
+                for other_mode, attempt_stopped in attempts.items():
+                    if other_mode != cookie_mode:
+                        self.stop_attempt(other_mode, attempt_stopped)
+                return True, message, formats, cookie_mode
+            last_message = message
+            if pending:
+                for mode in pending:
+                    launch(mode)
+                pending = []
+
+        return False, last_message, FormatTable(), None
+
+    def run(self, on_line):
+        self.job_metrics = JobMetrics('sniff', self.url, 'cache')
+
+        def on_metered_line(line):
+            self.job_metrics.observe_line(line)
+            on_line(line)
+
+        result = self.sniff(on_metered_line)
+        if result[0]:
+            outcome = 'cached' if self.job_metrics.attempts == 0 else 'success'
+        else:
+            outcome = 'failed' if self.is_running else 'cancelled'
+        self.core.record_metrics(self.job_metrics, outcome)
+        return result
+
+    def sniff(self, on_line):
+        try:
+            formats, cookie_mode = self.core.lookup_cached_formats(self.url)
+            if formats:
+                return True, '嗅探完成', formats, cookie_mode
+
+            # 子进程方式先记启动耗时，进程内调用没有这一段
+            self.job_metrics.enter('spawn' if self.core.engine.name == 'subprocess' else 'extract')
+            is_youtube = is_youtube_url(self.url)
+            cookie_modes = self.core.get_cookie_modes(self.url)
+            if 'firefox' in cookie_modes and len(cookie_modes) > 1:
+                on_line('正在同时尝试普通嗅探和 Firefox Cookies...')
+
+            success, message, formats, cookie_mode = self.race_sniff(cookie_modes, on_line)
+            if success:
+                # 缓存完整的格式表，显示时再按编码设置筛选
+                self.core.sniff_cache.put(self.url, cookie_mode, formats)
+                self.core.cookie_preferences.record(get_site_key(self.url), cookie_mode)
+                visible = self.core.filter_formats(formats)
+                if not visible:
+                    return False, '未找到可用的H.264视频格式或字幕', visible, 'none'
+                return True, message, visible, cookie_mode
+            if not self.is_running:
+                return False, '嗅探已取消', FormatTable(), 'none'
+
+            if is_youtube and not self.core.manual_cookie_enabled:
+                return False, 'Firefox Cookies 调用失败，请手动输入 Cookies 后重试。', FormatTable(), 'show_cookie_input'
+
+            return False, message, FormatTable(), 'none'
+        except Exception as e:
+            return False, f'嗅探时发生错误：{str(e)}', FormatTable(), 'none'
+
+    def stop(self):
+        self.is_running = False
+        for process in list(self.processes.values()):
+            self.core.supervisor.terminate(process)
+
+
+class SniffPoolListener:
+    def on_sniff_started(self, url):
+        pass
+
+    def on_sniff_line(self, url, text):
+        pass
+
+    def on_sniff_finished(self, url, success, message, formats, cookie_mode):
+        pass
+
+    def on_pool_idle(self):
+        pass
+
+
+class SniffPool:
+    def __init__(self, core, listener=None):
+        settings = core.settings
+        self.core = core
+        self.listener = listener or SniffPoolListener()
+        self.max_workers = max(1, int(settings['max_concurrent_sniffs']))
+        self.site_limit = max(1, int(settings['sniff_site_concurrency']))
+        self.urls = set()
+        self.pending = []
+        self.running = {}
+        self.lock = threading.RLock()
+        self.idle_event = threading.Event()
+        self.idle_event.set()
+
+    def add_urls(self, urls):
+        added = []
+        with self.lock:
+            for url in urls:
+                url = url.strip()
+                if url and url not in self.urls:
+                    self.urls.add(url)
+                    added.append(url)
+            if added:
+                self.idle_event.clear()
+        for url in added:
+            # 嗅探过的链接直接用缓存结果，不占用嗅探槽位
+            formats, cookie_mode = self.core.lookup_cached_formats(url)
+            if formats:
+                self.listener.on_sniff_finished(url, True, '已从缓存载入', formats, cookie_mode)
+                continue
+            with self.lock:
+                self.pending.append(url)
+        self.schedule()
+        self.check_idle()
+        return added
+
+    def schedule(self):
+        with self.lock:
+            site_counts = {}
+            for url in self.running:
+                site = get_site_key(url)
+                site_counts[site] = site_counts.get(site, 0) + 1
+
+            for url in list(self.pending):
+                if len(self.running) >= self.max_workers:
+                    break
+                site = get_site_key(url)
+                if site_counts.get(site, 0) >= self.site_limit:
+                    continue
+                self.pending.remove(url)
+                task = SniffTask(self.core, url)
+                self.running[url] = task
+                site_counts[site] = site_counts.get(site, 0) + 1
+                threading.Thread(target=self.run_task, args=(url, task), daemon=True).start()
+
+    def run_task(self, url, task):
+        self.listener.on_sniff_started(url)
+        success, message, formats, cookie_mode = task.run(lambda line: self.listener.on_sniff_line(url, line))
+        with self.lock:
+            self.running.pop(url, None)
+            if not success:
+                # 失败和取消的链接可以重新加入重试，成功的仍然去重
+                self.urls.discard(url)
+        self.listener.on_sniff_finished(url, success, message, formats, cookie_mode or 'none')
+        self.schedule()
+        self.check_idle()
+
+    def check_idle(self):
+        with self.lock:
+            if self.pending or self.running or self.idle_event.is_set():
+                return
+            self.idle_event.set()
+        self.listener.on_pool_idle()
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending) + len(self.running)
+
+    def wait_idle(self, timeout=None):
+        return self.idle_event.wait(timeout)
+
+    def stop(self):
+        # 没开始的直接丢弃，已经开始的结束进程；停止后同样的链接可以再次加入
+        with self.lock:
+            self.urls.difference_update(self.pending)
+            self.urls.difference_update(self.running)
+            self.pending = []
+            tasks = list(self.running.values())
+        for task in tasks:
+            task.stop()
+
+
+class PlaylistTask:
+    def __init__(self, core, url, cookie_mode=None):
+        self.core = core
+        self.url = url
+        # 指定了 Cookies 方式时只用这一种读取列表，否则按站点自动尝试
+        self.cookie_mode = cookie_mode
+        self.is_running = True
+        self.process = None
+        self.entry_count = 0
+
+    def set_process(self, process):
+        self.process = process
+
+    def run_list(self, cookie_mode, on_line, on_entry):
+        def handle_entry(entry):
+            entry_url = get_entry_url(entry)
+            if not entry_url:
+                return
+            self.entry_count += 1
+            on_entry({
+                'url': entry_url,
+                'title': entry.get('title') or entry_url,
+                'cookie_mode': cookie_mode,
+            })
+
+        with self.core.cookies.lease(cookie_mode, on_line) as lease:
+            return self.core.engine.list_entries(
+                self.url,
+                lease.mode,
+                lease.path,
+                lambda: not self.is_running,
+                lease.on_line,
+                handle_entry,
+                self.set_process,
+            )
+
+    def run(self, on_line, on_entry):
+        try:
+            cookie_modes = [self.cookie_mode] if self.cookie_mode else self.core.get_cookie_modes(self.url)
+            for cookie_mode in cookie_modes:
+                success = self.run_list(cookie_mode, on_line, on_entry)
+                if not self.is_running:
+                    return False, '列表读取已取消', self.entry_count
+                # 已经读到条目时不再换 Cookies 重试，避免重复加入队列
+                if success or self.entry_count:
+                    return success, f'列表读取完成，共 {self.entry_count} 个视频' if success else '列表读取中断', self.entry_count
+            return False, '列表读取失败', self.entry_count
+        except Exception as e:
+            return False, f'读取列表时发生错误：{str(e)}', self.entry_count
+
+    def stop(self):
+        self.is_running = False
+        self.core.supervisor.terminate(self.process)
+
+
+def rename_downloaded_file(downloaded_file, format_label):
+    # 获取文件大小
+    file_size = os.path.getsize(downloaded_file)
+    file_size_str = ''
+    if file_size >= 1024 * 1024 * 1024:  # GB
+        file_size_str = f'.{round(file_size / (1024 * 1024 * 1024), 2)}G'
+    elif file_size >= 1024 * 1024:  # MB
+        file_size_str = f'.{round(file_size / (1024 * 1024), 1)}M'
+    elif file_size >= 1024:  # KB
+        file_size_str = f'.{round(file_size / 1024, 1)}K'
+
+    # 获取文件扩展名和基本名称
+    base_name, ext = os.path.splitext(downloaded_file)
+
+    # 根据文件类型添加不同的后缀
+    if ext.lower() in ['.m4a', '.aac']:
+        new_name = f'{base_name}{file_size_str}{ext}'
+    elif ext.lower() == '.mp4':
+        resolution = format_label.split('/')[0] if format_label else ''
+        if resolution:
+            new_name = f'{base_name}.{resolution}{ext}'
+        else:
+            new_name = downloaded_file
+    else:
+        new_name = downloaded_file
+
+    try:
+        if new_name != downloaded_file:
+            os.rename(downloaded_file, new_name)
+            return new_name
+    except Exception as e:
+        print(f'重命名文件失败：{str(e)}')
+    return downloaded_file
+
+
+MP4_EXTENSIONS = ('.mp4', '.m4a', '.m4v', '.mov')
+MATROSKA_EXTENSIONS = ('.webm', '.mkv', '.mka')
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+POSTPROCESS_CHUNK_SIZE = 1024 * 1024
+
+
+def check_mp4_boxes(f, file_size):
+    # 只读每个顶层 box 的头部并跳过数据，几 GB 的文件也只要几次 seek
+    offset = 0
+    box_types = set()
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return False, '文件末尾不完整'
+        size = int.from_bytes(header[:4], 'big')
+        box_type = header[4:8].decode('latin-1')
+        if size == 1:
+            large_size = f.read(8)
+            if len(large_size) < 8:
+                return False, '文件末尾不完整'
+            size = int.from_bytes(large_size, 'big')
+        elif size == 0:
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            return False, f'{box_type} 数据不完整'
+        box_types.add(box_type)
+        offset += size
+    if 'ftyp' not in box_types:
+        return False, '缺少 ftyp'
+    if 'moov' not in box_types:
+        return False, '缺少 moov'
+    return True, ''
+
+
+def check_container(path):
+    file_size = get_file_size(path)
+    if not file_size:
+        return False, '文件为空'
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as f:
+        if ext in MP4_EXTENSIONS:
+            return check_mp4_boxes(f, file_size)
+        if ext in MATROSKA_EXTENSIONS and f.read(4) != EBML_MAGIC:
+            return False, '不是有效的 WebM/MKV 文件'
+    return True, ''
+
+
+class PostProcessor:
+    def __init__(self, workers, hash_enabled=True):
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix='postprocess')
+        self.hash_enabled = hash_enabled
+        self.is_running = True
+
+    def submit(self, job, downloaded_file, on_finished):
+        self.executor.submit(self.run, job, downloaded_file, on_finished)
+
+    def get_sha256(self, path):
+        import hashlib
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(POSTPROCESS_CHUNK_SIZE), b''):
+                if not self.is_running:
+                    return None
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def process(self, job, downloaded_file):
+        timer = PhaseTimer()
+        result = {'file': downloaded_file, 'valid': True, 'error': '', 'sha256': None}
+        if not downloaded_file or not os.path.exists(downloaded_file):
+            return result
+        downloaded_file = rename_downloaded_file(downloaded_file, job.format_label)
+        result['file'] = downloaded_file
+        timer.mark('rename')
+        result['valid'], result['error'] = check_container(downloaded_file)
+        timer.mark('check')
+        if result['valid'] and self.hash_enabled:
+            result['sha256'] = self.get_sha256(downloaded_file)
+            timer.mark('hash')
+        result['size'] = get_file_size(downloaded_file)
+        result['phases'] = {name: round(seconds, 3) for name, seconds in timer.phases}
+        return result
+
+    def run(self, job, downloaded_file, on_finished):
+        try:
+            result = self.process(job, downloaded_file)
+        except Exception as e:
+            result = {'file': downloaded_file, 'valid': False, 'error': str(e), 'sha256': None}
+        on_finished(job, result)
+
+    def shutdown(self):
+        # 退出时中断还没算完的哈希，已经开始的重命名会正常完成
+        self.is_running = False
+        self.executor.shutdown(wait=False)
+
+
+JOB_LOG_SUFFIX = '.log.gz'
+
+
+def prune_job_logs(log_dir, keep):
+    try:
+        paths = [os.path.join(log_dir, name) for name in os.listdir(log_dir) if name.endswith(JOB_LOG_SUFFIX)]
+    except FileNotFoundError:
+        return
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[max(0, int(keep)):]:
+        try:
+            os.remove(path)
+        except Exception as e:
+            print(f'删除旧日志失败：{str(e)}')
+
+
+def get_resume_log_path(path):
+    # 上次的日志可能在崩溃时被截断，继续下载另起一个文件，不往坏文件后面追加
+    base = re.sub(r'(-resume\d+)?' + re.escape(JOB_LOG_SUFFIX) + '$', '', path)
+    index = 1
+    while True:
+        resume_path = f'{base}-resume{index}{JOB_LOG_SUFFIX}'
+        if not os.path.exists(resume_path):
+            return resume_path
+        index += 1
+
+
+class JobLog:
+    def __init__(self, path, capacity, previous=None):
+        self.path = path
+        # 重启前同一个任务写过的日志文件，查看时按顺序接在前面
+        self.previous = list(previous or [])
+        self.lines = deque(maxlen=max(1, int(capacity)))
+        self.file = None
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def write(self, line):
+        with self.lock:
+            self.lines.append(line)
+            if self.failed:
+                return
+            try:
+                if self.file is None:
+                    import gzip
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    # 继续下载时追加为新的 gzip 成员，读取时会自动接起来
+                    self.file = gzip.open(self.path, 'at', encoding='utf-8')
+                self.file.write(line + '\n')
+            except Exception as e:
+                self.failed = True
+                print(f'写入任务日志失败：{str(e)}')
+
+    def mark(self, text):
+        self.write(f'[{time.strftime("%Y-%m-%d %H:%M:%S")}] {text}')
+
+    def tail(self):
+        with self.lock:
+            return list(self.lines)
+
+    def flush(self):
+        with self.lock:
+            if self.file:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def read_pages(self, page_size=1000):
+        # 每次只解压一页，几小时的日志也不会一次读进内存
+        self.flush()
+        with self.lock:
+            writing = self.file is not None
+        for path in self.previous:
+            if (yield from self.read_file_pages(path, page_size, False)):
+                yield [f'[日志在此处中断：{os.path.basename(path)}]']
+        if (yield from self.read_file_pages(self.path, page_size, writing)):
+            # 损坏的部分读不出来，后面接上内存里最近的输出
+            yield ['[日志文件已损坏，以下为内存中最近的输出]'] + self.tail()
+
+    def read_file_pages(self, path, page_size, writing):
+        # 读到第一个坏掉的 gzip 成员为止，返回文件是否损坏
+        import gzip
+        import zlib
+        page = []
+        damaged = False
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    page.append(line.rstrip('\n'))
+                    if len(page) >= page_size:
+                        yield page
+                        page = []
+        except FileNotFoundError:
+            pass
+        except EOFError:
+            # 正在写入的日志还没有结束标记，读到已经刷新的部分为止；
+            # 没在写入却读不完，说明上次退出时文件被截断了
+            damaged = not writing
+        except (OSError, zlib.error) as e:
+            damaged = True
+            print(f'读取任务日志失败：{str(e)}')
+        if page:
+            yield page
+        return damaged
+
+
+class DownloadJob:
+    def __init__(self, job_id, url, format_id, format_label, cookie_mode, title=None, output_dir=None):
+        self.job_id = job_id
+        self.url = url
+        self.title = title or url
+        self.format_id = format_id
+        # 列表策略在下载前才换成具体格式，下载记录按最初请求的格式查找
+        self.requested_format = format_id
+        self.format_label = format_label
+        self.cookie_mode = cookie_mode
+        self.output_dir = output_dir
+        self.site = get_site_key(url)
+        self.state = 'queued'
+        self.message = '排队中'
+        self.output_file = None
+        self.task = None
+        # 暂停后旧的 yt-dlp 还没退出时点了继续，等它退出后再重新排队
+        self.resume_requested = False
+        self.progress = {}
+        self.metrics = None
+        self.postprocess = None
+        self.log = None
+        # yt-dlp 输出的各个目标文件，取消时据此清理 .part 和分片
+        self.partial_files = []
+        # 带宽按优先级加权分配，默认都是 1
+        self.priority = 1
+
+    def is_active(self):
+        return self.state in ('queued', 'running', 'processing')
+
+    def to_dict(self):
+        return {
+            'id': self.job_id,
+            'url': self.url,
+            'title': self.title,
+            'format_id': self.format_id,
+            'format_label': self.format_label,
+            'cookie_mode': self.cookie_mode,
+            'priority': self.priority,
+            'state': self.state,
+            'message': self.message,
+            'file': self.output_file,
+            'metrics': self.metrics,
+            'postprocess': self.postprocess,
+            'log': self.log.path if self.log else None,
+        }
+
+    def to_journal(self):
+        return {
+            'id': self.job_id,
+            'url': self.url,
+            'title': self.title,
+            'format_id': self.format_id,
+            'requested_format': self.requested_format,
+            'format_label': self.format_label,
+            'cookie_mode': self.cookie_mode,
+            'output_dir': self.output_dir,
+            'output_file': self.output_file,
+            'priority': self.priority,
+            'state': self.state,
+            'message': self.message,
+            'log': self.log.path if self.log else None,
+            'previous_logs': self.log.previous if self.log else [],
+        }
+
+
+# 重启后还要继续的任务；正在下载和排队的重新排队，暂停和失败的保持原状等用户继续
+JOURNAL_RESTORE_STATES = ('queued', 'running', 'processing', 'paused', 'failed')
+
+
+# 完成、失败和取消要等落盘后才返回；其余状态由写入线程批量写入，最多隔这么多秒同步一次
+JOURNAL_DURABLE_STATES = ('done', 'failed', 'cancelled')
+JOURNAL_SYNC_INTERVAL = 1.0
+
+
+class JobJournal:
+    def __init__(self, path, sync_interval=JOURNAL_SYNC_INTERVAL):
+        self.path = os.path.abspath(path)
+        self.sync_interval = sync_interval
+        self.file = None
+        self.lock = threading.Lock()
+        # 待写入的行和写入进度，按序号判断某条记录是否已经写入和同步
+        self.condition = threading.Condition()
+        self.pending = []
+        self.queued = 0
+        self.synced = 0
+        self.durable = 0
+        self.closed = False
+        self.thread = None
+
+    def load(self):
+        # 按顺序重放，每个任务只保留最后一次记录；崩溃时写了一半的最后一行直接跳过
+        records = OrderedDict()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(record, dict) and 'id' in record:
+                        records[record['id']] = record
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'读取队列记录失败：{str(e)}')
+        return list(records.values())
+
+    def append(self, record):
+        # 调用方可能持有队列锁或在界面线程上，这里只放进待写列表，不等磁盘同步
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.condition:
+            if self.closed:
+                return
+            self.pending.append(line)
+            self.queued += 1
+            sequence = self.queued
+            if record.get('state') in JOURNAL_DURABLE_STATES:
+                self.durable = sequence
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+            if self.durable == sequence:
+                # 任务的最终结果必须落盘后才算记下
+                while self.synced < sequence and not self.closed:
+                    self.condition.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                # 没有要立即落盘的记录时再等一会儿，这段时间里的状态变化合成一次写入和同步
+                deadline = time.monotonic() + self.sync_interval
+                while self.durable <= self.synced and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                lines = self.pending
+                self.pending = []
+                sequence = self.queued
+                closed = self.closed
+            if lines:
+                self.write_lines(lines)
+            with self.condition:
+                self.synced = max(self.synced, sequence)
+                self.condition.notify_all()
+            if closed:
+                return
+
+    def write_lines(self, lines):
+        with self.lock:
+            try:
+                if self.file is None:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    self.file = open(self.path, 'a', encoding='utf-8')
+                self.file.write(''.join(lines))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except Exception as e:
+                print(f'写入队列记录失败：{str(e)}')
+
+    def close(self):
+        # 退出前把还没写入的记录写完并同步
+        with self.condition:
+            self.closed = True
+            thread = self.thread
+            self.condition.notify_all()
+        if thread:
+            thread.join()
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def rewrite(self, records):
+        # 启动恢复后整体重写一次，已完成和取消的任务不再留在文件里；之前还没写入的记录一并作废
+        with self.condition:
+            self.pending = []
+            self.synced = self.queued
+            self.condition.notify_all()
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+            try:
+                write_text_atomic(self.path, ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+            except Exception as e:
+                print(f'写入队列记录失败：{str(e)}')
+
+
+STREAM_AUDIO_FORMAT = 'bestaudio[ext=m4a]'
+# 两路分别保存为带格式编号的文件，合并后去掉编号，和 yt-dlp 自己合并时的文件名一致
+STREAM_OUTPUT_TEMPLATE = '%(title)s [%(id)s].f%(format_id)s.%(ext)s'
+
+
+def get_merged_path(stream_path):
+    return re.sub(r'\.f[\w-]+\.\w+$', '.mp4', stream_path)
+
+
+def combine_stream_progress(progresses):
+    # 两路的字节数和速度相加，剩余时间取较慢的一路，全部下完才算 finished
+    combined = dict(progresses[-1])
+    totals = [progress.get('total_bytes') or progress.get('total_bytes_estimate') for progress in progresses]
+    etas = [progress['eta'] for progress in progresses if progress.get('eta') is not None]
+    combined.update({
+        'status': 'finished' if all(progress.get('status') == 'finished' for progress in progresses) else 'downloading',
+        'downloaded_bytes': sum(progress.get('downloaded_bytes') or 0 for progress in progresses),
+        'total_bytes': sum(totals) if all(totals) else None,
+        'total_bytes_estimate': None,
+        'speed': sum(progress.get('speed') or 0 for progress in progresses) or None,
+        'eta': max(etas) if etas else None,
+    })
+    return combined
+
+
+class DownloadTask:
+    def __init__(self, core, job, on_updated=None):
+        self.core = core
+        self.job = job
+        self.on_updated = on_updated
+        self.url = job.url
+        self.format_id = job.format_id
+        self.is_running = True
+        self.processes = []
+        self.job_metrics = None
+        self.downloaded_file = None
+        self.transfer = None
+        # 嗅探得到的完整视频信息，音视频分开下载时共用，不用再各自提取
+        self.info = None
+
+    def set_process(self, process):
+        self.processes.append(process)
+        self.job_metrics.process_started(process)
+        if self.transfer:
+            self.transfer.set_process(process)
+
+    def resolve_policy(self, on_line):
+        # 列表条目在真正排到时才嗅探，并按所选策略挑格式；任务指定了 Cookies 方式时先用它
+        cookie_modes = self.core.get_cookie_modes(self.url)
+        if self.job.cookie_mode != 'none':
+            cookie_modes = [self.job.cookie_mode] + [mode for mode in cookie_modes if mode != self.job.cookie_mode]
+        for cookie_mode in cookie_modes:
+            probed = {}
+            formats = self.core.sniff_cache.get(self.url, cookie_mode)
+            if not formats:
+                with self.core.cookies.lease(cookie_mode, on_line) as lease:
+                    success, _, formats = self.core.engine.probe(
+                        self.url, lease.mode, lease.path,
+                        lambda: not self.is_running, lease.on_line, self.set_process,
+                        lambda info: probed.update(info=info),
+                    )
+                if not self.is_running:
+                    return False
+                if not success:
+                    continue
+                self.core.sniff_cache.put(self.url, cookie_mode, formats)
+
+            selected = select_format_for_policy(formats, self.format_id)
+            if selected:
+                self.format_id, self.job.format_label = selected
+                self.job.format_id = self.format_id
+                self.job.cookie_mode = cookie_mode
+                self.info = probed.get('info')
+                if self.on_updated:
+                    self.on_updated(self.job)
+                return True
+        return False
+
+    def run(self, on_line, on_progress):
+        start_phase = 'spawn' if self.core.engine.name == 'subprocess' else 'extract'
+        is_policy = self.format_id.startswith('policy:')
+        self.job_metrics = JobMetrics('download', self.url, 'resolve' if is_policy else start_phase)
+
+        def on_metered_line(line):
+            self.job_metrics.observe_line(line)
+            on_line(line)
+
+        def on_metered_progress(progress):
+            self.job_metrics.observe_progress(progress)
+            on_progress(progress)
+
+        success, message = self.download(on_metered_line, on_metered_progress, start_phase)
+        if success and self.downloaded_file is not None:
+            # 还要后处理，等重命名、校验和哈希做完再一起记录
+            self.job_metrics.enter('postprocess')
+            return success, message
+        outcome = 'success' if success else ('failed' if self.is_running else 'cancelled')
+        self.job.metrics = self.core.record_metrics(self.job_metrics, outcome)
+        return success, message
+
+    def download(self, on_line, on_progress, start_phase):
+        try:
+            if self.format_id.startswith('policy:'):
+                if not self.resolve_policy(on_line):
+                    return False, '嗅探失败' if self.is_running else '下载已取消'
+                self.job_metrics.enter(start_phase)
+
+            # 下载并合并视频和音频，选择最高码率的m4a(aac)音频
+            # 检查是否为YouTube链接，只有YouTube链接才需要Cookies
+            is_youtube = is_youtube_url(self.url)
+
+            is_subtitle = self.format_id.startswith('subtitle:')
+            if is_subtitle:
+                _, subtitle_lang, subtitle_mode = self.format_id.split(':', 2)
+                request = {'subtitle_lang': subtitle_lang, 'subtitle_mode': subtitle_mode}
+            else:
+                request = {'format': f'{self.format_id}+bestaudio[ext=m4a]', 'merge_output_format': 'mp4'}
+            request['output_dir'] = self.job.output_dir
+            request['cookie_mode'] = 'none'
+            if is_youtube and self.job.cookie_mode == 'firefox':
+                request['cookie_mode'] = 'firefox'
+            elif is_youtube and self.job.cookie_mode == 'file' and os.path.exists(self.core.cookie_file):
+                request['cookie_mode'] = 'file'
+            tuning = {}
+            if not is_subtitle:
+                tuning = self.core.get_download_tuning(self.job.site)
+                request.update(tuning)
+            request['priority'] = self.core.settings['download_priority']
+            # 选的是视频格式时音视频两路同时下载，不用等视频下完才开始下音频
+            ffmpeg = None
+            if not is_subtitle and self.core.settings['parallel_streams'] and get_label_height(self.job.format_label):
+                ffmpeg = find_external_downloader('ffmpeg')
+
+            def on_download_line(line):
+                if '[download] Destination:' in line:
+                    path = line.split(':', 1)[1].strip()
+                    if path not in self.job.partial_files:
+                        self.job.partial_files.append(path)
+                on_line(line)
+
+            # 采样开头几秒的实际速度，交给调优器决定同站点后续任务的参数
+            sample = ThroughputSample(self.core.settings['download_tune_seconds'])
+
+            def on_sampled_progress(progress):
+                sample.offer(progress)
+                on_progress(progress)
+                self.transfer.observe(progress, lambda: not self.is_running)
+
+            self.transfer = self.core.bandwidth.register(self.job)
+            try:
+                if ffmpeg:
+                    success, downloaded_file, audio_file = self.download_streams(request, on_download_line, on_sampled_progress)
+                else:
+                    success, downloaded_file = self.run_engine_download(
+                        request, lambda: not self.is_running, on_download_line, on_sampled_progress,
+                    )
+            finally:
+                self.transfer.close()
+            if success and ffmpeg:
+                merged_file = self.merge_streams(ffmpeg, downloaded_file, audio_file, request['priority'], on_line)
+                if not merged_file:
+                    return False, '合并失败' if self.is_running else '下载已取消'
+                downloaded_file = merged_file
+            if not success:
+                # 记下未完成的文件，再次下载时 yt-dlp 会接着 .part 继续
+                if downloaded_file:
+                    self.job.output_file = downloaded_file
+                    self.core.record_archive(self.job, 'partial')
+                return False, '下载失败'
+            if tuning:
+                self.core.download_tuner.record(self.job.site, tuning, sample)
+
+            # 重命名、校验和哈希交给后处理线程池，这里直接返回让出下载槽位
+            self.job.output_file = downloaded_file
+            if downloaded_file and os.path.exists(downloaded_file):
+                self.downloaded_file = downloaded_file
+            return True, '下载完成' if not is_subtitle else '字幕下载完成'
+        except Exception as e:
+            return False, f'发生错误：{str(e)}'
+
+    def run_engine_download(self, request, should_stop, on_line, on_progress):
+        # 每个 yt-dlp 使用单独的 Cookies 副本
+        with self.core.cookies.lease(request['cookie_mode'], on_line) as lease:
+            return self.core.engine.download(
+                self.url, dict(request, cookie_mode=lease.mode), lease.path, should_stop,
+                lease.on_line, on_progress, self.set_process,
+            )
+
+    def extract_stream_info(self, request, on_line):
+        # 两路共用一次提取的结果写成 --load-info-json 文件；里面可能带有 Cookies，只给当前用户读写，用完删除
+        if self.info is None:
+            with self.core.cookies.lease(request['cookie_mode'], on_line) as lease:
+                self.core.engine.probe(
+                    self.url, lease.mode, lease.path, lambda: not self.is_running, lease.on_line, self.set_process,
+                    lambda info: setattr(self, 'info', info),
+                )
+        if self.info is None:
+            return None
+        try:
+            fd, path = tempfile.mkstemp(prefix='yt_dlp_gui_', suffix='.info.json')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.info, f, ensure_ascii=False)
+            return path
+        except Exception as e:
+            print(f'写入视频信息失败：{str(e)}')
+            return None
+
+    def download_streams(self, request, on_line, on_progress):
+        # 先提取一次信息，再由视频和音频各一个 yt-dlp 同时下载，进度合在一起报告；任何一路失败就结束另一路
+        info_path = self.extract_stream_info(request, on_line)
+        try:
+            if not self.is_running:
+                return False, None, None
+            if info_path:
+                request = dict(request, info_json=info_path)
+            return self.fetch_streams(request, on_line, on_progress)
+        finally:
+            if info_path:
+                try:
+                    os.remove(info_path)
+                except OSError as e:
+                    print(f'删除视频信息失败：{str(e)}')
+
+    def fetch_streams(self, request, on_line, on_progress):
+        failed = threading.Event()
+        lock = threading.Lock()
+        progresses = {}
+        results = {}
+
+        def should_stop():
+            return not self.is_running or failed.is_set()
+
+        def fetch(name, stream_format):
+            stream_request = dict(request, format=stream_format, output_template=STREAM_OUTPUT_TEMPLATE)
+            stream_request.pop('merge_output_format', None)
+
+            def on_stream_line(line):
+                with lock:
+                    on_line(line)
+
+            def on_stream_progress(progress):
+                with lock:
+                    progresses[name] = progress
+                    on_progress(combine_stream_progress(list(progresses.values())))
+
+            try:
+                results[name] = self.run_engine_download(stream_request, should_stop, on_stream_line, on_stream_progress)
+            except Exception as e:
+                on_stream_line(f'ERROR: {str(e)}')
+                results[name] = (False, None)
+            if not results[name][0] and not failed.is_set():
+                failed.set()
+                for process in list(self.processes):
+                    self.core.supervisor.terminate(process)
+
+        audio_thread = threading.Thread(target=fetch, args=('audio', STREAM_AUDIO_FORMAT), daemon=True)
+        audio_thread.start()
+        fetch('video', self.format_id)
+        audio_thread.join()
+        success = results['video'][0] and results['audio'][0]
+        return success and not should_stop(), results['video'][1], results['audio'][1]
+
+    def merge_streams(self, ffmpeg, video_file, audio_file, priority, on_line):
+        if not video_file or not audio_file:
+            on_line('ERROR: 没有找到下载的视频或音频文件')
+            return None
+        merged_file = get_merged_path(video_file)
+        temp_file = os.path.splitext(merged_file)[0] + '.temp.mp4'
+        # 和 yt-dlp 合并时输出同样的行，指标和界面据此进入合并阶段
+        on_line(f'[Merger] Merging formats into "{merged_file}"')
+        cmd = [
+            ffmpeg, '-y', '-loglevel', 'error', '-i', video_file, '-i', audio_file,
+            '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-movflags', '+faststart', temp_file,
+        ]
+        process = self.core.supervisor.popen(cmd, priority)
+        self.set_process(process)
+        for line in process.stdout:
+            if line.strip():
+                on_line(line.strip())
+        process.wait()
+        if process.returncode != 0 or not self.is_running:
+            # 保留两路文件，重试时 yt-dlp 发现已经下载完就直接合并
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+            return None
+        os.replace(temp_file, merged_file)
+        for path in (video_file, audio_file):
+            try:
+                os.remove(path)
+            except Exception as e:
+                print(f'删除合并前的文件失败：{str(e)}')
+        return merged_file
+
+    def stop(self):
+        self.is_running = False
+        # 被限速暂停的进程要先恢复，否则收不到结束信号
+        if self.transfer:
+            self.transfer.close()
+        for process in list(self.processes):
+            self.core.supervisor.terminate(process)
+
+
+class QueueListener:
+    def on_job_added(self, job):
+        pass
+
+    def on_job_updated(self, job):
+        pass
+
+    def on_job_line(self, job, text):
+        pass
+
+    def on_job_progress(self, job, progress):
+        pass
+
+    def on_queue_idle(self):
+        pass
+
+
+class QueueListenerGroup(QueueListener):
+    def __init__(self, listeners):
+        self.listeners = list(listeners)
+
+    def on_job_added(self, job):
+        for listener in self.listeners:
+            listener.on_job_added(job)
+
+    def on_job_updated(self, job):
+        for listener in self.listeners:
+            listener.on_job_updated(job)
+
+    def on_job_line(self, job, text):
+        for listener in self.listeners:
+            listener.on_job_line(job, text)
+
+    def on_job_progress(self, job, progress):
+        for listener in self.listeners:
+            listener.on_job_progress(job, progress)
+
+    def on_queue_idle(self):
+        for listener in self.listeners:
+            listener.on_queue_idle()
+
+
+class JobQueue:
+    def __init__(self, core, listener=None, output_dir=None, journal=None):
+        settings = core.settings
+        self.core = core
+        self.listener = listener or QueueListener()
+        self.output_dir = output_dir
+        self.journal = journal
+        self.stopping = False
+        self.max_workers = max(1, int(settings['max_concurrent_downloads']))
+        self.default_site_limit = max(1, int(settings['default_site_concurrency']))
+        self.site_limits = dict(settings['site_concurrency'])
+        self.jobs = []
+        # 接口和界面按编号查任务，任务多时不用逐个比较
+        self.jobs_by_id = {}
+        self.next_job_id = 1
+        self.lock = threading.RLock()
+        self.idle_event = threading.Event()
+        self.idle_event.set()
+
+    def add_job(self, url, format_id, format_label, cookie_mode, title=None):
+        # 先查下载记录，已完成的不占用下载槽位，也不联网
+        record = self.core.lookup_archive(url, format_id)
+        partial = None if record else self.core.lookup_partial_archive(url, format_id)
+        with self.lock:
+            job = DownloadJob(self.next_job_id, url, format_id, format_label, cookie_mode, title, self.output_dir)
+            self.next_job_id += 1
+            if partial:
+                # 保存到上次的位置，yt-dlp 会找到同名的 .part 接着下载
+                job.output_dir = os.path.dirname(partial['output_path'])
+                job.output_file = partial['output_path']
+                job.message = '排队中（继续上次未完成的下载）'
+            self.jobs.append(job)
+            self.jobs_by_id[job.job_id] = job
+            if record:
+                job.state = 'done'
+                job.message = '已下载过，跳过'
+                job.format_id = record['format_id'] or format_id
+                job.format_label = record['format_label'] or format_label
+                job.output_file = record['output_path']
+            else:
+                self.idle_event.clear()
+                if self.journal:
+                    # 只是放进写入线程的待写列表，持锁入列保证和后续状态的先后顺序
+                    self.journal.append(job.to_journal())
+        self.listener.on_job_added(job)
+        if not record:
+            self.schedule()
+        return job
+
+    def restore(self):
+        # 按上次记录的格式、Cookies 和保存位置重建队列；yt-dlp 会接着已有的 .part 和分片继续下载
+        if not self.journal:
+            return []
+        restored = []
+        processing = []
+        with self.lock:
+            for record in self.journal.load():
+                state = record.get('state')
+                if state not in JOURNAL_RESTORE_STATES:
+                    continue
+                # 上次退出前已经完成、只是没来得及记下的任务
+                if self.core.lookup_archive(record['url'], record.get('requested_format') or record['format_id']):
+                    continue
+                job = DownloadJob(
+                    self.next_job_id, record['url'], record['format_id'], record.get('format_label') or '',
+                    record.get('cookie_mode') or 'none', record.get('title'), record.get('output_dir'),
+                )
+                self.next_job_id += 1
+                job.requested_format = record.get('requested_format') or job.format_id
+                job.output_file = record.get('output_file')
+                job.priority = record.get('priority') or 1
+                if record.get('log'):
+                    previous = (record.get('previous_logs') or []) + [record['log']]
+                    job.log = self.core.create_job_log(job, get_resume_log_path(record['log']), previous)
+                if state in ('paused', 'failed'):
+                    job.state = state
+                    job.message = record.get('message') or ''
+                elif state == 'processing' and job.output_file and os.path.exists(job.output_file):
+                    job.state = 'processing'
+                    job.message = '后处理中...'
+                    processing.append(job)
+                else:
+                    job.state = 'queued'
+                    job.message = '排队中（上次未完成）'
+                self.jobs.append(job)
+                self.jobs_by_id[job.job_id] = job
+                restored.append(job)
+            if any(job.is_active() for job in restored):
+                self.idle_event.clear()
+            self.journal.rewrite([job.to_journal() for job in restored])
+        for job in restored:
+            self.listener.on_job_added(job)
+        for job in processing:
+            self.core.postprocessor.submit(job, job.output_file, lambda job, result: self.postprocess_finished(job, result, '下载完成'))
+        self.schedule()
+        return restored
+
+    def notify_updated(self, job):
+        # 退出时被暂停的任务在记录里保持原来的状态，下次启动接着下载
+        if self.journal and not (self.stopping and job.state == 'paused'):
+            self.journal.append(job.to_journal())
+        self.listener.on_job_updated(job)
+
+    def add_listener(self, listener):
+        # 界面和本地接口同时接收队列事件
+        with self.lock:
+            if not isinstance(self.listener, QueueListenerGroup):
+                self.listener = QueueListenerGroup([self.listener])
+            self.listener.listeners.append(listener)
+
+    def get_job(self, job_id):
+        with self.lock:
+            return self.jobs_by_id.get(job_id)
+
+    def get_site_limit(self, site):
+        return max(1, int(self.site_limits.get(site, self.default_site_limit)))
+
+    def running_jobs(self):
+        with self.lock:
+            return [job for job in self.jobs if job.state == 'running']
+
+    def has_active(self):
+        with self.lock:
+            return any(job.is_active() for job in self.jobs)
+
+    def schedule(self):
+        with self.lock:
+            running = self.running_jobs()
+            site_counts = {}
+            for job in running:
+                site_counts[job.site] = site_counts.get(job.site, 0) + 1
+
+            for job in self.jobs:
+                if len(running) >= self.max_workers:
+                    break
+                if job.state != 'queued':
+                    continue
+                if site_counts.get(job.site, 0) >= self.get_site_limit(job.site):
+                    continue
+                self.start_job(job)
+                running.append(job)
+                site_counts[job.site] = site_counts.get(job.site, 0) + 1
+
+    def start_job(self, job):
+        job.state = 'running'
+        job.message = '正在下载中...'
+        task = DownloadTask(self.core, job, self.notify_updated)
+        job.task = task
+        if job.log is None:
+            job.log = self.core.create_job_log(job)
+        job.log.mark(f'开始下载：{job.url} 格式：{job.format_label or job.format_id}')
+        self.notify_updated(job)
+        threading.Thread(target=self.run_job, args=(job, task), daemon=True).start()
+
+    def run_job(self, job, task):
+        interval = self.core.get_progress_interval()
+        line_throttle = ProgressThrottle(interval)
+        progress_throttle = ProgressThrottle(interval)
+
+        def on_line(line):
+            job.log.write(line)
+            if line_throttle.offer(line):
+                self.listener.on_job_line(job, line)
+
+        def on_progress(progress):
+            job.progress = progress
+            if progress_throttle.offer(progress, force=progress.get('status') != 'downloading'):
+                # 进度只记录发给界面的那些，日志不会被每个数据块的进度撑大
+                job.log.write(format_progress_text(progress))
+                self.listener.on_job_progress(job, progress)
+
+        success, message = task.run(on_line, on_progress)
+        line = line_throttle.flush()
+        if line:
+            self.listener.on_job_line(job, line)
+        progress = progress_throttle.flush()
+        if progress:
+            job.log.write(format_progress_text(progress))
+            self.listener.on_job_progress(job, progress)
+        job.log.mark(message)
+        job.log.close()
+        self.job_finished(job, task, success, message)
+
+    def job_finished(self, job, task, success, message):
+        with self.lock:
+            # 暂停后又马上继续的任务可能已经换了新任务，旧任务的结果直接丢弃
+            if job.task is not task:
+                return
+            job.task = None
+            # 暂停或取消的任务由 stop() 结束进程，不覆盖它们的状态
+            is_processing = job.state == 'running' and success and task.downloaded_file is not None
+            if is_processing:
+                job.state = 'processing'
+                job.message = '后处理中...'
+            elif job.state == 'running':
+                job.state = 'done' if success else 'failed'
+                job.message = message
+            elif job.state == 'paused' and job.resume_requested:
+                # 旧进程已经退出，不会再有两个 yt-dlp 同时写同一个 .part
+                job.resume_requested = False
+                job.state = 'queued'
+                job.message = '排队中'
+                self.idle_event.clear()
+        if job.state == 'cancelled':
+            self.remove_partial_files(job)
+        self.notify_updated(job)
+        if is_processing:
+            self.core.postprocessor.submit(
+                job, task.downloaded_file, lambda job, result: self.postprocess_finished(job, result, message, task.job_metrics),
+            )
+        elif success and task.downloaded_file is not None:
+            # 下完时已经被暂停或取消，不再后处理，指标照常记录
+            job.metrics = self.core.record_metrics(task.job_metrics, 'cancelled')
+        self.schedule()
+        self.check_idle()
+
+    def postprocess_finished(self, job, result, message, job_metrics=None):
+        if job_metrics:
+            job_metrics.add_postprocess_phases(result.get('phases') or {})
+            job.metrics = self.core.record_metrics(job_metrics, 'success' if result['valid'] else 'failed')
+        with self.lock:
+            job.postprocess = result
+            job.output_file = result['file']
+            if result['valid']:
+                job.state = 'done'
+                job.message = message
+            else:
+                job.state = 'failed'
+                job.message = f'文件校验失败：{result["error"]}'
+        job.log.mark(f'后处理：{job.message} {result["file"] or ""}'.rstrip())
+        job.log.close()
+        self.core.record_archive(job, 'done' if result['valid'] else 'partial')
+        self.notify_updated(job)
+        self.check_idle()
+
+    def check_idle(self):
+        if not self.has_active():
+            self.idle_event.set()
+            self.listener.on_queue_idle()
+
+    def pause_job(self, job):
+        with self.lock:
+            if job.state == 'paused' and job.resume_requested:
+                # 旧进程退出前又点了暂停，取消之前的继续
+                job.resume_requested = False
+                job.message = '已暂停'
+            elif job.state not in ('queued', 'running'):
+                return
+            else:
+                was_running = job.state == 'running'
+                job.state = 'paused'
+                job.message = '已暂停'
+                if was_running and job.task:
+                    job.task.stop()
+        self.notify_updated(job)
+        self.schedule()
+
+    def resume_job(self, job):
+        # 失败的任务也可以继续，yt-dlp 会接着未完成的 .part 文件下载
+        with self.lock:
+            if job.state not in ('paused', 'failed'):
+                return
+            if job.task:
+                # 旧任务还在宽限时间内退出，先记下，由 job_finished 重新排队
+                job.resume_requested = True
+                job.message = '正在暂停，结束后继续...'
+            else:
+                job.state = 'queued'
+                job.message = '排队中'
+                self.idle_event.clear()
+        self.notify_updated(job)
+        self.schedule()
+
+    def set_priority(self, job, priority):
+        job.priority = max(1, int(priority))
+        self.core.bandwidth.update_priority()
+        self.notify_updated(job)
+
+    def cancel_job(self, job):
+        with self.lock:
+            # 后处理中的文件已经下载完成，不再取消
+            if job.state in ('done', 'cancelled', 'processing'):
+                return
+            was_running = job.state == 'running'
+            # 暂停后还没退出的任务同样要等进程结束
+            exiting = job.task is not None
+            job.state = 'cancelled'
+            job.message = '已取消'
+            job.resume_requested = False
+            if was_running and job.task:
+                job.task.stop()
+        # 正在下载的任务等进程退出后在 job_finished 中清理
+        if not exiting:
+            self.remove_partial_files(job)
+        self.notify_updated(job)
+        self.schedule()
+
+    def remove_partial_files(self, job):
+        removed = remove_partial_files(job.partial_files)
+        if removed and job.log:
+            job.log.mark(f'已删除 {len(removed)} 个临时文件')
+
+    def wait_idle(self, timeout=None):
+        return self.idle_event.wait(timeout)
+
+    def stop_all(self, timeout):
+        with self.lock:
+            self.stopping = True
+            running = self.running_jobs()
+            for job in self.jobs:
+                if job.state in ('queued', 'running'):
+                    job.state = 'paused'
+            for job in running:
+                if job.task:
+                    job.task.stop()
+        deadline = time.monotonic() + timeout
+        while any(job.task for job in running) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # 剩下的时间留给后处理完成重命名
+        while any(job.state == 'processing' for job in self.jobs) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.core.postprocessor.shutdown()
+        if self.journal:
+            self.journal.close()
+
+
+API_POLICIES = {policy_id.split(':', 1)[1]: (policy_id, label) for policy_id, label in PLAYLIST_POLICIES}
+API_LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+API_COOKIE_MODES = ('none', 'firefox', 'file')
+API_JOB_PATTERN = re.compile(r'^/api/jobs/(\d+)(?:/(cancel|pause|resume))?$')
+# 每个事件连接最多积压的消息数，超过就断开，客户端重连后重新同步
+API_EVENT_BACKLOG = 2000
+API_KEEPALIVE_SECONDS = 15
+
+
+class ApiEventStream(QueueListener):
+    def __init__(self):
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = queue.Queue()
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, event, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        # 没有连接时不序列化，不给下载线程增加开销
+        if not subscribers:
+            return
+        message = f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n'
+        for subscriber in subscribers:
+            if subscriber.qsize() >= API_EVENT_BACKLOG:
+                self.unsubscribe(subscriber)
+                subscriber.put(None)
+            else:
+                subscriber.put(message)
+
+    def close(self):
+        with self.lock:
+            subscribers = list(self.subscribers)
+            self.subscribers = []
+        for subscriber in subscribers:
+            subscriber.put(None)
+
+    def on_job_added(self, job):
+        self.publish('job', job.to_dict())
+
+    def on_job_updated(self, job):
+        self.publish('job', job.to_dict())
+
+    def on_job_progress(self, job, progress):
+        self.publish('progress', {
+            'id': job.job_id,
+            'percent': get_progress_percent(progress),
+            'downloaded_bytes': progress.get('downloaded_bytes'),
+            'total_bytes': progress.get('total_bytes') or progress.get('total_bytes_estimate'),
+            'speed': progress.get('speed'),
+            'eta': progress.get('eta'),
+            'text': format_progress_text(progress),
+        })
+
+    def on_queue_idle(self):
+        self.publish('idle', {})
+
+
+def create_api_handler(server):
+    from http.server import BaseHTTPRequestHandler
+
+    class ApiHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_job(self, job):
+            if job is None:
+                self.send_json(404, {'error': '任务不存在'})
+            else:
+                self.send_json(200, job.to_dict())
+
+        def send_json(self, status, data):
+            body = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def check_request(self):
+            # 只监听本机时检查 Host，网页无法借 DNS 重绑定访问接口
+            hostname = urllib.parse.urlsplit('//' + (self.headers.get('Host') or '')).hostname
+            if server.host in API_LOCAL_HOSTS and hostname not in API_LOCAL_HOSTS:
+                self.send_json(403, {'error': '只接受本机访问'})
+                return False
+            if server.token and self.headers.get('Authorization') != f'Bearer {server.token}':
+                self.send_json(401, {'error': '令牌无效'})
+                return False
+            return True
+
+        def read_json(self):
+            # 要求 JSON 请求头，浏览器跨站提交时必须先预检，而接口不响应预检
+            if 'application/json' not in (self.headers.get('Content-Type') or ''):
+                self.send_json(415, {'error': '请求体必须是 JSON'})
+                return None
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self.send_json(400, {'error': '无法解析 JSON'})
+                return None
+            if not isinstance(payload, dict):
+                self.send_json(400, {'error': '请求体必须是 JSON 对象'})
+                return None
+            return payload
+
+        def do_GET(self):
+            if not self.check_request():
+                return
+            parts = urllib.parse.urlsplit(self.path)
+            path = parts.path.rstrip('/')
+            match = API_JOB_PATTERN.match(path)
+            if path == '/api/jobs':
+                states = urllib.parse.parse_qs(parts.query).get('state')
+                self.send_json(200, server.list_jobs(states))
+            elif path == '/api/events':
+                self.stream_events()
+            elif match and not match.group(2):
+                self.send_job(server.job_queue.get_job(int(match.group(1))))
+            else:
+                self.send_json(404, {'error': '未知的接口'})
+
+        def do_POST(self):
+            if not self.check_request():
+                return
+            path = urllib.parse.urlsplit(self.path).path.rstrip('/')
+            match = API_JOB_PATTERN.match(path)
+            if path != '/api/jobs' and not (match and match.group(2)):
+                self.send_json(404, {'error': '未知的接口'})
+                return
+            payload = self.read_json()
+            if payload is None:
+                return
+            if path == '/api/jobs':
+                try:
+                    self.send_json(202, server.submit(payload))
+                except (TypeError, ValueError) as e:
+                    self.send_json(400, {'error': str(e)})
+                return
+            self.send_job(server.job_action(int(match.group(1)), match.group(2)))
+
+        def do_DELETE(self):
+            if not self.check_request():
+                return
+            match = API_JOB_PATTERN.match(urllib.parse.urlsplit(self.path).path.rstrip('/'))
+            if not match or match.group(2):
+                self.send_json(404, {'error': '未知的接口'})
+                return
+            self.send_job(server.job_action(int(match.group(1)), 'cancel'))
+
+        def stream_events(self):
+            subscriber = server.events.subscribe()
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                # 先发一次所有任务的快照，之后只发变化
+                snapshot = json.dumps(server.list_jobs(), ensure_ascii=False, default=str)
+                self.wfile.write(f'event: snapshot\ndata: {snapshot}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+                while True:
+                    try:
+                        message = subscriber.get(timeout=API_KEEPALIVE_SECONDS)
+                    except queue.Empty:
+                        message = ': keepalive\n\n'
+                    if message is None:
+                        break
+                    self.wfile.write(message.encode('utf-8'))
+                    self.wfile.flush()
+            except OSError:
+                pass
+            finally:
+                server.events.unsubscribe(subscriber)
+
+    return ApiHandler
+
+
+class ApiServer:
+    def __init__(self, core, job_queue, host=None, port=None, token=None):
+        settings = core.settings
+        self.core = core
+        self.job_queue = job_queue
+        self.host = host or settings['api_host']
+        self.port = settings['api_port'] if port is None else port
+        self.token = settings['api_token'] if token is None else token
+        self.events = ApiEventStream()
+        self.httpd = None
+
+    def start(self):
+        from http.server import ThreadingHTTPServer
+        if self.host not in API_LOCAL_HOSTS and not self.token:
+            raise ValueError('监听本机以外的地址时必须设置 api_token')
+        self.httpd = ThreadingHTTPServer((self.host, int(self.port)), create_api_handler(self))
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.job_queue.add_listener(self.events)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        host = f'[{self.host}]' if ':' in self.host else self.host
+        return f'http://{host}:{self.port}'
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+        self.events.close()
+
+    def list_jobs(self, states=None):
+        with self.job_queue.lock:
+            return [job.to_dict() for job in self.job_queue.jobs if not states or job.state in states]
+
+    def submit(self, payload):
+        urls = payload.get('urls') or ([payload['url']] if payload.get('url') else [])
+        if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url.strip() for url in urls):
+            raise ValueError('缺少 url 或 urls')
+        if payload.get('format_id'):
+            # 之前嗅探得到的具体格式编号，只对单个视频有意义
+            format_id = str(payload['format_id'])
+            format_label = str(payload.get('format_label') or format_id)
+        else:
+            policy = API_POLICIES.get(str(payload.get('format') or 'best'))
+            if policy is None:
+                raise ValueError(f'未知的格式策略：{payload.get("format")}，可选 {"、".join(API_POLICIES)}')
+            format_id, format_label = policy
+        cookie_mode = payload.get('cookie_mode') or 'none'
+        if cookie_mode not in API_COOKIE_MODES:
+            raise ValueError(f'未知的 Cookies 方式：{cookie_mode}')
+        priority = payload.get('priority')
+        try:
+            priority = 1 if priority in (None, '') else int(priority)
+        except (TypeError, ValueError):
+            priority = 0
+        if priority < 1:
+            raise ValueError(f'priority 必须是正整数：{payload.get("priority")}')
+        urls = [url.strip() for url in urls]
+        if not format_id.startswith('policy:') and any(is_playlist_url(url) for url in urls):
+            raise ValueError('播放列表只能使用格式策略')
+
+        jobs = []
+        playlists = []
+        title = payload.get('title') if len(urls) == 1 else None
+        for url in urls:
+            if is_playlist_url(url):
+                # 列表在后台边读边入队，请求立即返回
+                threading.Thread(
+                    target=self.add_playlist, args=(url, format_id, format_label, priority, payload.get('cookie_mode')),
+                    daemon=True,
+                ).start()
+                playlists.append(url)
+                continue
+            job = self.job_queue.add_job(url, format_id, format_label, cookie_mode, title)
+            if priority > 1:
+                self.job_queue.set_priority(job, priority)
+            jobs.append(job.to_dict())
+        return {'jobs': jobs, 'playlists': playlists}
+
+    def add_playlist(self, url, format_id, format_label, priority, cookie_mode=None):
+        # 条目沿用读取列表时成功的 Cookies 方式，请求里指定了就是指定的那一种
+        def add_entry(entry):
+            job = self.job_queue.add_job(entry['url'], format_id, format_label, entry['cookie_mode'], entry['title'])
+            if priority > 1:
+                self.job_queue.set_priority(job, priority)
+
+        success, message, count = PlaylistTask(self.core, url, cookie_mode).run(lambda line: None, add_entry)
+        self.events.publish('playlist', {'url': url, 'success': success, 'message': message, 'count': count})
+
+    def job_action(self, job_id, action):
+        job = self.job_queue.get_job(job_id)
+        if job is None:
+            return None
+        if action == 'cancel':
+            self.job_queue.cancel_job(job)
+        elif action == 'pause':
+            self.job_queue.pause_job(job)
+        else:
+            self.job_queue.resume_job(job)
+        return job
+
+
+UPDATE_CHECKSUM_ASSET = 'SHA2-256SUMS'
+UPDATE_CHUNK_SIZE = 64 * 1024
+
+
+def get_release_asset_name():
+    if os.name == 'nt':
+        return 'yt-dlp.exe'
+    if sys.platform == 'darwin':
+        return 'yt-dlp_macos'
+    return 'yt-dlp_linux'
+
+
+def get_local_ytdlp_version(command):
+    try:
+        if not command or not os.path.exists(command):
+            return None
+        result = subprocess.run(
+            [command, '--version'],
+            capture_output=True,
+            text=True,
+            timeout=15,
+            **get_popen_kwargs(),
+        )
+        if result.returncode == 0:
+            return result.stdout.strip()
+    except Exception:
+        pass
+    return None
+
+
+def open_update_url(url, headers=None, timeout=20):
+    import urllib.request
+    request_headers = {'User-Agent': 'yt_dlp_gui'}
+    request_headers.update(headers or {})
+    return urllib.request.urlopen(urllib.request.Request(url, headers=request_headers), timeout=timeout)
+
+
+def parse_release_info(data, asset_name):
+    assets = {asset.get('name'): asset for asset in data.get('assets') or []}
+    asset = assets.get(asset_name)
+    checksum = assets.get(UPDATE_CHECKSUM_ASSET)
+    if not asset:
+        raise ValueError(f'发布中没有 {asset_name}')
+    if not checksum:
+        raise ValueError(f'发布中没有校验文件 {UPDATE_CHECKSUM_ASSET}')
+    return {
+        'tag': str(data.get('tag_name', '')).strip() or None,
+        'asset_name': asset_name,
+        'asset_url': asset.get('browser_download_url'),
+        'asset_size': asset.get('size'),
+        'checksum_url': checksum.get('browser_download_url'),
+    }
+
+
+def parse_content_range_total(value):
+    # Content-Range: bytes 100-199/200
+    match = re.match(r'bytes\s+\d+-\d+/(\d+)', value or '')
+    return int(match.group(1)) if match else None
+
+
+def get_file_sha256(path):
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UpdateCancelled(Exception):
+    pass
+
+
+class UpdateTask:
+    def __init__(self, core, target_path, current_command, api_url=None, cache_path=None, retries=None):
+        self.core = core
+        # 用界面或命令行当前生效的设置，不再重新读一遍设置文件
+        settings = self.core.settings
+        self.target_path = target_path
+        self.current_command = current_command
+        self.api_url = api_url or settings['update_api_url']
+        self.cache_path = cache_path or os.path.join(get_cache_dir(), 'ytdlp_release.json')
+        self.retries = settings['update_retries'] if retries is None else retries
+        # 未完成的下载和它的元数据一直保留到校验通过，断网后从断点续传
+        self.temp_path = target_path + '.download'
+        self.meta_path = self.temp_path + '.json'
+        self.stop_requested = False
+
+    def stop(self):
+        self.stop_requested = True
+
+    def load_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f'读取更新记录失败：{str(e)}')
+            return {}
+
+    def fetch_release(self, record, on_line):
+        import urllib.error
+        headers = {}
+        if record.get('api_url') == self.api_url and record.get('release'):
+            if record.get('etag'):
+                headers['If-None-Match'] = record['etag']
+            if record.get('last_modified'):
+                headers['If-Modified-Since'] = record['last_modified']
+        try:
+            with open_update_url(self.api_url, headers) as response:
+                data = json.loads(response.read().decode('utf-8'))
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+        except urllib.error.HTTPError as e:
+            # 304 表示发布信息没变，直接用缓存的记录，也不占 API 配额
+            if e.code == 304 and headers:
+                on_line('发布信息未变化，使用缓存的发布记录')
+                return record['release']
+            raise
+        release = parse_release_info(data, get_release_asset_name())
+        record.update({
+            'api_url': self.api_url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'release': release,
+        })
+        return release
+
+    def get_local_version(self, record):
+        # 自己装的版本记下了文件戳，文件没变就不必再启动一次 yt-dlp --version
+        installed = record.get('installed') or {}
+        command = self.current_command
+        if command and installed.get('path') == command and installed.get('stamp') == get_file_stamp(command):
+            return installed.get('version')
+        return get_local_ytdlp_version(command)
+
+    def fetch_checksum(self, release):
+        with open_update_url(release['checksum_url']) as response:
+            text = response.read().decode('utf-8', 'replace')
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1].lstrip('*') == release['asset_name']:
+                return parts[0].lower()
+        raise ValueError(f'校验文件中没有 {release["asset_name"]}')
+
+    def clear_partial(self):
+        for path in (self.temp_path, self.meta_path):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                print(f'删除未完成的更新文件失败：{str(e)}')
+
+    def download_once(self, release, meta, on_progress):
+        offset = os.path.getsize(self.temp_path) if os.path.exists(self.temp_path) else 0
+        headers = {}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            # If-Range 保证服务器上的文件变了时返回完整内容，而不是拼接出一个坏文件
+            validator = meta.get('etag') if not str(meta.get('etag') or '').startswith('W/') else None
+            validator = validator or meta.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+
+        with open_update_url(release['asset_url'], headers, timeout=30) as response:
+            if response.status == 206:
+                total = parse_content_range_total(response.headers.get('Content-Range'))
+            else:
+                offset = 0
+                length = response.headers.get('Content-Length')
+                total = int(length) if length and length.isdigit() else None
+            total = total or release.get('asset_size')
+            meta['etag'] = response.headers.get('ETag') or meta.get('etag')
+            meta['last_modified'] = response.headers.get('Last-Modified') or meta.get('last_modified')
+            write_json_atomic(self.meta_path, meta)
+
+            downloaded = offset
+            started = time.monotonic()
+            with open(self.temp_path, 'ab' if offset else 'wb') as f:
+                while True:
+                    if self.stop_requested:
+                        raise UpdateCancelled()
+                    chunk = response.read(UPDATE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    elapsed = time.monotonic() - started
+                    on_progress({
+                        'status': 'downloading',
+                        'downloaded_bytes': downloaded,
+                        'total_bytes': total,
+                        'speed': (downloaded - offset) / elapsed if elapsed > 0 else None,
+                    })
+        if total and downloaded < total:
+            raise ConnectionError(f'连接提前断开（{downloaded}/{total} 字节）')
+
+    def download_asset(self, release, on_line, on_progress):
+        import urllib.error
+        meta = self.load_json(self.meta_path)
+        if meta.get('url') != release['asset_url'] or meta.get('tag') != release['tag']:
+            # 上次没下完的是别的版本，不能续传
+            self.clear_partial()
+            meta = {'url': release['asset_url'], 'tag': release['tag']}
+        elif os.path.exists(self.temp_path):
+            on_line(f'从 {format_size_label(os.path.getsize(self.temp_path)) or "0MB"} 处继续下载')
+
+        attempts = 0
+        while True:
+            try:
+                self.download_once(release, meta, on_progress)
+                return
+            except urllib.error.HTTPError as e:
+                if e.code == 416:
+                    # 断点超出了服务器上的文件大小，说明本地残留不可用，从头下载
+                    self.clear_partial()
+                    meta = {'url': release['asset_url'], 'tag': release['tag']}
+                elif e.code < 500:
+                    raise
+                error = e
+            except OSError as e:
+                error = e
+            attempts += 1
+            if attempts > self.retries:
+                raise error
+            on_line(f'下载中断，{attempts} 秒后续传：{str(error)}')
+            time.sleep(attempts)
+            if self.stop_requested:
+                raise UpdateCancelled()
+
+    def run(self, on_line=None, on_progress=None):
+        on_line = on_line or (lambda text: None)
+        on_progress = on_progress or (lambda progress: None)
+        record = self.load_json(self.cache_path)
+        try:
+            release = self.fetch_release(record, on_line)
+            latest_version = release['tag']
+            local_version = self.get_local_version(record)
+            write_json_atomic(self.cache_path, record)
+            target_exists = os.path.exists(self.target_path)
+            if target_exists and local_version and latest_version and local_version == latest_version:
+                return True, f'无需更新，已经是最新版啦：{local_version}'
+
+            os.makedirs(os.path.dirname(self.target_path), exist_ok=True)
+            expected_sha256 = self.fetch_checksum(release)
+            self.download_asset(release, on_line, on_progress)
+            on_line('正在校验 SHA-256...')
+            actual_sha256 = get_file_sha256(self.temp_path)
+            if actual_sha256 != expected_sha256:
+                self.clear_partial()
+                return False, f'yt-dlp 更新失败：SHA-256 校验不通过（期望 {expected_sha256}，实际 {actual_sha256}）'
+
+            if os.name != 'nt':
+                os.chmod(self.temp_path, 0o755)
+            # 校验通过后一次性替换，不会留下写了一半的可执行文件
+            os.replace(self.temp_path, self.target_path)
+            self.clear_partial()
+            invalidate_ytdlp_command()
+            record['installed'] = {
+                'path': self.target_path,
+                'stamp': get_file_stamp(self.target_path),
+                'version': latest_version,
+            }
+            write_json_atomic(self.cache_path, record)
+
+            final_version = latest_version or get_local_ytdlp_version(self.target_path) or '未知版本'
+            return True, f'yt-dlp 更新完成：{final_version}'
+        except UpdateCancelled:
+            return False, 'yt-dlp 更新已取消，下次更新会从断点继续'
+        except Exception as e:
+            return False, f'yt-dlp 更新失败：{str(e)}'
+
+
+def update_ytdlp(core, target_path, current_command, on_line=None, on_progress=None, api_url=None):
+    return UpdateTask(core, target_path, current_command, api_url).run(on_line, on_progress)
+
+
+class ConsoleQueueListener(QueueListener):
+    def on_job_updated(self, job):
+        print(f'[{job.job_id}] {job.message}：{job.title}', file=sys.stderr, flush=True)
+
+    def on_job_line(self, job, text):
+        print(f'[{job.job_id}] {text}', file=sys.stderr, flush=True)
+
+    def on_job_progress(self, job, progress):
+        print(f'[{job.job_id}] {format_progress_text(progress)}', file=sys.stderr, flush=True)
+
+
+def read_url_list(path):
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+
+def write_results(path, results):
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if path == '-':
+        print(text)
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text + '\n')
+
+
+def create_cli_core(args):
+    core = DownloaderCore()
+    if args.workers:
+        core.settings['max_concurrent_downloads'] = args.workers
+    if args.cookies:
+        core.cookie_file = os.path.abspath(args.cookies)
+        core.manual_cookie_enabled = True
+    return core
+
+
+def run_batch(args):
+    core = create_cli_core(args)
+    if args.no_archive:
+        core.settings['download_archive'] = False
+    if args.limit_rate is not None:
+        core.bandwidth.set_limit(args.limit_rate)
+    format_id, format_label = next(item for item in PLAYLIST_POLICIES if item[0] == f'policy:{args.format}')
+    journal = JobJournal(args.journal) if args.journal else None
+    job_queue = JobQueue(core, ConsoleQueueListener(), args.output_dir, journal)
+    # 中断后用同一个记录文件重新运行时，先恢复上次的任务，已经在队列里的 URL 不再重复加入
+    known_urls = set()
+    for job in job_queue.restore():
+        known_urls.add(job.url)
+        job_queue.resume_job(job)
+
+    def add_job(url, cookie_mode, title=None):
+        if url not in known_urls:
+            known_urls.add(url)
+            job_queue.add_job(url, format_id, format_label, cookie_mode, title)
+
+    # 单个视频直接入队；列表边读边入队，第一个视频不用等整个列表读完
+    for url in read_url_list(args.url_file):
+        if is_playlist_url(url):
+            task = PlaylistTask(core, url)
+            success, message, _ = task.run(
+                lambda line: print(line, file=sys.stderr, flush=True),
+                lambda entry: add_job(entry['url'], entry['cookie_mode'], entry['title']),
+            )
+            print(f'{url}：{message}', file=sys.stderr, flush=True)
+        else:
+            add_job(url, 'none')
+
+    job_queue.wait_idle()
+    if journal:
+        journal.close()
+    results = [job.to_dict() for job in job_queue.jobs]
+    write_results(args.output, results)
+    return 0 if all(job['state'] == 'done' for job in results) else 1
+
+
+class ConsoleSniffListener(SniffPoolListener):
+    def __init__(self):
+        self.results = {}
+
+    def on_sniff_line(self, url, text):
+        print(f'[{url}] {text}', file=sys.stderr, flush=True)
+
+    def on_sniff_finished(self, url, success, message, formats, cookie_mode):
+        print(f'[{url}] {message}', file=sys.stderr, flush=True)
+        self.results[url] = (success, message, formats, cookie_mode)
+
+
+def run_sniff(args):
+    core = create_cli_core(args)
+    if args.codec:
+        core.settings['format_codecs'] = args.codec
+    if args.workers:
+        core.settings['max_concurrent_sniffs'] = args.workers
+    if args.per_site:
+        core.settings['sniff_site_concurrency'] = args.per_site
+    urls = list(dict.fromkeys(args.urls or read_url_list(args.url_file)))
+    # 多个链接一起交给嗅探池，结果仍按输入顺序输出
+    listener = ConsoleSniffListener()
+    pool = SniffPool(core, listener)
+    pool.add_urls(urls)
+    pool.wait_idle()
+    results = []
+    for url in urls:
+        success, message, formats, cookie_mode = listener.results[url]
+        formats = formats.filter(kinds=args.kind, min_height=args.min_height, max_height=args.max_height,
+                                 min_fps=args.min_fps, hdr=True if args.hdr else None)
+        if args.sort:
+            formats = formats.sorted(args.sort, reverse=not args.ascending)
+        results.append({
+            'url': url,
+            'success': success,
+            'message': message,
+            'cookie_mode': cookie_mode,
+            'formats': formats.to_list(),
+        })
+    write_results(args.output, results)
+    return 0 if all(item['success'] for item in results) else 1
+
+
+def run_serve(args):
+    core = create_cli_core(args)
+    journal = JobJournal(args.journal) if args.journal else None
+    job_queue = JobQueue(core, ConsoleQueueListener(), args.output_dir, journal)
+    for job in job_queue.restore():
+        job_queue.resume_job(job)
+    server = ApiServer(core, job_queue, args.host, args.port, args.token)
+    try:
+        address = server.start()
+    except (OSError, ValueError) as e:
+        print(f'启动本地接口失败：{str(e)}', file=sys.stderr)
+        return 1
+    print(f'本地接口已启动：{address}', file=sys.stderr, flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print('正在停止...', file=sys.stderr, flush=True)
+    finally:
+        server.stop()
+        job_queue.stop_all(3.0)
+        core.supervisor.stop_all(1.0)
+    return 0
+
+
+def run_archive(args):
+    core = DownloaderCore()
+    if args.remove:
+        removed = sum(core.archive.remove(url) for url in args.remove)
+        print(f'已删除 {removed} 条下载记录', file=sys.stderr)
+        return 0
+    write_results(args.output, core.archive.query(args.search, args.status, args.limit))
+    return 0
+
+
+def run_update(args):
+    core = DownloaderCore()
+    throttle = ProgressThrottle(1.0)
+
+    def on_line(text):
+        print(text, file=sys.stderr, flush=True)
+
+    def on_progress(progress):
+        if throttle.offer(progress, progress['downloaded_bytes'] == progress['total_bytes']):
+            on_line(format_progress_text(progress))
+
+    success, message = update_ytdlp(core, get_managed_ytdlp_path(), core.get_ytdlp_command(),
+                                    on_line, on_progress, args.api_url)
+    if success:
+        core.sniff_cache.clear()
+    print(message)
+    return 0 if success else 1
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='yt_dlp_core', description='yt_dlp_gui 命令行模式，不依赖 Qt，适合无界面的批量任务。')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_common_arguments(subparser):
+        subparser.add_argument('-o', '--output', default='-', help='结果 JSON 文件，默认输出到标准输出')
+        subparser.add_argument('--cookies', help='Netscape 格式的 Cookies 文件')
+        subparser.add_argument('-j', '--workers', type=int, help='同时下载或嗅探的任务数')
+
+    batch_parser = subparsers.add_parser('batch', help='按 URL 列表批量下载')
+    batch_parser.add_argument('url_file', help='每行一个 URL 的文本文件，- 表示从标准输入读取')
+    batch_parser.add_argument('-f', '--format', default='best', choices=['best', '1080', '720', '480', 'audio'],
+                              help='格式策略，默认最高画质 H.264')
+    batch_parser.add_argument('-P', '--output-dir', help='下载保存目录，默认当前目录')
+    batch_parser.add_argument('--no-archive', action='store_true', help='不跳过下载记录中已完成的视频')
+    batch_parser.add_argument('--journal', help='队列记录文件；中断后用同样的参数重新运行会接着未完成的任务继续')
+    batch_parser.add_argument('--limit-rate', type=parse_rate_limit, help='所有任务共享的总速度上限，例如 20M，0 表示不限速；默认按配置和时段')
+    add_common_arguments(batch_parser)
+    batch_parser.set_defaults(handler=run_batch)
+
+    sniff_parser = subparsers.add_parser('sniff', help='只嗅探格式和字幕，不下载')
+    sniff_parser.add_argument('urls', nargs='*', help='视频 URL')
+    sniff_parser.add_argument('-i', '--url-file', default='-', help='URL 列表文件（未给出 URL 时使用），- 表示标准输入')
+    sniff_parser.add_argument('--codec', action='append', help='只显示这些编码，可重复；默认使用设置中的 format_codecs')
+    sniff_parser.add_argument('--kind', action='append', choices=['video', 'audio', 'subtitle'], help='只显示这些类型，可重复')
+    sniff_parser.add_argument('--min-height', type=int, help='最低分辨率')
+    sniff_parser.add_argument('--max-height', type=int, help='最高分辨率')
+    sniff_parser.add_argument('--min-fps', type=int, help='最低帧率')
+    sniff_parser.add_argument('--hdr', action='store_true', help='只显示 HDR 格式')
+    sniff_parser.add_argument('--sort', choices=FORMAT_SORT_KEYS, help='按字段排序，默认保持分辨率从高到低')
+    sniff_parser.add_argument('--ascending', action='store_true', help='升序排序')
+    sniff_parser.add_argument('--per-site', type=int, help='同一站点同时嗅探的数量，默认使用设置中的 sniff_site_concurrency')
+    add_common_arguments(sniff_parser)
+    sniff_parser.set_defaults(handler=run_sniff)
+
+    serve_parser = subparsers.add_parser('serve', help='启动本地 HTTP 接口，供其他程序提交任务和订阅进度')
+    serve_parser.add_argument('--host', help='监听地址，默认使用设置中的 api_host（127.0.0.1）')
+    serve_parser.add_argument('--port', type=int, help='监听端口，默认使用设置中的 api_port，0 表示随机端口')
+    serve_parser.add_argument('--token', help='访问令牌，请求需带上 Authorization: Bearer <令牌>；监听本机以外的地址时必须设置')
+    serve_parser.add_argument('-P', '--output-dir', help='下载保存目录，默认当前目录')
+    serve_parser.add_argument('--journal', help='队列记录文件；重新启动时接着未完成的任务继续')
+    serve_parser.add_argument('--cookies', help='Netscape 格式的 Cookies 文件')
+    serve_parser.add_argument('-j', '--workers', type=int, help='同时下载的任务数')
+    serve_parser.set_defaults(handler=run_serve)
+
+    archive_parser = subparsers.add_parser('archive', help='查询或删除下载记录')
+    archive_parser.add_argument('-s', '--search', help='按标题、URL、视频 ID 或文件路径搜索')
+    archive_parser.add_argument('--status', choices=['done', 'partial'], help='只显示已完成或未完成的记录')
+    archive_parser.add_argument('-n', '--limit', type=int, default=200, help='最多显示的条数，默认 200')
+    archive_parser.add_argument('--remove', action='append', metavar='URL', help='删除该视频的所有记录，可重复')
+    archive_parser.add_argument('-o', '--output', default='-', help='结果 JSON 文件，默认输出到标准输出')
+    archive_parser.set_defaults(handler=run_archive)
+
+    update_parser = subparsers.add_parser('update', help='更新程序目录下的 yt-dlp')
+    update_parser.add_argument('--api-url', help='发布信息接口地址，默认使用设置中的 update_api_url')
+    update_parser.set_defaults(handler=run_update)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
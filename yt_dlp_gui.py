@@ -1,468 +1,563 @@
+import time
+
+# 启动计时从导入 Qt 之前开始
+STARTUP_START = time.perf_counter()
+
 import sys
 import os
-import re
-import time
-import traceback
-import subprocess
-import ctypes
-import tempfile
-import shutil
-import urllib.request
-import json
 
 # 导入Qt相关模块
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QLabel, QLineEdit, QPushButton,
                              QProgressBar, QComboBox, QFileDialog, QMessageBox, QMenu,
-                             QPlainTextEdit)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
-from PyQt6.QtGui import QAction, QIcon
+                             QPlainTextEdit, QTableWidget, QTableWidgetItem, QHeaderView,
+                             QAbstractItemView, QDialog, QInputDialog)
+from PyQt6.QtCore import Qt, QThread, QObject, QTimer, QAbstractListModel, QModelIndex, pyqtSignal
+from PyQt6.QtGui import QAction, QIcon, QTextCursor
+
+# 嗅探、下载、更新等逻辑都在不依赖 Qt 的 yt_dlp_core 中，界面只负责展示
+from yt_dlp_core import (DownloaderCore, FormatTable, SniffTask, PlaylistTask, JobQueue, PLAYLIST_POLICIES,
+                         ProgressThrottle, PhaseTimer, UpdateTask, is_playlist_url, get_managed_ytdlp_path,
+                         invalidate_ytdlp_command, get_progress_percent, format_progress_text, format_size_label,
+                         JobJournal, get_queue_journal_path, get_sniffable_url, SniffPool, select_format_for_policy,
+                         ApiServer)
+
+
+def apply_dark_title_bar(widget):
+    # 在Windows 10/11上设置深色标题栏，其他系统直接跳过，也不加载 ctypes
+    if os.name != 'nt':
+        return
+    try:
+        from ctypes import windll, c_int, byref, sizeof
 
+        # DWMWA_USE_IMMERSIVE_DARK_MODE = 20 用于Windows 10/11
+        # DWMWA_CAPTION_COLOR = 35 用于Windows 11 22H2及以上版本
+        DWMWA_USE_IMMERSIVE_DARK_MODE = 20
+        DWMWA_CAPTION_COLOR = 35
+
+        # 获取窗口句柄
+        hwnd = int(widget.winId())
+
+        # 设置深色模式
+        dark_mode_value = c_int(2)  # 2表示启用深色模式
+        windll.dwmapi.DwmSetWindowAttribute(
+            hwnd,
+            DWMWA_USE_IMMERSIVE_DARK_MODE,
+            byref(dark_mode_value),
+            sizeof(dark_mode_value)
+        )
+
+        # 尝试设置标题栏颜色（仅适用于Windows 11 22H2及以上版本）
+        try:
+            # 设置标题栏颜色为深灰色 (#2b2b2b)
+            # 颜色格式为ABGR，其中A为透明度
+            caption_color = c_int(0xFF2B2B2B)  # 完全不透明的深灰色
+            windll.dwmapi.DwmSetWindowAttribute(
+                hwnd,
+                DWMWA_CAPTION_COLOR,
+                byref(caption_color),
+                sizeof(caption_color)
+            )
+        except Exception:
+            # 如果设置标题栏颜色失败，可能是因为系统版本不支持
+            pass
+    except Exception as e:
+        # 如果设置深色标题栏失败，记录错误但不影响程序运行
+        print(f"设置深色标题栏失败: {e}")
+
+
+# 深色主题样式表（已合并重复的选择器）
+DARK_STYLESHEET = """
+    QMainWindow, QWidget {
+        background-color: #2b2b2b;
+        color: #ffffff;
+    }
+    QMenuBar {
+        background-color: #2b2b2b;
+        color: #ffffff;
+        border-bottom: 1px solid #555555;
+    }
+    QMenuBar::item {
+        background-color: transparent;
+        padding: 4px 8px;
+    }
+    QMenuBar::item:selected {
+        background-color: #3b3b3b;
+        border-radius: 3px;
+    }
+    QMenuBar::item:pressed {
+        background-color: #4b4b4b;
+    }
+    QMenu {
+        background-color: #2b2b2b;
+        border: 1px solid #555555;
+        padding: 5px 0px;
+    }
+    QMenu::item {
+        padding: 5px 20px;
+        border: 1px solid transparent;
+    }
+    QMenu::item:selected {
+        background-color: #3b3b3b;
+    }
+    QLineEdit, QComboBox {
+        background-color: #3b3b3b;
+        border: 1px solid #555555;
+        padding: 5px;
+        border-radius: 3px;
+    }
+    QPushButton {
+        background-color: #3b3b3b;
+        border: 1px solid #555555;
+        padding: 5px 10px;
+        border-radius: 3px;
+    }
+    QPushButton:hover {
+        background-color: #4b4b4b;
+        border-color: #666666;
+    }
+    QPushButton:pressed {
+        background-color: #2b2b2b;
+        border-color: #777777;
+    }
+    QPushButton:disabled {
+        background-color: #2b2b2b;
+        color: #666666;
+        border-color: #444444;
+    }
+    QComboBox:drop-down {
+        border: none;
+        width: 20px;
+    }
+    QComboBox:down-arrow {
+        image: none;
+    }
+    QComboBox QAbstractItemView {
+        background-color: #3b3b3b;
+        selection-background-color: #4b4b4b;
+        border: 1px solid #555555;
+    }
+"""
+
+
+class FormatListModel(QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.table = FormatTable()
+
+    def set_table(self, table):
+        # 整个格式表一次性替换，只触发一次重置，不再逐条 addItem
+        self.beginResetModel()
+        self.table = table
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.table)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.table.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return row['label']
+        if role == Qt.ItemDataRole.UserRole:
+            return row['id']
+        return None
 
-def get_runtime_dir():
-    if getattr(sys, 'frozen', False):
-        return os.path.dirname(sys.executable)
-    return os.path.dirname(os.path.abspath(__file__))
 
+class SniffThread(QThread):
+    progress_signal = pyqtSignal(str)
+    finished_signal = pyqtSignal(bool, str, object, str)
 
-def get_managed_ytdlp_path():
-    return os.path.join(get_runtime_dir(), 'yt-dlp.exe')
+    def __init__(self, url, parent=None):
+        super().__init__(parent)
+        self.url = url
+        self.task = SniffTask(parent.core, url)
+        self.line_throttle = ProgressThrottle(parent.core.get_progress_interval())
 
+    def emit_line(self, line):
+        if self.line_throttle.offer(line):
+            self.progress_signal.emit(line)
 
-def resolve_ytdlp_command():
-    managed_path = get_managed_ytdlp_path()
-    if os.path.exists(managed_path):
-        return managed_path
+    def run(self):
+        success, message, formats, cookie_mode = self.task.run(self.emit_line)
+        self.finished_signal.emit(success, message, formats, cookie_mode or 'none')
 
-    path_cmd = shutil.which('yt-dlp.exe') or shutil.which('yt-dlp')
-    if path_cmd:
-        return path_cmd
+    def stop(self):
+        self.task.stop()
 
-    return managed_path
 
-class SniffThread(QThread):
+class PlaylistThread(QThread):
     progress_signal = pyqtSignal(str)
-    finished_signal = pyqtSignal(bool, str, list, str)
+    entry_signal = pyqtSignal(dict)
+    finished_signal = pyqtSignal(bool, str, int)
 
     def __init__(self, url, parent=None):
         super().__init__(parent)
         self.url = url
-        self.is_running = True
-        self.available_formats = []
-        self.subtitle_entries = []
-        self.process = None
-        self.subtitle_process = None
-
-    def build_sniff_cmd(self, cookie_mode):
-        cmd = [self.parent().get_ytdlp_command(), '-F']
-        if cookie_mode == 'firefox':
-            cmd.extend(['--cookies-from-browser', 'firefox'])
-        elif cookie_mode == 'file':
-            cmd.extend(['--cookies', self.parent().cookie_file])
-        cmd.extend([self.url, '--newline'])
-        return cmd
-
-    def build_subtitle_cmd(self, cookie_mode):
-        cmd = [self.parent().get_ytdlp_command(), '--list-subs']
-        if cookie_mode == 'firefox':
-            cmd.extend(['--cookies-from-browser', 'firefox'])
-        elif cookie_mode == 'file':
-            cmd.extend(['--cookies', self.parent().cookie_file])
-        cmd.append(self.url)
-        return cmd
-
-    def collect_subtitles(self, cookie_mode):
-        process = subprocess.Popen(
-            self.build_subtitle_cmd(cookie_mode),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            creationflags=subprocess.CREATE_NO_WINDOW,
-        )
-        self.subtitle_process = process
-        output, _ = process.communicate()
-        self.subtitle_process = None
-        if process.returncode != 0:
-            return
+        self.task = PlaylistTask(parent.core, url)
 
-        for raw_line in output.splitlines():
-            line = raw_line.strip()
-            subtitle_match = re.match(r'^([a-zA-Z0-9_-]+)\s+(.*)$', line)
-            if not subtitle_match:
-                continue
-            subtitle_lang = subtitle_match.group(1)
-            subtitle_note = subtitle_match.group(2).strip()
-            if subtitle_lang.lower() in {'language', 'code', 'name'}:
-                continue
-            if not re.search(r'(vtt|ttml|srv\d|json3|srt|ass)', subtitle_note, re.IGNORECASE):
-                continue
+    def run(self):
+        success, message, count = self.task.run(self.progress_signal.emit, self.entry_signal.emit)
+        self.finished_signal.emit(success, message, count)
 
-            subtitle_kind = '自动字幕' if 'auto' in subtitle_note.lower() else '字幕'
-            subtitle_id = f'subtitle:{subtitle_lang}:{"auto" if "auto" in subtitle_note.lower() else "manual"}'
-            subtitle_info = f'{subtitle_kind}/{subtitle_lang}'
-            if subtitle_note:
-                subtitle_info += f'/{subtitle_note}'
-            if not any(existing_id == subtitle_id for existing_id, _ in self.subtitle_entries):
-                self.subtitle_entries.append((subtitle_id, subtitle_info))
-
-    def run_sniff(self, cookie_mode):
-        self.available_formats = []
-        self.subtitle_entries = []
-        process = subprocess.Popen(
-            self.build_sniff_cmd(cookie_mode),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            creationflags=subprocess.CREATE_NO_WINDOW,
-        )
-        self.process = process
-
-        while self.is_running:
-            line = process.stdout.readline()
-            if not line:
-                break
-            self.progress_signal.emit(line.strip())
-
-            if 'avc1' in line.lower() or 'h264' in line.lower() or 'm4a' in line.lower() or 'aac' in line.lower():
-                parts = line.split()
-                if len(parts) >= 3:
-                    format_id = parts[0]
-                    resolution = None
-                    fps = None
-                    filesize = 0
-
-                    for part in parts:
-                        if 'x' in part and part[0].isdigit():
-                            resolution = part.split('x')[1] + 'p'
-                            break
-
-                    for part in parts:
-                        if 'fps' in part.lower():
-                            try:
-                                fps_str = part.lower()
-                                fps_val = ''.join([c for c in fps_str if c.isdigit() or c == '.'])
-                                if fps_val:
-                                    fps = int(float(fps_val))
-                                    print(f"成功解析帧率: {fps}fps")
-                            except Exception as e:
-                                print(f"解析帧率错误: {e}")
-                            break
-
-                    if fps is None:
-                        try:
-                            fps_match = re.search(r'(\d+(\.\d+)?)\s*fps', line.lower())
-                            if fps_match:
-                                fps = int(float(fps_match.group(1)))
-                                print(f"通过正则表达式解析帧率: {fps}fps")
-                        except Exception as e:
-                            print(f"正则解析帧率错误: {e}")
-
-                    if filesize == 0:
-                        try:
-                            size_match = re.search(r'(\d+(\.\d+)?)\s*(G|M|K)iB', line, re.IGNORECASE)
-                            if size_match:
-                                size = float(size_match.group(1))
-                                unit = size_match.group(3).upper()
-                                if unit == 'G':
-                                    filesize = size * 1024
-                                elif unit == 'M':
-                                    filesize = size
-                                elif unit == 'K':
-                                    filesize = size / 1024
-                        except Exception as e:
-                            print(f"正则解析文件大小错误: {e}")
-
-                    for i, part in enumerate(parts):
-                        if ('filesize' in part.lower() or 'filesize_approx' in part.lower() or
-                            'mib' in part.lower() or 'gib' in part.lower() or 'kib' in part.lower() or
-                            (i < len(parts) - 1 and ('mib' in parts[i+1].lower() or 'gib' in parts[i+1].lower() or 'kib' in parts[i+1].lower()))):
-                            try:
-                                size_str = ''
-                                if 'mib' in part.lower() or 'gib' in part.lower() or 'kib' in part.lower():
-                                    size_str = part
-                                elif '~' in part and (i < len(parts) - 1) and ('mib' in parts[i+1].lower() or 'gib' in parts[i+1].lower() or 'kib' in parts[i+1].lower()):
-                                    size_str = part.replace('~', '') + ' ' + parts[i+1]
-                                elif part.replace('.', '', 1).isdigit() and (i < len(parts) - 1) and ('mib' in parts[i+1].lower() or 'gib' in parts[i+1].lower() or 'kib' in parts[i+1].lower()):
-                                    size_str = part + ' ' + parts[i+1]
-                                elif '~' in part:
-                                    size_str = part.split('~')[-1]
-                                elif '=' in part:
-                                    size_str = part.split('=')[-1]
-                                elif part.lower().startswith('filesize'):
-                                    size_str = part.lower().replace('filesize', '').replace('_approx', '').strip()
-
-                                if size_str:
-                                    clean_str = size_str.replace('~', '').strip()
-                                    num_part = ''
-                                    for c in clean_str:
-                                        if c.isdigit() or c == '.':
-                                            num_part += c
-                                        elif num_part:
-                                            break
-
-                                    if num_part:
-                                        size = float(num_part)
-                                        if 'gib' in size_str.lower() or 'g' in size_str.lower():
-                                            filesize = size * 1024
-                                        elif 'mib' in size_str.lower() or 'm' in size_str.lower():
-                                            filesize = size
-                                        elif 'kib' in size_str.lower() or 'k' in size_str.lower():
-                                            filesize = size / 1024
-                            except Exception as e:
-                                print(f"解析文件大小错误: {e}")
-                            break
-
-                    is_audio = 'm4a' in line.lower() or 'aac' in line.lower()
-                    if (resolution and resolution.endswith('p')) or is_audio:
-                        format_info = '音频/AAC' if is_audio else f'{resolution}/H.264'
-                        if fps:
-                            format_info += f'/{fps}fps'
-                        if filesize > 0:
-                            if filesize >= 1024:
-                                format_info += f'/{round(filesize/1024, 2)}GB'
-                            else:
-                                format_info += f'/{round(filesize, 1)}MB'
-                        else:
-                            try:
-                                size_match = re.search(r'~?\s*(\d+(\.\d+)?)\s*(G|M|K)i?B', line, re.IGNORECASE)
-                                if size_match:
-                                    size = float(size_match.group(1))
-                                    unit = size_match.group(3).upper()
-                                    if unit == 'G':
-                                        format_info += f'/{round(size, 2)}GB'
-                                    elif unit == 'M':
-                                        format_info += f'/{round(size, 1)}MB'
-                                    elif unit == 'K':
-                                        format_info += f'/{round(size, 1)}KB'
-                            except Exception as e:
-                                print(f"最后尝试解析文件大小错误: {e}")
-
-                        if not any(existing_id == format_id for existing_id, _ in self.available_formats):
-                            self.available_formats.append((format_id, format_info))
-
-
-        if not self.is_running:
-            if process.poll() is None:
-                process.terminate()
-            return False, '嗅探已取消', []
-
-        process.wait()
-        if process.returncode == 0:
-            self.collect_subtitles(cookie_mode)
-            if not self.available_formats and not self.subtitle_entries:
-                return False, '未找到可用的H.264视频格式或字幕', []
-
-            resolutions = {
-                '2160p': 2160,
-                '1440p': 1440,
-                '1080p': 1080,
-                '720p': 720,
-                '480p': 480,
-                '360p': 360,
-                '240p': 240,
-                '144p': 144,
-            }
-            self.available_formats.sort(key=lambda x: resolutions.get(x[1].split('/')[0], 0), reverse=True)
-            combined_formats = self.available_formats + self.subtitle_entries
-            return True, '嗅探完成', combined_formats
+    def stop(self):
+        self.task.stop()
 
-        return False, '嗅探失败', []
 
-    def run(self):
-        try:
-            is_youtube = 'youtube.com' in self.url.lower() or 'youtu.be' in self.url.lower()
-            cookie_modes = ['none']
-            if is_youtube:
-                if self.parent().manual_cookie_enabled and os.path.exists(self.parent().cookie_file):
-                    cookie_modes = ['file']
-                else:
-                    cookie_modes = ['none', 'firefox']
-
-            last_message = '嗅探失败'
-            for cookie_mode in cookie_modes:
-                if is_youtube and cookie_mode == 'firefox':
-                    self.progress_signal.emit('普通嗅探失败，正在尝试调用 Firefox Cookies...')
-                success, message, formats = self.run_sniff(cookie_mode)
-                if success:
-                    self.finished_signal.emit(True, message, formats, cookie_mode)
-                    return
-                last_message = message
-                if not self.is_running:
-                    self.finished_signal.emit(False, '嗅探已取消', [], cookie_mode)
-                    return
-
-            if is_youtube and not self.parent().manual_cookie_enabled:
-                self.finished_signal.emit(False, 'Firefox Cookies 调用失败，请手动输入 Cookies 后重试。', [], 'show_cookie_input')
-                return
+class DownloadQueueSignals(QObject):
+    # 下载队列在工作线程里回调，这里转成信号交给界面线程处理
+    job_added = pyqtSignal(object)
+    job_updated = pyqtSignal(object)
+    job_progress = pyqtSignal(object, str)
+    job_progress_data = pyqtSignal(object, dict)
+    queue_idle = pyqtSignal()
 
-            self.finished_signal.emit(False, last_message, [], 'none')
-        except Exception as e:
-            self.finished_signal.emit(False, f'嗅探时发生错误：{str(e)}', [], 'none')
+    def on_job_added(self, job):
+        self.job_added.emit(job)
 
-    def stop(self):
-        self.is_running = False
-        if self.process and self.process.poll() is None:
-            self.process.terminate()
-        if self.subtitle_process and self.subtitle_process.poll() is None:
-            self.subtitle_process.terminate()
+    def on_job_updated(self, job):
+        self.job_updated.emit(job)
+
+    def on_job_line(self, job, text):
+        self.job_progress.emit(job, text)
+
+    def on_job_progress(self, job, progress):
+        self.job_progress_data.emit(job, progress)
+
+    def on_queue_idle(self):
+        self.queue_idle.emit()
 
-class DownloadThread(QThread):
-    progress_signal = pyqtSignal(str)
-    finished_signal = pyqtSignal(bool, str)
 
-    def __init__(self, url, format_id, parent=None):
+class SniffPoolSignals(QObject):
+    # 嗅探池在工作线程里回调，这里转成信号交给界面线程处理
+    sniff_started = pyqtSignal(str)
+    sniff_finished = pyqtSignal(str, bool, str, object, str)
+    pool_idle = pyqtSignal()
+
+    def on_sniff_started(self, url):
+        self.sniff_started.emit(url)
+
+    def on_sniff_line(self, url, text):
+        pass
+
+    def on_sniff_finished(self, url, success, message, formats, cookie_mode):
+        self.sniff_finished.emit(url, success, message, formats, cookie_mode)
+
+    def on_pool_idle(self):
+        self.pool_idle.emit()
+
+
+class BulkSniffDialog(QDialog):
+    def __init__(self, core, download_queue, parent=None):
         super().__init__(parent)
-        self.url = url
-        self.format_id = format_id
-        self.is_running = True
-        self.process = None
+        self.core = core
+        self.download_queue = download_queue
+        # 每个链接一行：url -> {'row', 'formats', 'cookie_mode', 'queued'}
+        self.items = {}
+        self.signals = SniffPoolSignals(self)
+        self.signals.sniff_started.connect(self.sniff_started)
+        self.signals.sniff_finished.connect(self.sniff_finished)
+        self.signals.pool_idle.connect(self.update_count)
+        self.pool = SniffPool(core, self.signals)
+        self.setWindowTitle('批量嗅探')
+        self.resize(820, 520)
+        apply_dark_title_bar(self)
+
+        layout = QVBoxLayout(self)
+        self.url_input = QPlainTextEdit()
+        self.url_input.setPlaceholderText('每行一个视频链接，可以一次粘贴几百个；播放列表请在主界面添加')
+        self.url_input.setFixedHeight(110)
+        layout.addWidget(self.url_input)
+
+        input_layout = QHBoxLayout()
+        load_button = QPushButton('从文件载入...')
+        load_button.clicked.connect(self.load_file)
+        sniff_button = QPushButton('开始嗅探')
+        sniff_button.clicked.connect(self.start_sniff)
+        stop_button = QPushButton('停止')
+        stop_button.clicked.connect(self.stop_sniff)
+        input_layout.addWidget(load_button)
+        input_layout.addStretch()
+        input_layout.addWidget(sniff_button)
+        input_layout.addWidget(stop_button)
+        layout.addLayout(input_layout)
+
+        self.table = QTableWidget(0, 3)
+        self.table.setHorizontalHeaderLabels(['视频', '状态', '格式'])
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        self.count_label = QLabel()
+        self.policy_combo = QComboBox()
+        # 和播放列表一样按策略挑格式，每个视频的实际格式显示在表格里
+        for policy_id, label in PLAYLIST_POLICIES:
+            self.policy_combo.addItem(label.split('/', 1)[1], policy_id)
+        self.policy_combo.currentIndexChanged.connect(self.refresh_formats)
+        add_button = QPushButton('加入下载队列')
+        add_button.clicked.connect(self.add_to_queue)
+        close_button = QPushButton('关闭')
+        close_button.clicked.connect(self.hide)
+        button_layout.addWidget(self.count_label)
+        button_layout.addStretch()
+        button_layout.addWidget(QLabel('下载格式：'))
+        button_layout.addWidget(self.policy_combo)
+        button_layout.addWidget(add_button)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+        self.update_count()
+
+    def load_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, '载入链接列表', '', '文本文件 (*.txt);;所有文件 (*)')
+        if not path:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.url_input.appendPlainText(f.read().strip())
+        except Exception as e:
+            QMessageBox.warning(self, '错误', f'读取链接列表失败：{str(e)}')
+
+    def start_sniff(self):
+        urls = []
+        skipped = 0
+        for line in self.url_input.toPlainText().splitlines():
+            url = line.strip()
+            if not url or url.startswith('#'):
+                continue
+            if is_playlist_url(url):
+                skipped += 1
+                continue
+            item = self.items.get(url)
+            # 已经成功或正在嗅探的链接不重复添加，失败和取消的可以重试
+            if item and (item['formats'] is not None or item['status'] in ('等待嗅探', '正在嗅探')):
+                continue
+            if item is None:
+                item = {'row': self.table.rowCount(), 'formats': None, 'cookie_mode': 'none', 'queued': False}
+                self.items[url] = item
+                self.table.insertRow(item['row'])
+                url_item = QTableWidgetItem(url)
+                url_item.setToolTip(url)
+                self.table.setItem(item['row'], 0, url_item)
+                self.table.setItem(item['row'], 2, QTableWidgetItem(''))
+            self.set_status(url, '等待嗅探')
+            urls.append(url)
+        self.url_input.clear()
+        if skipped:
+            QMessageBox.information(self, '提示', f'已跳过 {skipped} 个播放列表链接，请在主界面按策略添加')
+        self.pool.add_urls(urls)
+        self.update_count()
+
+    def stop_sniff(self):
+        self.pool.stop()
+        # 还没开始的链接不会再有结果，直接标记为已取消
+        for url, item in self.items.items():
+            if item['status'] == '等待嗅探':
+                self.set_status(url, '已取消')
+        self.update_count()
+
+    def set_status(self, url, status, tooltip=''):
+        item = self.items[url]
+        item['status'] = status
+        status_item = QTableWidgetItem(status)
+        status_item.setToolTip(tooltip)
+        self.table.setItem(item['row'], 1, status_item)
+
+    def sniff_started(self, url):
+        if url in self.items:
+            self.set_status(url, '正在嗅探')
+
+    def sniff_finished(self, url, success, message, formats, cookie_mode):
+        item = self.items.get(url)
+        if item is None:
+            return
+        if success and formats:
+            item['formats'] = formats
+            item['cookie_mode'] = cookie_mode
+            self.set_status(url, '已从缓存载入' if message == '已从缓存载入' else '嗅探完成')
+            self.update_format(url)
+        else:
+            self.set_status(url, '嗅探失败' if message != '嗅探已取消' else '已取消', message)
+        self.update_count()
+
+    def get_selected_format(self, url):
+        formats = self.items[url]['formats']
+        return select_format_for_policy(formats, self.policy_combo.currentData()) if formats else None
+
+    def update_format(self, url):
+        selected = self.get_selected_format(url)
+        text = selected[1] if selected else ('没有符合的格式' if self.items[url]['formats'] else '')
+        self.table.setItem(self.items[url]['row'], 2, QTableWidgetItem(text))
+
+    def refresh_formats(self):
+        for url in self.items:
+            self.update_format(url)
+
+    def update_count(self):
+        done = sum(1 for item in self.items.values() if item['formats'] is not None)
+        running = self.pool.pending_count()
+        text = f'已嗅探 {done} / {len(self.items)}'
+        self.count_label.setText(text + (f'，剩余 {running} 个' if running else ''))
+
+    def add_to_queue(self):
+        # 有选中的行只加入选中的，否则加入全部嗅探成功的
+        rows = {index.row() for index in self.table.selectedIndexes()}
+        added = 0
+        for url, item in self.items.items():
+            if item['queued'] or (rows and item['row'] not in rows):
+                continue
+            selected = self.get_selected_format(url)
+            if not selected:
+                continue
+            format_id, format_label = selected
+            self.download_queue.add_job(url, format_id, format_label, item['cookie_mode'])
+            item['queued'] = True
+            self.set_status(url, '已加入队列')
+            added += 1
+        if not added:
+            QMessageBox.warning(self, '警告', '没有可以加入队列的视频')
 
-    def run(self):
+
+class ArchiveDialog(QDialog):
+    STATUS_TEXT = {'done': '已完成', 'partial': '未完成'}
+
+    def __init__(self, core, parent=None):
+        super().__init__(parent)
+        self.core = core
+        self.records = []
+        self.setWindowTitle('下载记录')
+        self.resize(760, 420)
+        apply_dark_title_bar(self)
+
+        layout = QVBoxLayout(self)
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText('按标题、URL、视频 ID 或文件路径搜索')
+        self.search_input.textChanged.connect(self.refresh)
+        layout.addWidget(self.search_input)
+
+        self.table = QTableWidget(0, 5)
+        self.table.setHorizontalHeaderLabels(['视频', '格式', '状态', '大小', '完成时间'])
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        self.count_label = QLabel()
+        remove_button = QPushButton('删除所选记录')
+        remove_button.clicked.connect(self.remove_selected)
+        close_button = QPushButton('关闭')
+        close_button.clicked.connect(self.accept)
+        button_layout.addWidget(self.count_label)
+        button_layout.addStretch()
+        button_layout.addWidget(remove_button)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+        self.refresh()
+
+    def refresh(self):
         try:
-            # 下载并合并视频和音频，选择最高码率的m4a(aac)音频
-            # 检查是否为YouTube链接，只有YouTube链接才需要Cookies
-            is_youtube = 'youtube.com' in self.url.lower() or 'youtu.be' in self.url.lower()
-            
-            is_subtitle = self.format_id.startswith('subtitle:')
-            if is_subtitle:
-                _, subtitle_lang, subtitle_mode = self.format_id.split(':', 2)
-                cmd = [self.parent().get_ytdlp_command()]
-                if subtitle_mode == 'auto':
-                    cmd.append('--write-auto-sub')
-                else:
-                    cmd.append('--write-sub')
-                cmd.extend(['--sub-lang', subtitle_lang, '--convert-subs', 'srt', '--skip-download'])
-            else:
-                cmd = [self.parent().get_ytdlp_command(), '-f', f'{self.format_id}+bestaudio[ext=m4a]']
-            if is_youtube and self.parent().cookie_mode == 'firefox':
-                cmd.extend(['--cookies-from-browser', 'firefox'])
-            elif is_youtube and self.parent().cookie_mode == 'file' and os.path.exists(self.parent().cookie_file):
-                cmd.extend(['--cookies', self.parent().cookie_file])
-            if is_subtitle:
-                cmd.extend([self.url, '--newline'])
-            else:
-                cmd.extend(['--merge-output-format', 'mp4', self.url, '--newline'])
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-            self.process = process
-            downloaded_file = None
-            
-            while self.is_running:
-                line = process.stdout.readline()
-                if not line:
-                    break
-                line = line.strip()
-                self.progress_signal.emit(line)
-                if '[download] Destination:' in line:
-                    downloaded_file = line.split(':', 1)[1].strip()
-                elif '[Merger] Merging formats into ' in line:
-                    downloaded_file = line.split('into ', 1)[1].strip().strip('"')
-            
-            process.wait()
-            if process.returncode == 0:
-                if downloaded_file and os.path.exists(downloaded_file):
-                    # 获取文件大小
-                    file_size = os.path.getsize(downloaded_file)
-                    file_size_str = ''
-                    if file_size >= 1024 * 1024 * 1024:  # GB
-                        file_size_str = f'.{round(file_size / (1024 * 1024 * 1024), 2)}G'
-                    elif file_size >= 1024 * 1024:  # MB
-                        file_size_str = f'.{round(file_size / (1024 * 1024), 1)}M'
-                    elif file_size >= 1024:  # KB
-                        file_size_str = f'.{round(file_size / 1024, 1)}K'
-                    
-                    # 获取文件扩展名和基本名称
-                    base_name, ext = os.path.splitext(downloaded_file)
-                    
-                    # 根据文件类型添加不同的后缀
-                    if ext.lower() in ['.m4a', '.aac']:
-                        new_name = f'{base_name}{file_size_str}{ext}'
-                    elif ext.lower() == '.mp4':
-                        format_info = next((label for label, fmt_id in self.parent().format_id_map.items() if fmt_id == self.format_id), '')
-                        resolution = format_info.split('/')[0] if format_info else ''
-                        if resolution:
-                            new_name = f'{base_name}.{resolution}{ext}'
-                        else:
-                            new_name = downloaded_file
-                    else:
-                        new_name = downloaded_file
-                    
-                    try:
-                        if new_name != downloaded_file:
-                            os.rename(downloaded_file, new_name)
-                    except Exception as e:
-                        print(f'重命名文件失败：{str(e)}')
-                
-                self.finished_signal.emit(True, '下载完成' if not is_subtitle else '字幕下载完成')
-            else:
-                self.finished_signal.emit(False, '下载失败')
+            self.records = self.core.archive.query(self.search_input.text().strip() or None, limit=500)
         except Exception as e:
-            self.finished_signal.emit(False, f'发生错误：{str(e)}')
+            print(f'读取下载记录失败：{str(e)}')
+            self.records = []
+        self.table.setRowCount(len(self.records))
+        for row, record in enumerate(self.records):
+            title_item = QTableWidgetItem(record['title'] or record['url'])
+            title_item.setToolTip(record['output_path'] or record['url'])
+            completed_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(record['completed_at'] or 0))
+            self.table.setItem(row, 0, title_item)
+            self.table.setItem(row, 1, QTableWidgetItem(record['format_label'] or record['format_id'] or ''))
+            self.table.setItem(row, 2, QTableWidgetItem(self.STATUS_TEXT.get(record['status'], record['status'])))
+            self.table.setItem(row, 3, QTableWidgetItem(format_size_label(record['size'])))
+            self.table.setItem(row, 4, QTableWidgetItem(completed_at))
+        self.count_label.setText(f'共 {len(self.records)} 条')
+
+    def remove_selected(self):
+        # 删除记录后再下载同一个视频就不会被跳过，文件本身不会被删除
+        rows = sorted({index.row() for index in self.table.selectedIndexes()})
+        for row in rows:
+            self.core.archive.remove(self.records[row]['url'])
+        if rows:
+            self.refresh()
+
+
+class JobLogDialog(QDialog):
+    PAGE_SIZE = 1000
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self.job = job
+        self.pages = job.log.read_pages(self.PAGE_SIZE)
+        self.setWindowTitle(f'任务日志 - {job.title}')
+        self.resize(860, 520)
+        apply_dark_title_bar(self)
+
+        layout = QVBoxLayout(self)
+        path_label = QLabel(job.log.path)
+        path_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        layout.addWidget(path_label)
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        layout.addWidget(self.text)
+
+        button_layout = QHBoxLayout()
+        self.more_button = QPushButton(f'加载后 {self.PAGE_SIZE} 行')
+        self.more_button.clicked.connect(self.load_more)
+        tail_button = QPushButton('最近的输出')
+        tail_button.clicked.connect(self.show_tail)
+        close_button = QPushButton('关闭')
+        close_button.clicked.connect(self.accept)
+        button_layout.addWidget(self.more_button)
+        button_layout.addWidget(tail_button)
+        button_layout.addStretch()
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+        self.load_more()
+
+    def load_more(self):
+        # 日志文件按页解压，只有点击时才继续往后读
+        page = next(self.pages, None)
+        if page is None:
+            self.more_button.setEnabled(False)
+            if not self.text.toPlainText():
+                self.show_tail()
+            return
+        self.text.appendPlainText('\n'.join(page))
+
+    def show_tail(self):
+        # 内存中只保留最近的几百行，文件写不了时也能看到
+        self.more_button.setEnabled(False)
+        self.text.setPlainText('\n'.join(self.job.log.tail()))
+        self.text.moveCursor(QTextCursor.MoveOperation.End)
 
-    def stop(self):
-        self.is_running = False
-        if self.process and self.process.poll() is None:
-            self.process.terminate()
 
 class UpdateYtDlpThread(QThread):
+    progress_signal = pyqtSignal(str)
+    progress_data_signal = pyqtSignal(dict)
     finished_signal = pyqtSignal(bool, str)
 
     def __init__(self, target_path, current_command, parent=None):
         super().__init__(parent)
-        self.target_path = target_path
-        self.current_command = current_command
-
-    def get_local_version(self):
-        try:
-            if not self.current_command or not os.path.exists(self.current_command):
-                return None
-            result = subprocess.run(
-                [self.current_command, '--version'],
-                capture_output=True,
-                text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
-                timeout=15,
-            )
-            if result.returncode == 0:
-                return result.stdout.strip()
-        except Exception:
-            pass
-        return None
+        self.task = UpdateTask(parent.core, target_path, current_command)
+        self.progress_throttle = ProgressThrottle(parent.core.get_progress_interval())
 
-    def get_latest_version(self):
-        request = urllib.request.Request(
-            'https://api.github.com/repos/yt-dlp/yt-dlp/releases/latest',
-            headers={'User-Agent': 'yt_dlp_gui'}
-        )
-        with urllib.request.urlopen(request, timeout=20) as response:
-            data = json.loads(response.read().decode('utf-8'))
-        return str(data.get('tag_name', '')).strip() or None
+    def emit_progress(self, progress):
+        # 按块回调的字节进度合并后再发给界面
+        if self.progress_throttle.offer(progress, progress['downloaded_bytes'] == progress['total_bytes']):
+            self.progress_data_signal.emit(progress)
 
     def run(self):
-        temp_path = self.target_path + '.download'
-        download_url = 'https://github.com/yt-dlp/yt-dlp/releases/latest/download/yt-dlp.exe'
-        try:
-            local_version = self.get_local_version()
-            latest_version = self.get_latest_version()
-            target_exists = os.path.exists(self.target_path)
-            if target_exists and local_version and latest_version and local_version == latest_version:
-                self.finished_signal.emit(True, f'无需更新，已经是最新版啦：{local_version}')
-                return
-
-            os.makedirs(os.path.dirname(self.target_path), exist_ok=True)
-            urllib.request.urlretrieve(download_url, temp_path)
-            if os.path.exists(self.target_path):
-                os.remove(self.target_path)
-            os.replace(temp_path, self.target_path)
+        success, message = self.task.run(self.progress_signal.emit, self.emit_progress)
+        self.finished_signal.emit(success, message)
 
-            final_version = latest_version or self.get_local_version() or '未知版本'
-            self.finished_signal.emit(True, f'yt-dlp 更新完成：{final_version}')
-        except Exception as e:
-            try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-            except Exception:
-                pass
-            self.finished_signal.emit(False, f'yt-dlp 更新失败：{str(e)}')
+    def stop(self):
+        self.task.stop()
 
 
 class MainWindow(QMainWindow):
@@ -470,59 +565,41 @@ class MainWindow(QMainWindow):
         super().__init__()
         self.setWindowTitle('yt_dlp_gui v1.0.5 @少昊金天氏')
         self.setMinimumSize(533, 400)
-        # 在Windows 10/11上设置深色标题栏
-        # 导入必要的模块
-        import ctypes
-        from ctypes import windll, c_int, byref, sizeof
-        
         # 设置窗口属性
         self.setAttribute(Qt.WidgetAttribute.WA_StyledBackground, True)
-        
-        # 使用Windows 11的深色标题栏API
-        try:
-            # DWMWA_USE_IMMERSIVE_DARK_MODE = 20 用于Windows 10/11
-            # DWMWA_CAPTION_COLOR = 35 用于Windows 11 22H2及以上版本
-            DWMWA_USE_IMMERSIVE_DARK_MODE = 20
-            DWMWA_CAPTION_COLOR = 35
-            
-            # 获取窗口句柄
-            hwnd = int(self.winId())
-            
-            # 设置深色模式
-            dark_mode_value = c_int(2)  # 2表示启用深色模式
-            windll.dwmapi.DwmSetWindowAttribute(
-                hwnd, 
-                DWMWA_USE_IMMERSIVE_DARK_MODE, 
-                byref(dark_mode_value), 
-                sizeof(dark_mode_value)
-            )
-            
-            # 尝试设置标题栏颜色（仅适用于Windows 11 22H2及以上版本）
-            try:
-                # 设置标题栏颜色为深灰色 (#2b2b2b)
-                # 颜色格式为ABGR，其中A为透明度
-                caption_color = c_int(0xFF2B2B2B)  # 完全不透明的深灰色
-                windll.dwmapi.DwmSetWindowAttribute(
-                    hwnd, 
-                    DWMWA_CAPTION_COLOR, 
-                    byref(caption_color), 
-                    sizeof(caption_color)
-                )
-            except Exception:
-                # 如果设置标题栏颜色失败，可能是因为系统版本不支持
-                pass
-        except Exception as e:
-            # 如果设置深色标题栏失败，记录错误但不影响程序运行
-            pass
-        self.download_thread = None
+        # 在Windows 10/11上设置深色标题栏
+        apply_dark_title_bar(self)
         self.sniff_thread = None
+        self.playlist_thread = None
+        self.playlist_policy = None
         self.update_thread = None
-        self.cookie_file = os.path.join(tempfile.gettempdir(), 'YouTube-Cookies.txt')
-        self.ytdlp_path = resolve_ytdlp_command()
+        self.bulk_sniff_dialog = None
+        self.api_server = None
+        self.core = DownloaderCore()
         self.cookie_mode = 'none'
-        self.manual_cookie_enabled = False
-        self.format_id_map = {}
         self.is_sniffing = False
+        # 后台预嗅探不禁用按钮、失败不弹窗；用户点击后转为正常嗅探
+        self.sniff_speculative = False
+        self.cancelled_sniff_threads = set()
+        # 输入停顿后才处理链接，连续输入时不反复嗅探
+        self.url_timer = QTimer(self)
+        self.url_timer.setSingleShot(True)
+        self.url_timer.setInterval(int(self.core.settings['url_debounce_ms']))
+        self.url_timer.timeout.connect(self.url_settled)
+        self.queue_signals = DownloadQueueSignals(self)
+        journal = JobJournal(get_queue_journal_path()) if self.core.settings['restore_queue'] else None
+        self.download_queue = JobQueue(self.core, self.queue_signals, journal=journal)
+        self.queue_signals.job_added.connect(self.job_added)
+        self.queue_signals.job_updated.connect(self.job_updated)
+        self.queue_signals.job_progress.connect(self.job_progress)
+        self.queue_signals.job_progress_data.connect(self.job_progress_data)
+        self.queue_signals.queue_idle.connect(self.queue_idle)
+        self.job_rows = {}
+        # 按行号找任务、各状态的任务数和正在下载的任务都单独记下，进度刷新时不用扫描整个队列
+        self.row_jobs = []
+        self.job_states = {}
+        self.state_counts = {}
+        self.running_jobs = {}
 
         # 创建主窗口部件和布局
         central_widget = QWidget()
@@ -551,6 +628,10 @@ class MainWindow(QMainWindow):
         format_label = QLabel('嗅探结果：')
         format_label.setFixedWidth(60)  # 与URL标签保持相同宽度
         self.format_combo = QComboBox()
+        self.format_model = FormatListModel(self)
+        self.format_combo.setModel(self.format_model)
+        # 下拉列表按需绘制可见的行，格式很多时也能立即展开
+        self.format_combo.view().setUniformItemSizes(True)
         format_layout.addWidget(format_label)
         format_layout.addWidget(self.format_combo)
         layout.addLayout(format_layout)
@@ -594,28 +675,91 @@ class MainWindow(QMainWindow):
         self.progress_text = QLabel('准备就绪！（若下载失败请安装火狐浏览器并登录相应网站，比如油管以获得cookie。）')
         layout.addWidget(self.progress_text)
 
+        # 所有进行中任务的总进度
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.hide()
+        layout.addWidget(self.progress_bar)
+
+        # 下载队列，右键可暂停、继续、取消任务
+        self.job_table = QTableWidget(0, 4)
+        self.job_table.setHorizontalHeaderLabels(['视频', '格式', '状态', '进度'])
+        self.job_table.verticalHeader().setVisible(False)
+        self.job_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.job_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.job_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.ResizeMode.Stretch)
+        self.job_table.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.job_table.customContextMenuRequested.connect(self.show_job_menu)
+        layout.addWidget(self.job_table)
+
         # 创建菜单栏
         menubar = self.menuBar()
+        batch_menu = menubar.addMenu('批量')
+        bulk_sniff_action = QAction('批量嗅探...', self)
+        bulk_sniff_action.triggered.connect(self.show_bulk_sniff)
+        batch_menu.addAction(bulk_sniff_action)
+        archive_menu = menubar.addMenu('记录')
+        archive_action = QAction('下载记录', self)
+        archive_action.triggered.connect(self.show_archive)
+        archive_menu.addAction(archive_action)
+        settings_menu = menubar.addMenu('设置')
+        bandwidth_action = QAction('带宽限制...', self)
+        bandwidth_action.triggered.connect(self.set_bandwidth_limit)
+        settings_menu.addAction(bandwidth_action)
         help_menu = menubar.addMenu('帮助')
         about_action = QAction('关于', self)
         about_action.triggered.connect(self.show_about)
         help_menu.addAction(about_action)
 
+        # 窗口显示之后再恢复上次未完成的任务，不拖慢启动
+        QTimer.singleShot(0, self.restore_queue)
+
+    def restore_queue(self):
+        restored = self.download_queue.restore()
+        if restored:
+            self.progress_text.setText(f'已恢复上次未完成的 {len(restored)} 个任务')
+        if self.core.settings['api_enabled']:
+            self.start_api()
+
+    def start_api(self):
+        # 其他程序通过接口提交的任务和界面里添加的进入同一个队列
+        server = ApiServer(self.core, self.download_queue)
+        try:
+            address = server.start()
+        except Exception as e:
+            print(f'启动本地接口失败：{str(e)}')
+            return
+        self.api_server = server
+        self.setWindowTitle(f'{self.windowTitle()} - 接口 {address}')
+
     def get_ytdlp_command(self):
-        self.ytdlp_path = resolve_ytdlp_command()
-        return self.ytdlp_path
+        return self.core.get_ytdlp_command()
 
     def update_ytdlp(self):
         target_path = get_managed_ytdlp_path()
         self.update_ytdlp_button.setEnabled(False)
         self.progress_text.setText('正在更新 yt-dlp...')
         self.update_thread = UpdateYtDlpThread(target_path, self.get_ytdlp_command(), self)
+        self.update_thread.progress_signal.connect(self.progress_text.setText)
+        self.update_thread.progress_data_signal.connect(self.update_ytdlp_progress)
         self.update_thread.finished_signal.connect(self.update_ytdlp_finished)
         self.update_thread.start()
 
+    def update_ytdlp_progress(self, progress):
+        self.progress_text.setText(f'正在下载 yt-dlp {format_progress_text(progress)}')
+        percent = get_progress_percent(progress)
+        if percent is not None:
+            self.progress_bar.setValue(int(percent * 10))
+            self.progress_bar.show()
+
     def update_ytdlp_finished(self, success, message):
         self.update_ytdlp_button.setEnabled(True)
+        self.update_total_progress()
+        invalidate_ytdlp_command()
         self.get_ytdlp_command()
+        if success:
+            self.core.sniff_cache.clear()
         self.progress_text.setText(message)
         if success:
             QMessageBox.information(self, '成功', message)
@@ -628,27 +772,24 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, '警告', '请输入视频URL')
             return
             
-        # 如果没有可用的视频格式，需要先进行嗅探
+        # 播放列表/频道链接不整体嗅探，直接让用户选择下载策略
+        if not self.format_combo.count() and is_playlist_url(url):
+            self.populate_formats(FormatTable.from_entries(PLAYLIST_POLICIES))
+            self.progress_text.setText('已识别为播放列表/频道，请选择下载策略')
+            return
+
+        # 如果没有可用的视频格式，先查嗅探缓存，再进行嗅探
+        if not self.format_combo.count() and self.load_cached_formats(url):
+            return
+
         if not self.format_combo.count():
-            # 清空格式选择框
-            self.format_combo.clear()
-            self.format_id_map.clear()
-            
-            # 更改按钮文本和状态
-            self.download_button.setText('正在嗅探中')
-            self.download_button.setEnabled(False)  # 设置按钮为不可用状态
-            self.is_sniffing = True
-            self.progress_text.setText('正在嗅探可下载的视频、音频和字幕...')
-            
-            # 启动嗅探线程
-            if self.sniff_thread and self.sniff_thread.isRunning():
-                self.sniff_thread.stop()
-                self.sniff_thread.wait(1000)
-                
-            self.sniff_thread = SniffThread(url, self)
-            self.sniff_thread.progress_signal.connect(self.update_progress)
-            self.sniff_thread.finished_signal.connect(self.sniff_finished)
-            self.sniff_thread.start()
+            # 同一个链接已经在后台预嗅探，直接接着等结果
+            if self.sniff_thread and self.sniff_thread.url == url:
+                self.sniff_speculative = False
+                self.show_sniffing()
+                return
+            self.cancel_sniff()
+            self.start_sniff(url)
             return
         
         # 如果已有视频格式，执行下载操作
@@ -656,52 +797,132 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, '警告', '请选择视频格式')
             return
             
-        format_id = self.format_id_map[self.format_combo.currentText()]
-        
-        # 停止当前下载线程（如果有）
-        if self.download_thread and self.download_thread.isRunning():
-            self.download_thread.stop()
-            self.download_thread.wait(1000)
-
-        self.download_button.setText('正在下载中')
-        self.download_button.setEnabled(False)  # 设置按钮为不可用状态
-        self.download_thread = DownloadThread(url, format_id, self)
-        self.progress_text.setText('正在下载中...')
-        self.download_thread.progress_signal.connect(self.update_progress)
-        self.download_thread.finished_signal.connect(self.download_finished)
-        self.download_thread.start()
+        format_label = self.format_combo.currentText()
+        format_id = self.format_combo.currentData()
+
+        if format_id.startswith('policy:'):
+            self.start_playlist(url, format_id, format_label)
+            return
+
+        # 加入下载队列，不影响正在进行的下载
+        self.download_queue.add_job(url, format_id, format_label, self.cookie_mode)
+        self.progress_text.setText('已加入下载队列')
+
+    def start_sniff(self, url, speculative=False):
+        self.clear_formats()
+        self.is_sniffing = True
+        self.sniff_speculative = speculative
+        if speculative:
+            self.progress_text.setText('正在后台预先嗅探...')
+        else:
+            self.show_sniffing()
+        self.sniff_thread = SniffThread(url, self)
+        self.sniff_thread.progress_signal.connect(self.update_progress)
+        self.sniff_thread.finished_signal.connect(self.sniff_finished)
+        self.sniff_thread.finished.connect(self.sniff_thread.deleteLater)
+        self.sniff_thread.start()
+
+    def show_sniffing(self):
+        self.download_button.setText('正在嗅探中')
+        self.download_button.setEnabled(False)
+        self.progress_text.setText('正在嗅探可下载的视频、音频和字幕...')
+
+    def cancel_sniff(self):
+        # 不等待线程结束：子进程被结束后线程很快自己退出，旧链接的结果也不会再送到界面
+        thread = self.sniff_thread
+        if thread and thread.isRunning():
+            thread.progress_signal.disconnect()
+            thread.finished_signal.disconnect()
+            thread.stop()
+            self.cancelled_sniff_threads.add(thread)
+            thread.finished.connect(lambda: self.cancelled_sniff_threads.discard(thread))
+        self.sniff_thread = None
+        self.is_sniffing = False
+        self.sniff_speculative = False
+
+    def url_settled(self):
+        url = self.url_input.text().strip()
+        if not url or self.format_combo.count() or self.sniff_thread:
+            return
+        if self.load_cached_formats(url):
+            return
+        sniff_url = get_sniffable_url(url)
+        if sniff_url and self.core.settings['speculative_sniff']:
+            self.start_sniff(sniff_url, speculative=True)
+
+    def start_playlist(self, url, format_id, format_label):
+        if self.playlist_thread and self.playlist_thread.isRunning():
+            QMessageBox.warning(self, '警告', '正在读取播放列表，请稍候')
+            return
+
+        self.playlist_policy = (format_id, format_label)
+        self.progress_text.setText('正在读取播放列表...')
+        self.playlist_thread = PlaylistThread(url, self)
+        self.playlist_thread.progress_signal.connect(self.update_progress)
+        self.playlist_thread.entry_signal.connect(self.playlist_entry)
+        self.playlist_thread.finished_signal.connect(self.playlist_finished)
+        self.playlist_thread.start()
+
+    def playlist_entry(self, entry):
+        format_id, format_label = self.playlist_policy
+        self.download_queue.add_job(entry['url'], format_id, format_label, entry['cookie_mode'], entry['title'])
+
+    def playlist_finished(self, success, message, count):
+        self.progress_text.setText(message)
+        if not success and not count:
+            QMessageBox.warning(self, '错误', message)
 
     def update_progress(self, text):
         self.progress_text.setText(text)
 
+    def load_cached_formats(self, url):
+        formats, cookie_mode = self.core.lookup_cached_formats(url)
+        if not formats:
+            return False
+        self.cookie_mode = cookie_mode
+        self.populate_formats(formats)
+        self.progress_text.setText('已从缓存载入嗅探结果')
+        return True
+
+    def clear_formats(self):
+        self.format_model.set_table(FormatTable())
+
+    def populate_formats(self, formats):
+        self.format_model.set_table(formats)
+
+        # 自动选择第一个格式
+        if self.format_combo.count() > 0:
+            self.format_combo.setCurrentIndex(0)
+            # 更改按钮文本为开始下载
+            self.download_button.setText('开始下载')
+
     def sniff_finished(self, success, message, formats, cookie_mode):
+        # 取消前已经排进事件队列的旧结果直接丢弃
+        if self.sender() is not self.sniff_thread:
+            return
+        speculative = self.sniff_speculative
+        self.sniff_thread = None
         self.is_sniffing = False
+        self.sniff_speculative = False
         self.download_button.setText('开始嗅探')
         self.download_button.setEnabled(True)  # 恢复按钮为可用状态
-        
+
+        if speculative and not (success and formats):
+            # 预嗅探失败不打扰用户，点击开始嗅探时会重新尝试并提示原因
+            self.progress_text.setText('准备就绪')
+            return
+
         if success and formats:
             self.cookie_mode = cookie_mode
             self.cookie_container.hide()
             self.progress_text.setText('视频/字幕嗅探完成')
             # 清空并更新格式选择框
-            self.format_combo.clear()
-            self.format_id_map.clear()
-            
-            for format_id, resolution in formats:
-                self.format_combo.addItem(resolution)
-                self.format_id_map[resolution] = format_id
-            
-            # 自动选择第一个格式
-            if self.format_combo.count() > 0:
-                self.format_combo.setCurrentIndex(0)
-                # 更改按钮文本为开始下载
-                self.download_button.setText('开始下载')
+            self.populate_formats(formats)
         else:
             # 嗅探失败时重置状态
             self.download_button.setText('开始嗅探')
             self.progress_text.setText('准备就绪')
-            self.format_combo.clear()
-            self.format_id_map.clear()
+            self.clear_formats()
             
             if cookie_mode == 'show_cookie_input':
                 self.cookie_container.show()
@@ -712,15 +933,145 @@ class MainWindow(QMainWindow):
             elif not formats:
                 QMessageBox.warning(self, '警告', '未找到可下载的视频格式或字幕')
 
-    def download_finished(self, success, message):
-        self.download_button.setEnabled(True)  # 恢复按钮为可用状态
-        self.is_sniffing = False
-        self.progress_text.setText(message)
-        self.download_button.setText('开始下载')  # 无论成功失败都显示"开始下载"
-        if success:
-            QMessageBox.information(self, '成功', '下载完成！')
+    def job_added(self, job):
+        row = self.job_table.rowCount()
+        self.job_table.insertRow(row)
+        self.job_table.setItem(row, 0, QTableWidgetItem(job.title))
+        self.job_table.setItem(row, 1, QTableWidgetItem(job.format_label))
+        self.job_table.setItem(row, 2, QTableWidgetItem(job.message))
+        self.job_table.setItem(row, 3, QTableWidgetItem(''))
+        self.job_rows[job.job_id] = row
+        self.row_jobs.append(job)
+        self.track_job_state(job)
+
+    def track_job_state(self, job):
+        previous = self.job_states.get(job.job_id)
+        if previous == job.state:
+            return
+        if previous:
+            self.state_counts[previous] -= 1
+        self.state_counts[job.state] = self.state_counts.get(job.state, 0) + 1
+        self.job_states[job.job_id] = job.state
+        if job.state == 'running':
+            self.running_jobs[job.job_id] = job
+        else:
+            self.running_jobs.pop(job.job_id, None)
+
+    def job_updated(self, job):
+        row = self.job_rows.get(job.job_id)
+        if row is None:
+            return
+        self.track_job_state(job)
+        self.job_table.item(row, 1).setText(job.format_label)
+        self.job_table.item(row, 2).setText(job.message)
+        if job.state == 'failed' and job.log:
+            # 失败时把最后几行输出放在提示里，不用打开日志也能看到原因
+            self.job_table.item(row, 2).setToolTip('\n'.join(job.log.tail()[-10:]))
+        if job.state != 'running':
+            # 进度条只给正在下载的任务用，避免几千行列表各挂一个控件
+            self.job_table.removeCellWidget(row, 3)
+            percent = get_progress_percent(job.progress) if job.progress else None
+            finished = job.state in ('done', 'processing')
+            self.job_table.item(row, 3).setText('100%' if finished else (f'{percent:.1f}%' if percent else ''))
+        running = self.state_counts.get('running', 0)
+        queued = self.state_counts.get('queued', 0)
+        processing = self.state_counts.get('processing', 0)
+        text = f'下载中：{running}，排队中：{queued}'
+        if processing:
+            text += f'，后处理中：{processing}'
+        self.progress_text.setText(text)
+        self.update_total_progress()
+
+    def job_progress(self, job, text):
+        row = self.job_rows.get(job.job_id)
+        if row is not None and job.state == 'running':
+            self.job_table.item(row, 2).setText(text)
+
+    def job_progress_data(self, job, progress):
+        job.progress = progress
+        row = self.job_rows.get(job.job_id)
+        if row is None or job.state != 'running':
+            return
+        progress_bar = self.job_table.cellWidget(row, 3)
+        if progress_bar is None:
+            progress_bar = QProgressBar()
+            progress_bar.setRange(0, 1000)
+            self.job_table.setCellWidget(row, 3, progress_bar)
+        percent = get_progress_percent(progress)
+        if percent is None:
+            progress_bar.setRange(0, 0)
         else:
+            progress_bar.setRange(0, 1000)
+            progress_bar.setValue(int(percent * 10))
+        progress_bar.setFormat(format_progress_text(progress).replace('[download] ', ''))
+        self.update_total_progress()
+
+    def update_total_progress(self):
+        if not self.running_jobs:
+            self.progress_bar.hide()
+            return
+        percents = [get_progress_percent(job.progress) or 0 for job in self.running_jobs.values()]
+        self.progress_bar.setValue(int(sum(percents) * 10 / len(percents)))
+        self.progress_bar.show()
+
+    def queue_idle(self):
+        done = self.state_counts.get('done', 0)
+        failed = self.state_counts.get('failed', 0)
+        message = f'下载队列已完成：成功 {done} 个，失败 {failed} 个'
+        self.progress_text.setText(message)
+        if failed:
             QMessageBox.warning(self, '错误', message)
+        elif done:
+            QMessageBox.information(self, '成功', '下载完成！')
+
+    def show_job_menu(self, pos):
+        row = self.job_table.rowAt(pos.y())
+        if not 0 <= row < len(self.row_jobs):
+            return
+        job = self.row_jobs[row]
+
+        menu = QMenu(self)
+        pause_action = menu.addAction('暂停')
+        resume_action = menu.addAction('继续')
+        cancel_action = menu.addAction('取消')
+        pause_action.setEnabled(job.state in ('queued', 'running'))
+        resume_action.setEnabled(job.state in ('paused', 'failed'))
+        cancel_action.setEnabled(job.state not in ('done', 'cancelled', 'processing'))
+        menu.addSeparator()
+        priority_action = menu.addAction('带宽优先')
+        priority_action.setCheckable(True)
+        priority_action.setChecked(job.priority > 1)
+        log_action = menu.addAction('查看日志')
+        log_action.setEnabled(job.log is not None)
+
+        pause_action.triggered.connect(lambda: self.download_queue.pause_job(job))
+        resume_action.triggered.connect(lambda: self.download_queue.resume_job(job))
+        cancel_action.triggered.connect(lambda: self.download_queue.cancel_job(job))
+        priority_action.triggered.connect(lambda checked: self.download_queue.set_priority(job, 3 if checked else 1))
+        log_action.triggered.connect(lambda: JobLogDialog(job, self).exec())
+
+        menu.exec(self.job_table.viewport().mapToGlobal(pos))
+
+    def set_bandwidth_limit(self):
+        current = format_size_label(self.core.bandwidth.get_total_limit()) or '0'
+        text, ok = QInputDialog.getText(self, '带宽限制', '所有下载共享的总速度，例如 20M、512K，0 表示不限速；\n留空恢复配置文件中的设置和时段：', text=current)
+        if not ok:
+            return
+        try:
+            self.core.bandwidth.set_limit(text.strip() or None)
+        except ValueError as e:
+            QMessageBox.warning(self, '错误', str(e))
+
+    def show_bulk_sniff(self):
+        # 关闭窗口只是隐藏，嗅探在后台继续，再次打开时结果还在
+        if self.bulk_sniff_dialog is None:
+            self.bulk_sniff_dialog = BulkSniffDialog(self.core, self.download_queue, self)
+        self.bulk_sniff_dialog.show()
+        self.bulk_sniff_dialog.raise_()
+        self.bulk_sniff_dialog.activateWindow()
+
+    def show_archive(self):
+        ArchiveDialog(self.core, self).exec()
 
     def show_about(self):
         # 创建自定义的关于对话框
@@ -730,48 +1081,9 @@ class MainWindow(QMainWindow):
         about_box.setIcon(QMessageBox.Icon.Information)
         
         # 设置对话框的深色标题栏
-        try:
-            # 导入必要的模块
-            from ctypes import windll, c_int, byref, sizeof
-            
-            # 设置窗口属性
-            about_box.setAttribute(Qt.WidgetAttribute.WA_StyledBackground, True)
-            
-            # 等待对话框创建完成并获取窗口句柄
-            about_box.show()
-            hwnd = int(about_box.winId())
-            
-            # 设置深色模式
-            DWMWA_USE_IMMERSIVE_DARK_MODE = 20
-            dark_mode_value = c_int(2)  # 2表示启用深色模式
-            windll.dwmapi.DwmSetWindowAttribute(
-                hwnd, 
-                DWMWA_USE_IMMERSIVE_DARK_MODE, 
-                byref(dark_mode_value), 
-                sizeof(dark_mode_value)
-            )
-            
-            # 尝试设置标题栏颜色（仅适用于Windows 11 22H2及以上版本）
-            try:
-                # 设置标题栏颜色为深灰色 (#2b2b2b)
-                DWMWA_CAPTION_COLOR = 35
-                caption_color = c_int(0xFF2B2B2B)  # 完全不透明的深灰色
-                windll.dwmapi.DwmSetWindowAttribute(
-                    hwnd, 
-                    DWMWA_CAPTION_COLOR, 
-                    byref(caption_color), 
-                    sizeof(caption_color)
-                )
-            except Exception:
-                # 如果设置标题栏颜色失败，可能是因为系统版本不支持
-                pass
-                
-            # 隐藏对话框，稍后再显示（这样可以确保样式应用）
-            about_box.hide()
-        except Exception as e:
-            # 如果设置深色标题栏失败，记录错误但不影响程序运行
-            print(f"设置关于对话框深色标题栏失败: {e}")
-        
+        about_box.setAttribute(Qt.WidgetAttribute.WA_StyledBackground, True)
+        apply_dark_title_bar(about_box)
+
         # 设置对话框的样式表，使其与主窗口风格一致
         about_box.setStyleSheet("""
             QMessageBox {
@@ -809,10 +1121,9 @@ class MainWindow(QMainWindow):
                 QMessageBox.warning(self, '警告', '请输入Cookies内容')
                 return
             
-            with open(self.cookie_file, 'w', encoding='utf-8') as f:
-                f.write(cookie_content)
-            
-            self.manual_cookie_enabled = True
+            self.core.cookies.save_manual(cookie_content)
+
+            self.core.manual_cookie_enabled = True
             self.cookie_mode = 'file'
             self.cookie_container.hide()
             QMessageBox.information(self, '成功', 'Cookies已更新，请重新点击开始嗅探。')
@@ -850,7 +1161,17 @@ class MainWindow(QMainWindow):
         menu.exec(sender.mapToGlobal(pos))
 
     def closeEvent(self, event):
-        if (self.download_thread and self.download_thread.isRunning()) or (self.sniff_thread and self.sniff_thread.isRunning()):
+        # 更新中途退出时保留已下载的部分，下次更新从断点继续
+        if self.update_thread and self.update_thread.isRunning():
+            self.update_thread.stop()
+            self.update_thread.wait(3000)
+        # 后台预嗅探不算正在进行的操作，直接取消
+        if self.sniff_speculative:
+            self.cancel_sniff()
+        for thread in list(self.cancelled_sniff_threads):
+            thread.wait(1000)
+        playlist_running = self.playlist_thread and self.playlist_thread.isRunning()
+        if self.download_queue.has_active() or playlist_running or (self.sniff_thread and self.sniff_thread.isRunning()):
             operation = '嗅探' if self.is_sniffing else '下载'
             reply = QMessageBox.question(self, '确认', f'{operation}正在进行中，确定要退出吗？',
                                        QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
@@ -858,13 +1179,14 @@ class MainWindow(QMainWindow):
                 # 设置最大等待时间（毫秒）
                 max_wait_time = 3000
                 
-                # 终止下载线程
-                if self.download_thread and self.download_thread.isRunning():
-                    self.download_thread.stop()
-                    if not self.download_thread.wait(max_wait_time):
-                        self.download_thread.terminate()
-                        self.download_thread.wait(1000)  # 再给一秒确保完全终止
+                # 终止下载队列中的所有任务
+                self.download_queue.stop_all(max_wait_time / 1000)
                 
+                # 终止播放列表读取线程
+                if self.playlist_thread and self.playlist_thread.isRunning():
+                    self.playlist_thread.stop()
+                    self.playlist_thread.wait(max_wait_time)
+
                 # 终止嗅探线程
                 if self.sniff_thread and self.sniff_thread.isRunning():
                     self.sniff_thread.stop()
@@ -872,44 +1194,49 @@ class MainWindow(QMainWindow):
                         self.sniff_thread.terminate()
                         self.sniff_thread.wait(1000)  # 再给一秒确保完全终止
                 
-                # 终止所有相关的子进程
-                try:
-                    current_pid = os.getpid()
-                    subprocess.run(['taskkill', '/F', '/T', '/PID', str(current_pid)], 
-                                 creationflags=subprocess.CREATE_NO_WINDOW,
-                                 capture_output=True)
-                except Exception as e:
-                    print(f'终止进程时出错：{str(e)}')
-                
+                # 每个任务都在自己的进程组里，逐组结束残留的 yt-dlp 和 ffmpeg，不再结束自己的进程
+                self.core.supervisor.stop_all(1.0)
+
                 event.accept()
             else:
                 event.ignore()
 
+        if event.isAccepted():
+            # 批量嗅探只是在准备格式，退出时直接停止
+            if self.bulk_sniff_dialog:
+                self.bulk_sniff_dialog.pool.stop()
+            if self.api_server:
+                self.api_server.stop()
+
     def handle_url_change(self):
         # 清空格式选择框和相关状态
-        self.format_combo.clear()
-        self.format_id_map.clear()
+        self.clear_formats()
         self.cookie_mode = 'none'
         self.cookie_container.hide()
         self.download_button.setText('开始嗅探')
         self.progress_text.setText('准备就绪')
-        
-        # 如果正在进行嗅探或下载，停止它们
-        if self.sniff_thread and self.sniff_thread.isRunning():
-            self.sniff_thread.stop()
-            self.sniff_thread.wait(1000)
-        
-        if self.download_thread and self.download_thread.isRunning():
-            self.download_thread.stop()
-            self.download_thread.wait(1000)
-        
+
+        # 如果正在进行嗅探，停止它（下载队列不受影响）
+        self.cancel_sniff()
         self.download_button.setEnabled(True)
-        self.is_sniffing = False
+
+        # 每次输入都重新计时，停顿后再查缓存或预嗅探
+        self.url_timer.start()
+
+def report_startup(window, startup_timer):
+    startup_timer.mark('首帧')
+    budget_ms = float(window.core.settings['startup_budget_ms'])
+    if os.environ.get('YT_DLP_GUI_PROFILE_STARTUP') or startup_timer.total() * 1000 > budget_ms:
+        print(f'启动耗时 {startup_timer.report()}，预算 {budget_ms:.0f}ms', file=sys.stderr)
+
 
 def main():
+    startup_timer = PhaseTimer(STARTUP_START)
+    startup_timer.mark('导入')
     try:
         # 首先初始化QApplication，确保在使用任何Qt组件前完成初始化
         app = QApplication(sys.argv)
+        startup_timer.mark('QApplication')
         # 修改应用程序图标
         try:
             if getattr(sys, 'frozen', False):
@@ -950,106 +1277,9 @@ def main():
         app.setPalette(dark_palette)
         
         # 设置深色主题样式表
-        app.setStyleSheet("""
-            QMainWindow, QWidget { 
-                background-color: #2b2b2b; 
-                color: #ffffff; 
-            }
-            /* 标题栏样式 */
-            QMainWindow::title {
-                background-color: #2b2b2b;
-                color: #ffffff;
-            }
-            QMainWindow::titleBar {
-                background-color: #2b2b2b;
-                color: #ffffff;
-            }
-            QTitleBar {
-                background-color: #2b2b2b;
-                color: #ffffff;
-            }
-            QMenuBar { 
-                background-color: #2b2b2b; 
-                color: #ffffff; 
-                border-bottom: 1px solid #555555;
-            }
-            QMenuBar::item {
-                background-color: transparent;
-                padding: 4px 8px;
-            }
-            QMenuBar::item:selected {
-                background-color: #3b3b3b;
-                border-radius: 3px;
-            }
-            QMenuBar::item:pressed {
-                background-color: #4b4b4b;
-            }
-            QMenu {
-                background-color: #2b2b2b;
-                border: 1px solid #555555;
-            }
-            QMenu::item {
-                padding: 5px 30px 5px 20px;
-                border: 1px solid transparent;
-            }
-            QMenu::item:selected {
-                background-color: #3b3b3b;
-            }
-            QLineEdit, QComboBox { 
-                background-color: #3b3b3b; 
-                border: 1px solid #555555; 
-                padding: 5px; 
-                border-radius: 3px; 
-            }
-            QPushButton { 
-                background-color: #3b3b3b; 
-                border: 1px solid #555555; 
-                padding: 5px 10px; 
-                border-radius: 3px; 
-            }
-            QPushButton:hover { 
-                background-color: #4b4b4b; 
-                border-color: #666666; 
-            }
-            QPushButton:pressed { 
-                background-color: #2b2b2b; 
-                border-color: #777777; 
-            }
-            QPushButton:disabled { 
-                background-color: #2b2b2b; 
-                color: #666666; 
-                border-color: #444444; 
-            }
-            QComboBox:drop-down { 
-                border: none; 
-                width: 20px; 
-            }
-            QComboBox:down-arrow { 
-                image: none; 
-            }
-            QComboBox QAbstractItemView { 
-                background-color: #3b3b3b; 
-                selection-background-color: #4b4b4b; 
-                border: 1px solid #555555; 
-            }
-            QMenuBar { 
-                background-color: #2b2b2b; 
-                color: #ffffff; 
-                border-bottom: 1px solid #555555; 
-            }
-            QMenuBar::item:selected, QMenu::item:selected { 
-                background-color: #3b3b3b; 
-            }
-            QMenu { 
-                background-color: #2b2b2b; 
-                border: 1px solid #555555; 
-                padding: 5px 0px; 
-            }
-            QMenu::item { 
-                padding: 5px 20px; 
-            }
-        """)
-        
+        app.setStyleSheet(DARK_STYLESHEET)
+        startup_timer.mark('主题')
+
         # 创建DLL目录
         dll_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dll')
         os.makedirs(dll_dir, exist_ok=True)
@@ -1061,7 +1291,11 @@ def main():
                             dll_dir + os.pathsep + os.environ.get('PATH', '')
 
         window = MainWindow()
+        startup_timer.mark('主窗口')
         window.show()
+        startup_timer.mark('显示')
+        # 事件循环处理完第一批事件（首帧绘制）后记录可交互时间
+        QTimer.singleShot(0, lambda: report_startup(window, startup_timer))
         sys.exit(app.exec())
     except Exception as e:
         error_msg = f'程序启动失败：{str(e)}'